@@ -15,6 +15,7 @@ export function AdminPanel() {
   const [telegramApiId, setTelegramApiId] = useState("");
   const [telegramApiHash, setTelegramApiHash] = useState("");
   const [telegramPhone, setTelegramPhone] = useState("");
+  const [additionalPhones, setAdditionalPhones] = useState("");
   const [openaiApiKey, setOpenaiApiKey] = useState("");
   const [channels, setChannels] = useState("");
   const [promptTemplate, setPromptTemplate] = useState("");
@@ -25,6 +26,7 @@ export function AdminPanel() {
     telegramApiId: string;
     telegramApiHash: string;
     telegramPhone: string;
+    additionalPhones?: string[];
     openaiApiKey: string;
     channels: string[];
     hasApiKeys: boolean;
@@ -41,6 +43,7 @@ export function AdminPanel() {
     telegramApiId: string;
     telegramApiHash: string;
     telegramPhone: string;
+    additionalPhones?: string[];
     openaiApiKey: string;
     channels: string[];
     promptTemplate: string;
@@ -81,10 +84,11 @@ export function AdminPanel() {
 
   // Save configuration
   const saveConfigMutation = useMutation({
-    mutationFn: async ({ telegramApiId, telegramApiHash, telegramPhone, openaiApiKey, channels, promptTemplate, timeWindowMinutes }: { 
+    mutationFn: async ({ telegramApiId, telegramApiHash, telegramPhone, additionalPhones, openaiApiKey, channels, promptTemplate, timeWindowMinutes }: { 
       telegramApiId: string; 
       telegramApiHash: string; 
       telegramPhone: string; 
+      additionalPhones: string[];
       openaiApiKey: string; 
       channels: string[];
       promptTemplate: string;
@@ -94,6 +98,7 @@ export function AdminPanel() {
         telegramApiId,
         telegramApiHash,
         telegramPhone,
+        additionalPhones,
         openaiApiKey,
         channels,
         promptTemplate,
@@ -147,11 +152,17 @@ export function AdminPanel() {
       return;
     }
 
+    const phoneList = additionalPhones
+      .split("\n")
+      .map((phone) => phone.trim())
+      .filter((phone) => phone.length > 0);
+
     // Save all configuration values
     saveConfigMutation.mutate({
       telegramApiId,
       telegramApiHash,
       telegramPhone,
+      additionalPhones: phoneList,
       openaiApiKey,
       channels: channelList,
       promptTemplate,
@@ -166,6 +177,7 @@ export function AdminPanel() {
       setTelegramApiId(configuration.telegramApiId || "");
       setTelegramApiHash(configuration.telegramApiHash || "");
       setTelegramPhone(configuration.telegramPhone || "");
+      setAdditionalPhones(configuration.additionalPhones ? configuration.additionalPhones.join("\n") : "");
       setOpenaiApiKey(configuration.openaiApiKey || "");
       setChannels(configuration.channels ? configuration.channels.join("\n") : "");
       setPromptTemplate(configuration.promptTemplate || "Analyze the following Telegram messages and generate a concise report finding the main topics of discussion and writing a short briefing for each one, no bullets or lists.");
@@ -177,6 +189,7 @@ export function AdminPanel() {
       setTelegramApiId(envConfig.telegramApiId);
       setTelegramApiHash(envConfig.telegramApiHash);
       setTelegramPhone(envConfig.telegramPhone);
+      setAdditionalPhones(envConfig.additionalPhones ? envConfig.additionalPhones.join("\n") : "");
       setOpenaiApiKey(envConfig.openaiApiKey);
       setChannels(envConfig.channels.join("\n"));
       setPromptTemplate(envConfig.promptTemplate);
@@ -274,6 +287,20 @@ export function AdminPanel() {
                       onChange={(e) => setTelegramPhone(e.target.value)}
                     />
                   </div>
+
+                  <div>
+                    <Label htmlFor="telegram-additional-phones">Teléfonos adicionales (opcional)</Label>
+                    <Textarea
+                      id="telegram-additional-phones"
+                      rows={3}
+                      placeholder={"+1234567891\n+1234567892"}
+                      value={additionalPhones}
+                      onChange={(e) => setAdditionalPhones(e.target.value)}
+                    />
+                    <p className="text-sm text-gray-500 mt-1">
+                      Uno por línea. Los canales se reparten entre todas las cuentas autenticadas.
+                    </p>
+                  </div>
                 </div>
               </div>
             </div>
@@ -340,14 +367,6 @@ export function AdminPanel() {
                 onChange={(e) => setChannels(e.target.value)}
                 rows={6}
               />
-              {channels.split('\n').filter(c => c.trim()).length > 20 && (
-                <Alert>
-                  <Info className="h-4 w-4" />
-                  <AlertDescription>
-                    Advertencia: Tienes más de 20 canales. El sistema procesará solo los primeros 20 para evitar timeouts.
-                  </AlertDescription>
-                </Alert>
-              )}
             </div>
           </div>
         </CardContent>
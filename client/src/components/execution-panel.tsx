@@ -42,11 +42,10 @@ export function ExecutionPanel() {
     queryKey: ["/api/analysis"],
   });
 
-  // Get current analysis status (when processing)
-  const { data: currentAnalysis, refetch: refetchCurrentAnalysis } = useQuery<AnalysisResult | null>({
+  // Get current analysis status (when processing); later updates arrive over the event stream
+  const { data: currentAnalysis } = useQuery<AnalysisResult | null>({
     queryKey: ["/api/analysis", currentAnalysisId],
     enabled: !!currentAnalysisId,
-    refetchInterval: isProcessing ? 1000 : false, // More frequent updates (1 second)
     refetchOnWindowFocus: false,
     retry: 3,
   });
@@ -105,16 +104,24 @@ export function ExecutionPanel() {
     }
   }, [currentAnalysis, toast]);
 
-  // Force refresh every 2 seconds when processing
+  // Follow progress over Server-Sent Events instead of polling; the browser reconnects on its own
   useEffect(() => {
     if (isProcessing && currentAnalysisId) {
-      const interval = setInterval(() => {
-        refetchCurrentAnalysis();
-      }, 2000);
+      const source = new EventSource(`/api/analysis/${currentAnalysisId}/events`);
+      source.onmessage = (event) => {
+        const progress = JSON.parse(event.data);
+        queryClient.setQueryData<AnalysisResult | null>(
+          ["/api/analysis", currentAnalysisId],
+          (previous) => ({ ...previous, ...progress }),
+        );
+        if (progress.status === "completed" || progress.status === "failed") {
+          source.close();
+        }
+      };
       
-      return () => clearInterval(interval);
+      return () => source.close();
     }
-  }, [isProcessing, currentAnalysisId, refetchCurrentAnalysis]);
+  }, [isProcessing, currentAnalysisId]);
 
   const handleStartAnalysis = () => {
     if (!configuration?.hasApiKeys) {
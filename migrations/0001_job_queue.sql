@@ -0,0 +1,15 @@
+CREATE TABLE "jobs" (
+	"id" serial PRIMARY KEY NOT NULL,
+	"type" text NOT NULL,
+	"dedup_key" text NOT NULL,
+	"payload" jsonb NOT NULL,
+	"status" text DEFAULT 'pending' NOT NULL,
+	"attempts" integer DEFAULT 0 NOT NULL,
+	"error" text,
+	"created_at" timestamp DEFAULT now(),
+	"started_at" timestamp,
+	"completed_at" timestamp
+);
+--> statement-breakpoint
+CREATE INDEX "jobs_status_idx" ON "jobs" USING btree ("status");--> statement-breakpoint
+CREATE INDEX "jobs_dedup_key_idx" ON "jobs" USING btree ("dedup_key");
\ No newline at end of file
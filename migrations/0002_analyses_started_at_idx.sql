@@ -0,0 +1 @@
+CREATE INDEX "analyses_started_at_idx" ON "analyses" USING btree ("started_at","id");
\ No newline at end of file
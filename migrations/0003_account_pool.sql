@@ -0,0 +1 @@
+ALTER TABLE "configurations" ADD COLUMN "additional_phones" text[] DEFAULT '{}' NOT NULL;
\ No newline at end of file
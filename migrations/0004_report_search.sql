@@ -0,0 +1 @@
+CREATE INDEX "analyses_report_search_idx" ON "analyses" USING gin ((setweight(to_tsvector('simple', coalesce(jsonb_path_query_array(report, '$.topics[*].topic')::text, '')), 'A') || setweight(to_tsvector('simple', coalesce(jsonb_path_query_array(report, '$.topics[*].briefing')::text, '')), 'B')));
\ No newline at end of file
@@ -0,0 +1,4 @@
+UPDATE "jobs" SET "status" = 'failed', "error" = 'Duplicate of an identical job', "completed_at" = now() WHERE "status" IN ('pending', 'running') AND "id" NOT IN (SELECT min("id") FROM "jobs" WHERE "status" IN ('pending', 'running') GROUP BY "dedup_key");--> statement-breakpoint
+UPDATE "analyses" SET "status" = 'failed', "error" = 'Superseded by an identical analysis', "completed_at" = now() WHERE "status" = 'pending' AND NOT EXISTS (SELECT 1 FROM "jobs" WHERE "jobs"."status" IN ('pending', 'running') AND ("jobs"."payload"->>'analysisId')::int = "analyses"."id");--> statement-breakpoint
+DROP INDEX "jobs_dedup_key_idx";--> statement-breakpoint
+CREATE UNIQUE INDEX "jobs_active_dedup_key_idx" ON "jobs" USING btree ("dedup_key") WHERE "jobs"."status" in ('pending', 'running');
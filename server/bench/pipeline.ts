@@ -0,0 +1,380 @@
+/**
+ * End-to-end pipeline benchmark.
+ *
+ * Starts the real server against the Telegram simulator (TELEGRAM_SIMULATOR) and
+ * a local mock of the OpenAI chat completions API, then drives
+ * /api/analysis/start for each channel count and records per-stage latency,
+ * throughput, peak memory of the Node and Python processes and prompt tokens.
+ *
+ *   npm run bench -- --channels 20,100,500 --iterations 5 --openai-latency 800
+ *
+ * Results are written as JSON (default bench-results/<commit>-<time>.json) so
+ * runs from different versions can be compared.
+ */
+import { spawn, execSync, type ChildProcess } from "child_process";
+import { createServer, type Server } from "http";
+import fs from "fs";
+import path from "path";
+
+interface Options {
+  channels: number[];
+  iterations: number;
+  minutes: number;
+  port: number;
+  openaiLatencyMs: number;
+  openaiMsPer1kTokens: number;
+  simulator: string;
+  out: string;
+  keepArchive: boolean;
+}
+
+interface StageTimes {
+  queueMs: number;
+  collectMs: number;
+  processMs: number;
+  analyzeMs: number;
+  totalMs: number;
+}
+
+interface RunResult extends StageTimes {
+  iteration: number;
+  status: string;
+  error?: string;
+  messages: number;
+  messagesPerSecond: number;
+  openaiRequests: number;
+  promptTokens: number;
+}
+
+const POLL_INTERVAL_MS = 50;
+const RUN_TIMEOUT_MS = 20 * 60 * 1000;
+const SERVICES_DIR = path.resolve("server/services");
+
+function parseArgs(argv: string[]): Options {
+  const args = new Map<string, string>();
+  for (let i = 0; i < argv.length; i++) {
+    if (argv[i].startsWith("--")) {
+      const next = argv[i + 1];
+      const hasValue = next !== undefined && !next.startsWith("--");
+      args.set(argv[i].slice(2), hasValue ? next : "true");
+      if (hasValue) i++;
+    }
+  }
+
+  const commit = gitCommit();
+  return {
+    channels: (args.get("channels") || "20,100,500").split(",").map(n => parseInt(n, 10)),
+    iterations: parseInt(args.get("iterations") || "5", 10),
+    minutes: parseInt(args.get("minutes") || "60", 10),
+    port: parseInt(args.get("port") || "5055", 10),
+    openaiLatencyMs: parseInt(args.get("openai-latency") || "800", 10),
+    openaiMsPer1kTokens: parseInt(args.get("openai-ms-per-1k-tokens") || "20", 10),
+    simulator: args.get("simulator") || "seed=1,latency=50",
+    out: args.get("out") || `bench-results/${commit}-${new Date().toISOString().replace(/[:.]/g, "-")}.json`,
+    keepArchive: args.get("keep-archive") === "true",
+  };
+}
+
+function gitCommit(): string {
+  try {
+    return execSync("git rev-parse --short HEAD", { stdio: ["ignore", "pipe", "ignore"] }).toString().trim();
+  } catch {
+    return "unknown";
+  }
+}
+
+function percentile(values: number[], p: number): number {
+  if (values.length === 0) return 0;
+  const sorted = [...values].sort((a, b) => a - b);
+  const index = Math.min(sorted.length - 1, Math.ceil((p / 100) * sorted.length) - 1);
+  return sorted[Math.max(0, index)];
+}
+
+function summarize(values: number[]) {
+  return {
+    p50: percentile(values, 50),
+    p95: percentile(values, 95),
+    p99: percentile(values, 99),
+    max: Math.max(0, ...values),
+  };
+}
+
+/**
+ * Minimal stand-in for POST /v1/chat/completions. Answers after a fixed latency
+ * plus a per-token cost and counts the prompt tokens it was sent.
+ */
+class MockOpenAI {
+  requests = 0;
+  promptTokens = 0;
+  private server: Server;
+
+  constructor(private latencyMs: number, private msPer1kTokens: number) {
+    this.server = createServer((req, res) => {
+      let body = "";
+      req.on("data", chunk => body += chunk);
+      req.on("end", () => {
+        const request = JSON.parse(body || "{}");
+        const prompt = (request.messages || []).map((m: any) => m.content).join("\n");
+        // Same ~4 characters per token estimate the service budgets with
+        const tokens = Math.ceil(prompt.length / 4);
+        this.requests++;
+        this.promptTokens += tokens;
+
+        const content = JSON.stringify({
+          topics: [
+            { topic: "Simulated topic", briefing: `Summary of ${tokens} prompt tokens.` },
+            { topic: "Second simulated topic", briefing: "Another briefing." },
+          ],
+        });
+        setTimeout(() => {
+          res.writeHead(200, { "Content-Type": "application/json" });
+          res.end(JSON.stringify({
+            id: `chatcmpl-bench-${this.requests}`,
+            object: "chat.completion",
+            created: Math.floor(Date.now() / 1000),
+            model: request.model,
+            choices: [{ index: 0, message: { role: "assistant", content }, finish_reason: "stop" }],
+            usage: { prompt_tokens: tokens, completion_tokens: 50, total_tokens: tokens + 50 },
+          }));
+        }, this.latencyMs + (tokens / 1000) * this.msPer1kTokens);
+      });
+    });
+  }
+
+  listen(): Promise<number> {
+    return new Promise(resolve => {
+      this.server.listen(0, "127.0.0.1", () => {
+        const address = this.server.address();
+        resolve(typeof address === "object" && address ? address.port : 0);
+      });
+    });
+  }
+
+  close() {
+    this.server.close();
+  }
+}
+
+class ApiClient {
+  private cookie = "";
+
+  constructor(private baseUrl: string) {}
+
+  async request(method: string, url: string, body?: unknown): Promise<any> {
+    const response = await fetch(this.baseUrl + url, {
+      method,
+      headers: { "Content-Type": "application/json", ...(this.cookie ? { Cookie: this.cookie } : {}) },
+      body: body === undefined ? undefined : JSON.stringify(body),
+    });
+    const setCookie = response.headers.get("set-cookie");
+    if (setCookie) {
+      this.cookie = setCookie.split(";")[0];
+    }
+    const text = await response.text();
+    if (!response.ok) {
+      throw new Error(`${method} ${url} failed with ${response.status}: ${text}`);
+    }
+    return text ? JSON.parse(text) : null;
+  }
+}
+
+// Peak resident set size (VmHWM) of a process and all its descendants, by command line
+function peakRss(rootPid: number): { node: number; collector: number } {
+  const peak = { node: 0, collector: 0 };
+  if (!fs.existsSync("/proc")) return peak;
+
+  const children = new Map<number, number[]>();
+  for (const entry of fs.readdirSync("/proc")) {
+    if (!/^\d+$/.test(entry)) continue;
+    try {
+      const stat = fs.readFileSync(`/proc/${entry}/stat`, "utf8");
+      const ppid = parseInt(stat.slice(stat.lastIndexOf(")") + 2).split(" ")[1], 10);
+      children.set(ppid, [...(children.get(ppid) || []), parseInt(entry, 10)]);
+    } catch {
+      // Process exited while scanning
+    }
+  }
+
+  const visit = (pid: number) => {
+    try {
+      const cmdline = fs.readFileSync(`/proc/${pid}/cmdline`, "utf8");
+      const status = fs.readFileSync(`/proc/${pid}/status`, "utf8");
+      const hwm = parseInt(status.match(/VmHWM:\s+(\d+)/)?.[1] || "0", 10) * 1024;
+      if (cmdline.includes("telegram_collector.py")) {
+        peak.collector = Math.max(peak.collector, hwm);
+      } else if (cmdline.includes("node")) {
+        peak.node = Math.max(peak.node, hwm);
+      }
+    } catch {
+      // Process exited while scanning
+    }
+    (children.get(pid) || []).forEach(visit);
+  };
+  visit(rootPid);
+  return peak;
+}
+
+async function waitForServer(api: ApiClient, server: ChildProcess) {
+  const deadline = Date.now() + 120000;
+  while (Date.now() < deadline) {
+    if (server.exitCode !== null) {
+      throw new Error(`Server exited with code ${server.exitCode}`);
+    }
+    try {
+      await api.request("GET", "/api/statistics");
+      return;
+    } catch {
+      await new Promise(resolve => setTimeout(resolve, 500));
+    }
+  }
+  throw new Error("Server did not start within 120 seconds");
+}
+
+/**
+ * Start one analysis and follow it by polling, timing each stage from the
+ * step transitions processAnalysis reports.
+ */
+async function runAnalysis(api: ApiClient, openai: MockOpenAI, iteration: number): Promise<RunResult> {
+  const requestsBefore = openai.requests;
+  const tokensBefore = openai.promptTokens;
+  const started = Date.now();
+  const analysis = await api.request("POST", "/api/analysis/start");
+
+  const marks: Record<string, number> = {};
+  let current = analysis;
+  while (current.status !== "completed" && current.status !== "failed") {
+    if (Date.now() - started > RUN_TIMEOUT_MS) {
+      throw new Error(`Analysis ${analysis.id} did not finish within ${RUN_TIMEOUT_MS / 60000} minutes`);
+    }
+    await new Promise(resolve => setTimeout(resolve, POLL_INTERVAL_MS));
+    current = await api.request("GET", `/api/analysis/${analysis.id}`);
+    const now = Date.now();
+    if (current.status === "processing") marks.processing ??= now;
+    if (current.progress >= 20) marks.collect ??= now;
+    if (current.progress >= 50) marks.process ??= now;
+    if (current.progress >= 70) marks.analyze ??= now;
+    if (current.progress >= 90) marks.report ??= now;
+  }
+  const finished = Date.now();
+
+  // A stage that finished between two polls is attributed to the next one seen
+  const at = (name: string, fallback: number) => marks[name] ?? fallback;
+  const collectMs = at("process", finished) - at("collect", finished);
+  const messages = current.messagesCollected || 0;
+  return {
+    iteration,
+    status: current.status,
+    error: current.error || undefined,
+    queueMs: at("processing", finished) - started,
+    collectMs,
+    processMs: at("analyze", finished) - at("process", finished),
+    analyzeMs: at("report", finished) - at("analyze", finished),
+    totalMs: finished - started,
+    messages,
+    messagesPerSecond: collectMs > 0 ? Math.round((messages / collectMs) * 1000) : 0,
+    openaiRequests: openai.requests - requestsBefore,
+    promptTokens: openai.promptTokens - tokensBefore,
+  };
+}
+
+function summarizeRuns(runs: RunResult[]) {
+  const stages: (keyof StageTimes)[] = ["queueMs", "collectMs", "processMs", "analyzeMs", "totalMs"];
+  return {
+    ...Object.fromEntries(stages.map(stage => [stage, summarize(runs.map(run => run[stage]))])),
+    messagesPerSecond: summarize(runs.map(run => run.messagesPerSecond)),
+    promptTokens: summarize(runs.map(run => run.promptTokens)),
+  };
+}
+
+function removeSimulatedArchives() {
+  for (const file of fs.readdirSync(SERVICES_DIR)) {
+    if (file.startsWith("simulated_") && /\.(entities|messages)\.db(-wal|-shm)?$/.test(file)) {
+      fs.rmSync(path.join(SERVICES_DIR, file));
+    }
+  }
+}
+
+async function main() {
+  const options = parseArgs(process.argv.slice(2));
+  if (!options.keepArchive) {
+    removeSimulatedArchives();
+  }
+
+  const openai = new MockOpenAI(options.openaiLatencyMs, options.openaiMsPer1kTokens);
+  const openaiPort = await openai.listen();
+
+  // Without DATABASE_URL the server keeps everything in memory, so runs don't touch real data
+  const env: NodeJS.ProcessEnv = {
+    ...process.env,
+    NODE_ENV: "development",
+    PORT: String(options.port),
+    TELEGRAM_SIMULATOR: options.simulator,
+    OPENAI_BASE_URL: `http://127.0.0.1:${openaiPort}/v1`,
+  };
+  delete env.DATABASE_URL;
+  // Own process group so the server and everything it spawns can be stopped together
+  const server = spawn("npx", ["tsx", "server/index.ts"], { env, stdio: ["ignore", "pipe", "pipe"], detached: true });
+  fs.mkdirSync(path.dirname(options.out), { recursive: true });
+  const serverLog = fs.createWriteStream(options.out.replace(/\.json$/, ".server.log"), { flags: "w" });
+  server.stdout?.pipe(serverLog);
+  server.stderr?.pipe(serverLog);
+
+  const api = new ApiClient(`http://127.0.0.1:${options.port}`);
+  const scenarios: any[] = [];
+  try {
+    await waitForServer(api, server);
+    const credentials = { username: "bench", password: "bench" };
+    await api.request("POST", "/api/auth/setup", credentials).catch(() => {});
+    await api.request("POST", "/api/auth/login", credentials);
+
+    for (const channelCount of options.channels) {
+      const channels = Array.from({ length: channelCount }, (_, i) => `@sim_${String(i).padStart(5, "0")}`);
+      await api.request("POST", "/api/configuration", {
+        telegramApiId: "12345",
+        telegramApiHash: "0123456789abcdef0123456789abcdef",
+        telegramPhone: "+10000000000",
+        openaiApiKey: "sk-bench",
+        channels,
+        promptTemplate: "Summarize the main topics of these messages.",
+        timeWindowMinutes: options.minutes,
+      });
+
+      const runs: RunResult[] = [];
+      for (let iteration = 0; iteration < options.iterations; iteration++) {
+        const run = await runAnalysis(api, openai, iteration);
+        runs.push(run);
+        console.log(`${channelCount} channels #${iteration}: ${run.status} in ${run.totalMs}ms ` +
+          `(collect ${run.collectMs}ms, analyze ${run.analyzeMs}ms, ${run.messages} messages, ${run.promptTokens} prompt tokens)`);
+      }
+
+      // The first run fills the archive and LLM cache; later runs show the steady state
+      scenarios.push({
+        channels: channelCount,
+        cold: runs[0],
+        warm: runs.length > 1 ? summarizeRuns(runs.slice(1)) : null,
+        all: summarizeRuns(runs),
+        runs,
+      });
+    }
+
+    const result = {
+      commit: gitCommit(),
+      date: new Date().toISOString(),
+      options,
+      peakRssBytes: server.pid ? peakRss(server.pid) : null,
+      scenarios,
+    };
+    fs.writeFileSync(options.out, JSON.stringify(result, null, 2));
+    console.log(`Results written to ${options.out}`);
+  } finally {
+    if (server.pid) {
+      process.kill(-server.pid, "SIGTERM");
+    }
+    openai.close();
+  }
+}
+
+main().catch(error => {
+  console.error("Benchmark failed:", error);
+  process.exit(1);
+});
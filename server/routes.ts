@@ -1,11 +1,62 @@
 import type { Express } from "express";
 import { createServer, type Server } from "http";
 import { storage } from "./storage";
-import { insertConfigurationSchema, insertAnalysisSchema, loginSchema, insertUserSchema } from "@shared/schema";
+import { insertConfigurationSchema, insertAnalysisSchema, loginSchema, insertUserSchema, type Analysis } from "@shared/schema";
 import { TelegramService } from "./services/telegram";
+import { CollectorError, UNSUPPORTED_CODE } from "./services/collector";
+import { streamExport, analysisRow, messageRow, ANALYSIS_COLUMNS, EXPORT_FORMATS, MESSAGE_COLUMNS, type ExportFormat } from "./services/export";
 import { OpenAIService } from "./services/openai";
+import { JobQueue, withTimeout } from "./services/job-queue";
+import { LLMCache } from "./services/llm-cache";
+import { analysisStageDuration, registry } from "./services/metrics";
+import { ProgressHub, isTerminal } from "./services/progress-hub";
 import bcrypt from "bcryptjs";
 
+// Per-stage limits so a stuck stage fails the analysis instead of holding a worker forever
+const COLLECT_TIMEOUT_MS = 10 * 60 * 1000;
+const ANALYZE_TIMEOUT_MS = 5 * 60 * 1000;
+
+const HISTORY_PAGE_SIZE = 50;
+const HISTORY_MAX_PAGE_SIZE = 200;
+
+const SEARCH_DEFAULT_RESULTS = 20;
+const SEARCH_MAX_RESULTS = 100;
+
+// Analyses (with their reports) per export page
+const EXPORT_ANALYSES_PAGE_SIZE = 200;
+
+// SSE keep-alive so proxies don't close idle progress streams
+const SSE_HEARTBEAT_MS = 15000;
+
+const progressHub = new ProgressHub(storage);
+
+const jobQueue = new JobQueue(storage, {
+  analysis: async (job, signal) => {
+    const { analysisId } = job.payload as { analysisId: number };
+    if (job.createdAt) {
+      analysisStageDuration.observe({ stage: "queue" }, (Date.now() - job.createdAt.getTime()) / 1000);
+    }
+    const analysis = await storage.getAnalysis(analysisId);
+    if (analysis) {
+      progressHub.track(analysis);
+    }
+    const config = await storage.getConfiguration();
+    if (!config) {
+      throw new Error("No configuration found");
+    }
+    await analysisStageDuration.time({ stage: "total" }, () => processAnalysis(analysisId, config, signal));
+  },
+}, {
+  onFailure: async (job, error) => {
+    const { analysisId } = job.payload as { analysisId: number };
+    await progressHub.update(analysisId, {
+      status: "failed",
+      error: error.message,
+      completedAt: new Date(),
+    });
+  },
+});
+
 // Extend Express Request type to include session
 declare module 'express-session' {
   interface SessionData {
@@ -24,6 +75,17 @@ function requireAuth(req: any, res: any, next: any) {
 
 export async function registerRoutes(app: Express): Promise<Server> {
   
+  // Warm up the Telegram collector and start listening so analyses read a pushed window
+  storage.getConfiguration().then(config => {
+    if (config?.telegramApiId && config.telegramApiHash && config.telegramPhone) {
+      new TelegramService(config.telegramApiId, config.telegramApiHash, config.telegramPhone, config.additionalPhones).warmUp();
+      listenToChannels(config);
+    }
+  }).catch(error => console.error("Failed to warm up Telegram collector:", error));
+  
+  // Resume analyses interrupted by a restart and start the workers
+  jobQueue.start().catch(error => console.error("Failed to start job queue:", error));
+  
   // Authentication routes
   app.post("/api/auth/login", async (req, res) => {
     try {
@@ -139,6 +201,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
           telegramApiId: process.env.TELEGRAM_API_ID,
           telegramApiHash: process.env.TELEGRAM_API_HASH,
           telegramPhone: process.env.TELEGRAM_PHONE,
+          additionalPhones: envAdditionalPhones(),
           openaiApiKey: process.env.OPENAI_API_KEY,
           channels: ["@Slavyangrad", "@TheIslanderNews"],
           promptTemplate: "Analyze the following Telegram messages and generate a concise report finding the main topics of discussion and writing a short briefing for each one, no bullets or lists.",
@@ -156,6 +219,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
         telegramApiId: config.telegramApiId,
         telegramApiHash: config.telegramApiHash,
         telegramPhone: config.telegramPhone,
+        additionalPhones: config.additionalPhones,
         openaiApiKey: config.openaiApiKey,
         channels: config.channels,
         hasApiKeys: !!(config.telegramApiId && config.telegramApiHash && config.telegramPhone && config.openaiApiKey),
@@ -186,6 +250,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
           telegramApiId: process.env.TELEGRAM_API_ID,
           telegramApiHash: process.env.TELEGRAM_API_HASH,
           telegramPhone: process.env.TELEGRAM_PHONE,
+          additionalPhones: envAdditionalPhones(),
           openaiApiKey: process.env.OPENAI_API_KEY,
           channels: ["@Slavyangrad", "@TheIslanderNews"],
           promptTemplate: "Analyze the following Telegram messages and generate a concise intelligence report. Focus on key topics, events, and significant developments. Provide clear, factual briefings without sentiment analysis.",
@@ -213,6 +278,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
         telegramApiId: config.telegramApiId ? `${config.telegramApiId.substring(0, 4)}...${config.telegramApiId.slice(-4)}` : "Not set",
         telegramApiHash: config.telegramApiHash ? `${config.telegramApiHash.substring(0, 8)}...${config.telegramApiHash.slice(-8)}` : "Not set",
         telegramPhone: config.telegramPhone || "Not set",
+        additionalPhones: config.additionalPhones,
         openaiApiKey: config.openaiApiKey ? `${config.openaiApiKey.substring(0, 8)}...${config.openaiApiKey.slice(-8)}` : "Not set",
         channels: config.channels,
         promptTemplate: config.promptTemplate?.substring(0, 100) + "..." || "Not set",
@@ -257,6 +323,8 @@ export async function registerRoutes(app: Express): Promise<Server> {
         activeChannels: config.channels.length,
       });
       
+      listenToChannels(config);
+      
       res.json({ 
         id: config.id,
         channels: config.channels,
@@ -287,7 +355,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
       
       console.log("Testing connections with stored configuration...");
       
-      const telegramService = new TelegramService(config.telegramApiId, config.telegramApiHash, config.telegramPhone);
+      const telegramService = new TelegramService(config.telegramApiId, config.telegramApiHash, config.telegramPhone, config.additionalPhones);
       const openaiService = new OpenAIService(config.openaiApiKey);
       
       const [telegramTest, openaiTest] = await Promise.all([
@@ -336,17 +404,29 @@ export async function registerRoutes(app: Express): Promise<Server> {
         return res.status(400).json({ message: "No channels configured" });
       }
       
-      const analysis = await storage.createAnalysis({ configId: config.id });
+      // Identical requests while one is queued or running share that analysis
+      const dedupKey = LLMCache.key(
+        String(config.id),
+        JSON.stringify(config.channels),
+        String(config.timeWindowMinutes),
+        config.promptTemplate,
+      );
+      const activeJob = await storage.getActiveJob(dedupKey);
+      if (activeJob) {
+        const existing = await storage.getAnalysis((activeJob.payload as { analysisId: number }).analysisId);
+        if (existing) {
+          return res.json(existing);
+        }
+      }
       
-      // Start the analysis process asynchronously
-      processAnalysis(analysis.id, config).catch(error => {
-        console.error("Analysis process failed:", error);
-        storage.updateAnalysis(analysis.id, {
-          status: "failed",
-          error: error.message,
-          completedAt: new Date(),
-        });
-      });
+      const analysis = await storage.createAnalysis({ configId: config.id });
+      const { job, created } = await jobQueue.enqueue("analysis", dedupKey, { analysisId: analysis.id, configId: config.id });
+      if (!created) {
+        // A concurrent identical request queued its analysis first: share it and drop ours, which no job would run
+        await storage.deleteAnalysis(analysis.id);
+        return res.json(await storage.getAnalysis((job.payload as { analysisId: number }).analysisId));
+      }
+      progressHub.track(analysis);
       
       res.json(analysis);
     } catch (error) {
@@ -358,7 +438,8 @@ export async function registerRoutes(app: Express): Promise<Server> {
   app.get("/api/analysis/:id", async (req, res) => {
     try {
       const id = parseInt(req.params.id);
-      const analysis = await storage.getAnalysis(id);
+      // Running analyses are answered from memory; storage lags behind by design
+      const analysis = progressHub.get(id) || await storage.getAnalysis(id);
       
       if (!analysis) {
         return res.status(404).json({ message: "Analysis not found" });
@@ -370,6 +451,52 @@ export async function registerRoutes(app: Express): Promise<Server> {
     }
   });
 
+  // Stream progress of an analysis as Server-Sent Events until it finishes
+  app.get("/api/analysis/:id/events", async (req, res) => {
+    const id = parseInt(req.params.id);
+    let state = progressHub.get(id);
+    if (!state) {
+      const analysis = await storage.getAnalysis(id).catch(() => undefined);
+      if (!analysis) {
+        return res.status(404).json({ message: "Analysis not found" });
+      }
+      if (!isTerminal(analysis.status)) {
+        progressHub.track(analysis);
+      }
+      state = analysis;
+    }
+    
+    res.writeHead(200, {
+      "Content-Type": "text/event-stream",
+      "Cache-Control": "no-cache",
+      "Connection": "keep-alive",
+      "X-Accel-Buffering": "no",
+    });
+    
+    // The report can be large; clients fetch it once the stream says the analysis is done
+    const send = (current: typeof state) => {
+      const { report, ...progress } = current!;
+      res.write(`data: ${JSON.stringify(progress)}\n\n`);
+    };
+    
+    send(state);
+    if (isTerminal(state.status)) {
+      return res.end();
+    }
+    
+    const heartbeat = setInterval(() => res.write(": keep-alive\n\n"), SSE_HEARTBEAT_MS);
+    const unsubscribe = progressHub.subscribe(id, (current) => {
+      send(current);
+      if (isTerminal(current.status)) {
+        res.end();
+      }
+    });
+    res.on("close", () => {
+      clearInterval(heartbeat);
+      unsubscribe();
+    });
+  });
+
   // Get latest analysis
   app.get("/api/analysis", async (req, res) => {
     try {
@@ -380,16 +507,192 @@ export async function registerRoutes(app: Express): Promise<Server> {
     }
   });
 
-  // Get all analyses
+  // Analysis history, newest first, one page at a time (reports are fetched per analysis)
   app.get("/api/analyses", async (req, res) => {
     try {
-      const analyses = await storage.getAllAnalyses();
-      res.json(analyses);
+      const limit = Math.min(Math.max(parseInt(String(req.query.limit)) || HISTORY_PAGE_SIZE, 1), HISTORY_MAX_PAGE_SIZE);
+      const before = req.query.before !== undefined ? parseInt(String(req.query.before)) : undefined;
+      if (before !== undefined && isNaN(before)) {
+        return res.status(400).json({ message: "Invalid cursor" });
+      }
+      
+      const items = await storage.listAnalyses(limit, before);
+      res.json({
+        items,
+        nextCursor: items.length === limit ? items[items.length - 1].id : null,
+      });
     } catch (error) {
       res.status(500).json({ message: "Failed to get analyses" });
     }
   });
 
+  // Semantic search over the collected message history: ?q=...&limit=&minutes=&channels=a,b
+  app.get("/api/search", async (req, res) => {
+    try {
+      const query = String(req.query.q || "").trim();
+      if (!query) {
+        return res.status(400).json({ message: "Missing search query" });
+      }
+      const limit = Math.min(Math.max(parseInt(String(req.query.limit)) || SEARCH_DEFAULT_RESULTS, 1), SEARCH_MAX_RESULTS);
+      const minutes = req.query.minutes !== undefined ? parseInt(String(req.query.minutes)) : undefined;
+      if (minutes !== undefined && !(minutes > 0)) {
+        return res.status(400).json({ message: "Invalid time range" });
+      }
+      const channels = req.query.channels !== undefined
+        ? String(req.query.channels).split(",").map(channel => channel.trim()).filter(Boolean)
+        : undefined;
+      
+      const config = await storage.getConfiguration();
+      if (!config?.telegramApiId || !config.telegramApiHash || !config.telegramPhone) {
+        return res.status(400).json({ message: "Telegram credentials not configured" });
+      }
+      
+      const telegramService = new TelegramService(config.telegramApiId, config.telegramApiHash, config.telegramPhone, config.additionalPhones);
+      const started = Date.now();
+      const result = await telegramService.search(query, { limit, minutesBack: minutes, channels });
+      res.json({ query, ...result, elapsedMs: Date.now() - started });
+    } catch (error) {
+      res.status(500).json({ message: "Search failed" });
+    }
+  });
+
+  // Full-text search over archived messages, best match first: ?q=...&limit=&offset=&channels=a,b&from=&to= (ISO dates)
+  app.get("/api/search/messages", async (req, res) => {
+    try {
+      const query = String(req.query.q || "").trim();
+      if (!query) {
+        return res.status(400).json({ message: "Missing search query" });
+      }
+      const page = searchPage(req.query);
+      const since = searchDate(req.query.from);
+      const until = searchDate(req.query.to);
+      if (!page || since === null || until === null) {
+        return res.status(400).json({ message: "Invalid page or date range" });
+      }
+      const channels = req.query.channels !== undefined
+        ? String(req.query.channels).split(",").map(channel => channel.trim()).filter(Boolean)
+        : undefined;
+      
+      const config = await storage.getConfiguration();
+      if (!config?.telegramApiId || !config.telegramApiHash || !config.telegramPhone) {
+        return res.status(400).json({ message: "Telegram credentials not configured" });
+      }
+      
+      const telegramService = new TelegramService(config.telegramApiId, config.telegramApiHash, config.telegramPhone, config.additionalPhones);
+      const result = await telegramService.searchText(query, { ...page, channels, since, until });
+      res.json({ query, ...result });
+    } catch (error) {
+      res.status(500).json({ message: "Search failed" });
+    }
+  });
+
+  // Full-text search over the topics and briefings of past reports, best match first: ?q=...&limit=&offset=
+  app.get("/api/search/reports", async (req, res) => {
+    try {
+      const query = String(req.query.q || "").trim();
+      if (!query) {
+        return res.status(400).json({ message: "Missing search query" });
+      }
+      const page = searchPage(req.query);
+      if (!page) {
+        return res.status(400).json({ message: "Invalid page" });
+      }
+      
+      // One extra row tells whether there is a next page
+      const items = await storage.searchReports(query, page.limit + 1, page.offset);
+      res.json({
+        query,
+        results: items.slice(0, page.limit),
+        nextOffset: items.length > page.limit ? page.offset + page.limit : null,
+      });
+    } catch (error) {
+      res.status(500).json({ message: "Search failed" });
+    }
+  });
+
+  // Bulk export of archived messages, oldest first: ?format=ndjson|csv|parquet&channels=a,b&from=&to= (ISO dates)
+  app.get("/api/export/messages", async (req, res) => {
+    try {
+      const format = exportFormat(req.query.format);
+      const since = searchDate(req.query.from);
+      const until = searchDate(req.query.to);
+      if (!format || since === null || until === null) {
+        return res.status(400).json({ message: `Invalid format or date range (formats: ${EXPORT_FORMATS.join(", ")})` });
+      }
+      const channels = req.query.channels !== undefined
+        ? String(req.query.channels).split(",").map(channel => channel.trim()).filter(Boolean)
+        : undefined;
+      
+      const config = await storage.getConfiguration();
+      if (!config?.telegramApiId || !config.telegramApiHash || !config.telegramPhone) {
+        return res.status(400).json({ message: "Telegram credentials not configured" });
+      }
+      
+      const telegramService = new TelegramService(config.telegramApiId, config.telegramApiHash, config.telegramPhone, config.additionalPhones);
+      await streamExport(res, {
+        format,
+        filename: `messages-${new Date().toISOString().split("T")[0]}`,
+        columns: MESSAGE_COLUMNS,
+        pages: telegramService.exportMessages({ channels, since, until }),
+        row: messageRow,
+        openParquet: columns => telegramService.openParquet(columns),
+      });
+    } catch (error) {
+      exportFailed(res, error);
+    }
+  });
+
+  // Bulk export of the analysis history with reports, oldest first: ?format=ndjson|csv|parquet&from=&to= (ISO dates)
+  app.get("/api/export/analyses", async (req, res) => {
+    try {
+      const format = exportFormat(req.query.format);
+      const since = searchDate(req.query.from);
+      const until = searchDate(req.query.to);
+      if (!format || since === null || until === null) {
+        return res.status(400).json({ message: `Invalid format or date range (formats: ${EXPORT_FORMATS.join(", ")})` });
+      }
+      const range = {
+        from: since === undefined ? undefined : new Date(since * 1000),
+        to: until === undefined ? undefined : new Date(until * 1000),
+      };
+      
+      // Parquet is written by the collector, so it needs the Telegram credentials even here
+      const config = await storage.getConfiguration();
+      const telegramService = config ? new TelegramService(config.telegramApiId, config.telegramApiHash, config.telegramPhone, config.additionalPhones) : null;
+      
+      async function* pages() {
+        let afterId: number | undefined;
+        while (true) {
+          const page = await storage.exportAnalyses(EXPORT_ANALYSES_PAGE_SIZE, afterId, range);
+          if (page.length > 0) yield page;
+          if (page.length < EXPORT_ANALYSES_PAGE_SIZE) return;
+          afterId = page[page.length - 1].id;
+        }
+      }
+      
+      await streamExport(res, {
+        format,
+        filename: `analyses-${new Date().toISOString().split("T")[0]}`,
+        columns: ANALYSIS_COLUMNS,
+        pages: pages(),
+        row: analysisRow,
+        openParquet: async columns => {
+          if (!telegramService) {
+            throw new CollectorError(UNSUPPORTED_CODE, "Parquet export needs the Telegram collector configured");
+          }
+          return telegramService.openParquet(columns);
+        },
+      });
+    } catch (error) {
+      exportFailed(res, error);
+    }
+  });
+
+  // Prometheus metrics: stage timings, collector spans, LLM and storage latency
+  app.get("/api/metrics", (req, res) => {
+    res.type("text/plain; version=0.0.4").send(registry.render());
+  });
+
   // Get statistics
   app.get("/api/statistics", async (req, res) => {
     try {
@@ -404,111 +707,167 @@ export async function registerRoutes(app: Express): Promise<Server> {
   return httpServer;
 }
 
-async function processAnalysis(analysisId: number, config: any) {
+// TELEGRAM_ADDITIONAL_PHONES: comma-separated accounts sharing the collection with TELEGRAM_PHONE
+function envAdditionalPhones(): string[] {
+  return (process.env.TELEGRAM_ADDITIONAL_PHONES || "").split(",").map(phone => phone.trim()).filter(Boolean);
+}
+
+// `limit`/`offset` of a ranked search page, or null when they aren't valid
+function searchPage(query: any): { limit: number; offset: number } | null {
+  const limit = Math.min(Math.max(parseInt(String(query.limit)) || SEARCH_DEFAULT_RESULTS, 1), SEARCH_MAX_RESULTS);
+  const offset = query.offset !== undefined ? parseInt(String(query.offset)) : 0;
+  return offset >= 0 ? { limit, offset } : null;
+}
+
+// A date query parameter as unix seconds: undefined when absent, null when unparseable
+function searchDate(value: any): number | undefined | null {
+  if (value === undefined) return undefined;
+  const time = Date.parse(String(value));
+  return isNaN(time) ? null : Math.floor(time / 1000);
+}
+
+function exportFormat(value: any): ExportFormat | null {
+  const format = value === undefined ? "ndjson" : String(value).toLowerCase();
+  return (EXPORT_FORMATS as string[]).includes(format) ? format as ExportFormat : null;
+}
+
+// Errors before any of the export was sent; streamExport handles the ones after
+function exportFailed(res: any, error: unknown) {
+  if (res.headersSent) {
+    res.destroy();
+  } else if (error instanceof CollectorError && error.code === UNSUPPORTED_CODE) {
+    res.status(501).json({ message: error.message });
+  } else {
+    console.error("Export failed:", error);
+    res.status(500).json({ message: "Export failed" });
+  }
+}
+
+function listenToChannels(config: any) {
+  if (!config.telegramApiId || !config.telegramApiHash || !config.telegramPhone || config.channels.length === 0) {
+    return;
+  }
+  const telegramService = new TelegramService(config.telegramApiId, config.telegramApiHash, config.telegramPhone, config.additionalPhones);
+  telegramService.listen(config.channels, config.timeWindowMinutes || 60)
+    .catch(error => console.error("Failed to listen to channels:", error));
+}
+
+// Errors are left to the job queue, whose onFailure marks the analysis failed
+async function processAnalysis(analysisId: number, config: any, signal: AbortSignal) {
   console.log(`Starting analysis ${analysisId} with config:`, { 
     telegramApiId: config.telegramApiId, 
     channels: config.channels, 
     hasOpenAI: !!config.openaiApiKey 
   });
   
-  const telegramService = new TelegramService(config.telegramApiId, config.telegramApiHash, config.telegramPhone);
+  const telegramService = new TelegramService(config.telegramApiId, config.telegramApiHash, config.telegramPhone, config.additionalPhones);
   const openaiService = new OpenAIService(config.openaiApiKey);
+  // Once the job is aborted (it failed, e.g. on a stage timeout) nothing more is written to the analysis
+  const update = async (updates: Partial<Analysis>) => {
+    signal.throwIfAborted();
+    await progressHub.update(analysisId, updates);
+  };
+  
+  // Update status: Starting
+  console.log(`Updating analysis ${analysisId} to processing state`);
+  await update({
+    status: "processing",
+    progress: 10,
+    currentStep: "Connecting to Telegram API...",
+  });
+  console.log(`Analysis ${analysisId} updated to processing state with 10% progress`);
+  
+  // Test Telegram connection
+  const telegramConnected = await telegramService.testConnection();
+  if (!telegramConnected) {
+    throw new Error("Failed to connect to Telegram API");
+  }
   
+  await update({
+    progress: 20,
+    currentStep: "Collecting messages from channels...",
+  });
+  console.log(`Analysis ${analysisId} updated to 20% - collecting messages`);
+  
+  // Collect messages with error handling
+  let messages: any[] = [];
   try {
-    // Update status: Starting
-    console.log(`Updating analysis ${analysisId} to processing state`);
-    await storage.updateAnalysis(analysisId, {
-      status: "processing",
-      progress: 10,
-      currentStep: "Connecting to Telegram API...",
-    });
-    console.log(`Analysis ${analysisId} updated to processing state with 10% progress`);
-    
-    // Test Telegram connection
-    const telegramConnected = await telegramService.testConnection();
-    if (!telegramConnected) {
-      throw new Error("Failed to connect to Telegram API");
-    }
-    
-    await storage.updateAnalysis(analysisId, {
-      progress: 20,
-      currentStep: "Collecting messages from channels...",
-    });
-    console.log(`Analysis ${analysisId} updated to 20% - collecting messages`);
-    
-    // Collect messages with error handling
-    let messages: any[] = [];
-    try {
-      messages = await telegramService.getRecentMessages(config.channels, config.timeWindowMinutes || 60);
-    } catch (telegramError) {
-      console.error('Telegram service failed:', telegramError);
-      await storage.updateAnalysis(analysisId, {
-        status: "failed",
-        progress: 100,
-        error: `Error conectando con Telegram: ${telegramError.message}. Verifica tus credenciales MTProto (API ID, Hash, teléfono) en my.telegram.org`,
-        completedAt: new Date(),
-      });
-      return;
-    }
-    
-    await storage.updateAnalysis(analysisId, {
-      progress: 50,
-      currentStep: "Processing content...",
-      messagesCollected: messages.length,
-      channelsProcessed: config.channels.length,
-    });
-    console.log(`Analysis ${analysisId} updated to 50% - ${messages.length} messages from ${config.channels.length} channels`);
-    
-    if (messages.length === 0) {
-      console.log(`No messages found in the last ${config.timeWindowMinutes || 60} minutes. This may be because:`);
-      console.log("1. The bot is not an administrator of the specified channels");
-      console.log("2. No messages were posted in the last 60 minutes");
-      console.log("3. The channels may not exist or be accessible");
-      
-      await storage.updateAnalysis(analysisId, {
-        status: "failed",
-        progress: 100,
-        error: `No se encontraron mensajes en los últimos ${config.timeWindowMinutes || 60} minutos. PASOS REQUERIDOS: 1) Ve a cada canal de Telegram que configuraste, 2) Agrega tu bot como administrador con permisos de 'Leer mensajes', 3) Verifica que los nombres de canal sean correctos (ej: @nombrecanal), 4) Asegúrate de que haya actividad reciente en los canales.`,
-        completedAt: new Date(),
-      });
-      return;
-    }
-    
-    await storage.updateAnalysis(analysisId, {
-      progress: 70,
-      currentStep: `Analyzing ${messages.length} messages with AI...`,
-    });
-    
-    // Generate intelligence report using configured prompt template
-    const report = await openaiService.generateIntelligenceReport(messages, config.promptTemplate, config.timeWindowMinutes || 60);
-    
-    await storage.updateAnalysis(analysisId, {
-      progress: 90,
-      currentStep: "Generating final report...",
-    });
-    
-    // Complete analysis
-    await storage.updateAnalysis(analysisId, {
-      status: "completed",
+    // Collection covers 20%-50%; every channel is pushed to viewers, storage writes are coalesced by the hub
+    messages = await analysisStageDuration.time({ stage: "collect" }, () => withTimeout((stageSignal) => telegramService.getRecentMessages(config.channels, config.timeWindowMinutes || 60, (progress) => {
+      if (stageSignal.aborted) return;
+      const percent = 20 + Math.floor((30 * progress.channelsDone) / progress.channelsTotal);
+      progressHub.update(analysisId, {
+        progress: percent,
+        currentStep: `Collecting messages from channels (${progress.channelsDone}/${progress.channelsTotal})...`,
+        messagesCollected: progress.messagesCollected,
+        channelsProcessed: progress.channelsDone,
+      }).catch(error => console.error(`Failed to update progress for analysis ${analysisId}:`, error));
+    }, stageSignal), COLLECT_TIMEOUT_MS, "Message collection", signal));
+  } catch (telegramError) {
+    console.error('Telegram service failed:', telegramError);
+    await update({
+      status: "failed",
       progress: 100,
-      currentStep: "Analysis completed",
-      report: report,
+      error: `Error conectando con Telegram: ${telegramError.message}. Verifica tus credenciales MTProto (API ID, Hash, teléfono) en my.telegram.org`,
       completedAt: new Date(),
     });
+    return;
+  }
+  
+  await update({
+    progress: 50,
+    currentStep: "Processing content...",
+    messagesCollected: messages.length,
+    channelsProcessed: config.channels.length,
+  });
+  console.log(`Analysis ${analysisId} updated to 50% - ${messages.length} messages from ${config.channels.length} channels`);
+  
+  if (messages.length === 0) {
+    console.log(`No messages found in the last ${config.timeWindowMinutes || 60} minutes. This may be because:`);
+    console.log("1. The bot is not an administrator of the specified channels");
+    console.log("2. No messages were posted in the last 60 minutes");
+    console.log("3. The channels may not exist or be accessible");
     
-    // Update statistics
-    const currentStats = await storage.getStatistics();
-    await storage.updateStatistics({
-      messagesProcessed: (currentStats?.messagesProcessed || 0) + messages.length,
-      aiAnalyses: (currentStats?.aiAnalyses || 0) + 1,
-    });
-    
-  } catch (error) {
-    await storage.updateAnalysis(analysisId, {
+    await update({
       status: "failed",
-      error: error.message,
+      progress: 100,
+      error: `No se encontraron mensajes en los últimos ${config.timeWindowMinutes || 60} minutos. PASOS REQUERIDOS: 1) Ve a cada canal de Telegram que configuraste, 2) Agrega tu bot como administrador con permisos de 'Leer mensajes', 3) Verifica que los nombres de canal sean correctos (ej: @nombrecanal), 4) Asegúrate de que haya actividad reciente en los canales.`,
       completedAt: new Date(),
     });
-    throw error;
+    return;
   }
+  
+  await update({
+    progress: 70,
+    currentStep: `Analyzing ${messages.length} messages with AI...`,
+  });
+  
+  // Generate intelligence report using configured prompt template
+  const report = await analysisStageDuration.time({ stage: "analyze" }, () => withTimeout(
+    (stageSignal) => openaiService.generateIntelligenceReport(messages, config.promptTemplate, config.timeWindowMinutes || 60, stageSignal),
+    ANALYZE_TIMEOUT_MS,
+    "AI analysis",
+    signal,
+  ));
+  
+  await update({
+    progress: 90,
+    currentStep: "Generating final report...",
+  });
+  
+  // Complete analysis
+  await update({
+    status: "completed",
+    progress: 100,
+    currentStep: "Analysis completed",
+    report: report,
+    completedAt: new Date(),
+  });
+  
+  // Update statistics
+  const currentStats = await storage.getStatistics();
+  await storage.updateStatistics({
+    messagesProcessed: (currentStats?.messagesProcessed || 0) + messages.length,
+    aiAnalyses: (currentStats?.aiAnalyses || 0) + 1,
+  });
 }
@@ -0,0 +1,276 @@
+"""
+Pool of authenticated Telegram accounts sharing one collection.
+Channels are assigned to accounts on a consistent-hash ring, so adding or
+losing an account only moves that account's channels. Every account has its
+own client, rate limiter and entity cache (access hashes are per account) and
+collects its share in parallel with the others; they share the message
+archive. An account that hits a FloodWait is skipped until the wait is over,
+one whose session stopped working until it is reconnected, and the channels
+it failed or hadn't started yet move to the next account on the ring.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import struct
+import time
+
+from entity_cache import EntityCache
+from rate_limiter import RateLimiter
+from telegram_simple import (SetupRequiredError, open_client, collect_messages, clean_channel_name, finish_collection,
+                             entity_cache_path, setup_command, DEFAULT_BACKFILL_LIMIT, DEFAULT_CONCURRENCY,
+                             MAX_FLOOD_RETRIES, MAX_FLOOD_WAIT)
+
+# Points per account on the ring; enough for an even split of a few hundred channels
+RING_REPLICAS = 64
+
+
+def _ring_hash(value):
+    return struct.unpack('<Q', hashlib.blake2b(value.encode(), digest_size=8).digest())[0]
+
+
+class HashRing:
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        points = sorted((_ring_hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self.hashes = [h for h, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def owner(self, key, exclude=()):
+        """First node clockwise from `key` that isn't excluded, or None"""
+        if not self.nodes:
+            return None
+        start = bisect.bisect(self.hashes, _ring_hash(key))
+        for i in range(len(self.nodes)):
+            node = self.nodes[(start + i) % len(self.nodes)]
+            if node not in exclude:
+                return node
+        return None
+
+
+class Account:
+    def __init__(self, phone, cache_entities=True):
+        self.phone = phone
+        self.client = None
+        self.user = None
+        self.limiter = RateLimiter()
+        self.entity_cache = EntityCache(entity_cache_path(phone)) if cache_entities else None
+        self.unavailable_until = 0.0
+        self.error = None
+        self.channels_collected = 0
+        self.rebalanced_away = 0
+
+    @property
+    def connected(self):
+        return bool(self.client and self.client.is_connected())
+
+    def available(self, now=None):
+        return self.connected and (now or time.monotonic()) >= self.unavailable_until
+
+    def stats(self):
+        return {
+            'phone': self.phone,
+            'user': self.user,
+            'connected': self.connected,
+            'unavailableFor': round(max(0.0, self.unavailable_until - time.monotonic()), 1),
+            'error': self.error,
+            'channelsCollected': self.channels_collected,
+            'rebalancedAway': self.rebalanced_away,
+            'rateLimiter': self.limiter.stats(),
+            'entityCache': self.entity_cache.stats() if self.entity_cache else None,
+        }
+
+
+class AccountPool:
+    def __init__(self, api_id, api_hash, phones, cache_entities=True, connect=open_client):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.accounts = {phone: Account(phone, cache_entities) for phone in dict.fromkeys(phones)}
+        self.ring = HashRing(self.accounts)
+        self.connect_account = connect
+        self.connect_lock = asyncio.Lock()
+
+    @property
+    def primary(self):
+        """First connected account in configuration order (used for listening)"""
+        return next((a for a in self.accounts.values() if a.connected), None)
+
+    async def connect(self):
+        """(Re)connect every account that isn't connected; raises SetupRequiredError if none is usable"""
+        async with self.connect_lock:
+            failure = None
+            for account in self.accounts.values():
+                if account.connected:
+                    continue
+                try:
+                    account.client = await self.connect_account(self.api_id, self.api_hash, account.phone)
+                    me = await account.client.get_me()
+                    account.user = f"{me.first_name} {me.last_name or ''}".strip()
+                    account.unavailable_until = 0.0
+                    account.error = None
+                    print(f"Authenticated {account.phone} as: {account.user}")
+                except SetupRequiredError as e:
+                    account.client = None
+                    account.error = f"{e}. Command: {setup_command(self.api_id, self.api_hash, account.phone)}"
+                    failure = failure or SetupRequiredError(account.error)
+                    print(f"Account {account.phone} unavailable: {account.error}")
+                except Exception as e:
+                    account.client = None
+                    account.error = str(e)
+                    failure = e
+                    print(f"Failed to connect {account.phone}: {e}")
+
+            if self.primary is None:
+                raise failure
+            return self.primary
+
+    def mark_flooded(self, account, seconds):
+        account.unavailable_until = max(account.unavailable_until, time.monotonic() + seconds)
+
+    def mark_invalid(self, account, error):
+        # Dropping the client makes the next connect() retry it (and report it if it needs setup)
+        print(f"Session of {account.phone} is no longer valid: {error}")
+        account.error = error
+        client, account.client = account.client, None
+        if client:
+            asyncio.ensure_future(client.disconnect())
+
+    def owner(self, channel, exclude=(), waiting=True):
+        """Account that should collect `channel`, skipping `exclude` and accounts in a FloodWait.
+
+        When every remaining account is waiting one out, the channel stays with its
+        usual owner and queues behind its limiter, unless `waiting` is False.
+        """
+        now = time.monotonic()
+        exclude = set(exclude)
+        phone = self.ring.owner(channel, exclude | {p for p, a in self.accounts.items() if not a.available(now)})
+        if phone is None and waiting:
+            phone = self.ring.owner(channel, exclude | {p for p, a in self.accounts.items() if not a.connected})
+        return self.accounts[phone] if phone else None
+
+    async def collect(self, channels, minutes_back, concurrency=DEFAULT_CONCURRENCY, store=None, on_event=None,
+                      max_staleness=0, dedupe=False, live=None, preprocessor=None, max_clusters=0,
+                      backfill_limit=DEFAULT_BACKFILL_LIMIT):
+        """collect_messages() over every available account, each collecting its share of `channels`"""
+        streaming = on_event is not None and not (dedupe or max_clusters)
+        pending = list(dict.fromkeys(clean_channel_name(c) for c in channels if c.strip()))
+        tried = {channel: set() for channel in pending}
+        floods = dict.fromkeys(pending, 0)
+        all_messages = []
+        reports = []
+        tasks = set()
+        total = 0
+
+        def finish(event):
+            reports.append({key: value for key, value in event.items() if key != 'event'})
+            if on_event:
+                on_event(event)
+
+        def move(account, event):
+            """Hand a channel `account` failed to another account; False if it has to fail"""
+            channel = event['channel']
+            tried[channel].add(account.phone)
+            floods[channel] += event.get('floodWaits', 0)
+            if self.owner(channel, tried[channel], waiting=False) is None:
+                if not 0 < event.get('retryAfter', 0) <= MAX_FLOOD_WAIT or floods[channel] > MAX_FLOOD_RETRIES:
+                    return False
+                # Every account is waiting out a FloodWait: queue behind the usual owner's limiter
+                tried[channel].clear()
+            account.rebalanced_away += 1
+            dispatch([channel])
+            return True
+
+        def relay(account, stop):
+            def on_account_event(event):
+                if event['event'] == 'message':
+                    if streaming:
+                        on_event(event)
+                    else:
+                        all_messages.append(event['message'])
+                    return
+
+                if event['event'] == 'channel_error':
+                    if event.get('accountInvalid'):
+                        self.mark_invalid(account, event['error'])
+                    elif event.get('retryAfter'):
+                        self.mark_flooded(account, event['retryAfter'])
+                    if not account.available():
+                        if self.owner(event['channel'], tried[event['channel']] | {account.phone}, waiting=False):
+                            # The rest of this account's share moves as well
+                            stop.set()
+                        if move(account, event):
+                            return
+                elif event['event'] == 'channel_done':
+                    account.channels_collected += 1
+
+                if event['event'] in ('channel_done', 'channel_error'):
+                    finish(event)
+                elif on_event:
+                    on_event(event)
+            return on_account_event
+
+        async def run(account, share):
+            nonlocal total
+            stop = asyncio.Event()
+            # With somewhere else to go, a FloodWait moves the channel instead of waiting it out
+            flood_retries = 0 if len(self.available()) > 1 else MAX_FLOOD_RETRIES
+            result = await collect_messages(account.client, share, minutes_back, limiter=account.limiter,
+                                            concurrency=concurrency, entity_cache=account.entity_cache, store=store,
+                                            on_event=relay(account, stop), max_staleness=max_staleness,
+                                            live=live, flood_retries=flood_retries, stop=stop,
+                                            preprocessor=preprocessor if streaming else None,
+                                            backfill_limit=backfill_limit)
+            total += sum(r['messages'] for r in result['channels'] if r['status'] == 'ok')
+            if result['remaining']:
+                print(f"Rebalancing {len(result['remaining'])} channels away from {account.phone}")
+            for channel in result['remaining']:
+                tried[channel].add(account.phone)
+                account.rebalanced_away += 1
+            dispatch(result['remaining'])
+
+        def dispatch(channels):
+            shares = {}
+            for channel in channels:
+                account = self.owner(channel, tried[channel])
+                if account is None:
+                    finish({'event': 'channel_error', 'channel': channel, 'status': 'error', 'messages': 0,
+                            'fetched': 0, 'floodWaits': floods[channel], 'elapsedMs': 0,
+                            'error': 'No Telegram account available'})
+                    continue
+                shares.setdefault(account.phone, (account, []))[1].append(channel)
+            for account, share in shares.values():
+                tasks.add(asyncio.ensure_future(run(account, share)))
+
+        dispatch(pending)
+        if len(tasks) > 1:
+            print(f"Collecting {len(pending)} channels over {len(tasks)} accounts")
+        # Moved channels start on their new account right away instead of waiting for the others
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                tasks.difference_update(done)
+                for task in done:
+                    task.result()
+        except BaseException:
+            # Cancelled by the caller or failed: don't leave the other accounts collecting
+            for task in tasks:
+                task.cancel()
+            raise
+
+        result = {'messages': all_messages, 'channels': reports, 'total': total}
+        if not streaming:
+            await finish_collection(result, on_event, preprocessor, dedupe, max_clusters)
+        return result
+
+    def available(self):
+        now = time.monotonic()
+        return [a for a in self.accounts.values() if a.available(now)]
+
+    def stats(self):
+        return [account.stats() for account in self.accounts.values()]
+
+    async def close(self):
+        for account in self.accounts.values():
+            if account.connected:
+                await account.client.disconnect()
+            if account.entity_cache:
+                account.entity_cache.close()
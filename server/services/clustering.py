@@ -0,0 +1,183 @@
+"""
+Topic clustering of collected messages.
+Messages are vectorized with hashed TF-IDF (word unigrams hashed into a fixed
+number of dimensions, stored as CSR arrays) and grouped with spherical
+mini-batch k-means over cosine similarity. Every message gets a 'cluster' id
+(-1 for messages too far from every topic) and its 'centrality', the cosine
+similarity to its cluster's centroid; the server sends each cluster to the
+model as its own request, most central messages first. Input order and the
+seed fix the result, so the same messages always give the same clusters.
+"""
+
+import math
+import re
+import zlib
+
+import numpy as np
+
+DIMENSIONS = 2 ** 18
+DEFAULT_MAX_CLUSTERS = 12
+# Fewer messages than this are left to a single request
+MIN_MESSAGES = 50
+# Clusters smaller than this, and messages less similar than this to their centroid, are unclustered
+MIN_CLUSTER_SIZE = 3
+MIN_CENTRALITY = 0.08
+BATCH_SIZE = 512
+ITERATIONS = 30
+SEED = 20240601
+# Rows scored against the centroids at once, bounding the (k x nnz) temporary
+ASSIGN_CHUNK = 4096
+
+_TERM = re.compile(r'[^\W\d_]{3,}')
+
+
+def vectorize(texts):
+    """Hashed TF-IDF rows, L2-normalized: (indptr, indices, data, index -> sample term)"""
+    rows = []
+    terms = {}
+    document_frequency = {}
+    for text in texts:
+        counts = {}
+        for term in _TERM.findall(text.lower()):
+            index = zlib.crc32(term.encode()) % DIMENSIONS
+            terms.setdefault(index, term)
+            counts[index] = counts.get(index, 0) + 1
+        rows.append(counts)
+        for index in counts:
+            document_frequency[index] = document_frequency.get(index, 0) + 1
+
+    total = len(texts)
+    indptr = np.zeros(total + 1, dtype=np.int64)
+    indices = np.empty(sum(len(r) for r in rows), dtype=np.int64)
+    data = np.empty(len(indices), dtype=np.float32)
+    position = 0
+    for i, counts in enumerate(rows):
+        for index, count in counts.items():
+            indices[position] = index
+            # Sublinear tf, smoothed idf
+            data[position] = (1 + math.log(count)) * (math.log((1 + total) / (1 + document_frequency[index])) + 1)
+            position += 1
+        indptr[i + 1] = position
+
+    row_of = np.repeat(np.arange(total), np.diff(indptr))
+    norms = np.sqrt(np.bincount(row_of, weights=data ** 2, minlength=total)).astype(np.float32)
+    data /= norms[row_of]
+    return indptr, indices, data, terms
+
+
+def _positions(indptr, rows):
+    """Positions of the given CSR rows' entries, their lengths and where each row starts among them"""
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths), lengths, offsets
+
+
+def _similarities(indptr, indices, data, centroids, rows):
+    """Cosine similarity of CSR `rows` (all non-empty) to every centroid: (len(rows), k)"""
+    result = np.empty((len(rows), len(centroids)), dtype=np.float32)
+    for chunk_start in range(0, len(rows), ASSIGN_CHUNK):
+        chunk = rows[chunk_start:chunk_start + ASSIGN_CHUNK]
+        positions, _, offsets = _positions(indptr, chunk)
+        contributions = centroids[:, indices[positions]] * data[positions]
+        result[chunk_start:chunk_start + len(chunk)] = np.add.reduceat(contributions, offsets, axis=1).T
+    return result
+
+
+def _dense(indptr, indices, data, row):
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    vector[indices[indptr[row]:indptr[row + 1]]] = data[indptr[row]:indptr[row + 1]]
+    return vector
+
+
+def _init_centroids(indptr, indices, data, rows, k, rng):
+    """k-means++ seeding on a sample of the rows"""
+    sample = rows if len(rows) <= 2000 else np.sort(rng.choice(rows, 2000, replace=False))
+    centroids = np.zeros((k, DIMENSIONS), dtype=np.float32)
+    centroids[0] = _dense(indptr, indices, data, sample[rng.integers(len(sample))])
+    closest = _similarities(indptr, indices, data, centroids[:1], sample)[:, 0]
+    for c in range(1, k):
+        weights = np.clip(1 - closest, 0, None) ** 2
+        if weights.sum() <= 0:
+            return centroids[:c]
+        choice = sample[rng.choice(len(sample), p=weights / weights.sum())]
+        centroids[c] = _dense(indptr, indices, data, choice)
+        closest = np.maximum(closest, _similarities(indptr, indices, data, centroids[c:c + 1], sample)[:, 0])
+    return centroids
+
+
+def kmeans(indptr, indices, data, rows, k, seed=SEED):
+    """Spherical mini-batch k-means: returns (centroids, labels, similarity to own centroid)"""
+    rng = np.random.default_rng(seed)
+    centroids = _init_centroids(indptr, indices, data, rows, k, rng)
+    k = len(centroids)
+    seen = np.zeros(k)
+
+    for _ in range(ITERATIONS):
+        batch = rows if len(rows) <= BATCH_SIZE else np.sort(rng.choice(rows, BATCH_SIZE, replace=False))
+        labels = _similarities(indptr, indices, data, centroids, batch).argmax(axis=1)
+
+        sums = np.zeros_like(centroids)
+        positions, lengths, _ = _positions(indptr, batch)
+        np.add.at(sums, (np.repeat(labels, lengths), indices[positions]), data[positions])
+        counts = np.bincount(labels, minlength=k)
+
+        # Per-centroid learning rate 1/(points seen), as in Sculley's mini-batch k-means
+        updated = counts > 0
+        seen[updated] += counts[updated]
+        rate = np.where(updated, counts / np.maximum(seen, 1), 0)[:, None]
+        centroids = (1 - rate) * centroids + rate * sums / np.maximum(counts, 1)[:, None]
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        centroids = centroids / np.where(norms > 0, norms, 1)
+
+    similarities = _similarities(indptr, indices, data, centroids, rows)
+    labels = similarities.argmax(axis=1)
+    return centroids, labels, similarities[np.arange(len(rows)), labels]
+
+
+def cluster_count(messages, max_clusters):
+    return max(2, min(max_clusters, round(math.sqrt(messages / 8))))
+
+
+def cluster_messages(messages, max_clusters=DEFAULT_MAX_CLUSTERS):
+    """Cluster messages by topic.
+
+    Returns (messages annotated with 'cluster' and 'centrality', cluster
+    summaries [{'id', 'size', 'terms'}]) with ids numbered by decreasing size.
+    Sets smaller than MIN_MESSAGES come back unchanged with no summaries.
+    """
+    if len(messages) < MIN_MESSAGES or max_clusters < 2:
+        return messages, []
+
+    indptr, indices, data, terms = vectorize([m['text'] for m in messages])
+    rows = np.flatnonzero(indptr[1:] > indptr[:-1])
+    k = cluster_count(len(rows), max_clusters)
+    if len(rows) < k:
+        return messages, []
+    centroids, labels, centrality = kmeans(indptr, indices, data, rows, k)
+
+    members = {}
+    for row, label, score in zip(rows, labels, centrality):
+        if score >= MIN_CENTRALITY:
+            members.setdefault(int(label), []).append(int(row))
+    kept = sorted((label for label, group in members.items() if len(group) >= MIN_CLUSTER_SIZE),
+                  key=lambda label: (-len(members[label]), members[label][0]))
+    renumber = {label: cluster for cluster, label in enumerate(kept)}
+
+    assignment = {}
+    for row, label, score in zip(rows, labels, centrality):
+        assignment[int(row)] = (renumber.get(int(label), -1) if score >= MIN_CENTRALITY else -1, float(score))
+    annotated = []
+    for i, message in enumerate(messages):
+        cluster, score = assignment.get(i, (-1, 0.0))
+        annotated.append({**message, 'cluster': cluster, 'centrality': round(score, 3)})
+
+    summaries = []
+    for label in kept:
+        top = np.argsort(centroids[label])[::-1][:5]
+        summaries.append({
+            'id': renumber[label],
+            'size': len(members[label]),
+            'terms': [terms[int(i)] for i in top if centroids[label][i] > 0 and int(i) in terms],
+        })
+    return annotated, summaries
@@ -0,0 +1,299 @@
+import { spawn, type ChildProcessWithoutNullStreams } from "child_process";
+import { createInterface } from "readline";
+import { collectorParseDuration, collectorSpawnDuration, observeCollectorSpan } from "./metrics";
+
+const HEALTH_CHECK_INTERVAL_MS = 30000;
+const HEALTH_CHECK_TIMEOUT_MS = 10000;
+const MAX_RESTART_DELAY_MS = 30000;
+// Subscribing backfills every channel's window first
+const LISTEN_TIMEOUT_MS = 10 * 60 * 1000;
+
+// JSON-RPC error code telegram_collector.py uses when the session needs setup
+export const SETUP_REQUIRED_CODE = -32001;
+// ...and when a request needs an optional dependency it doesn't have
+export const UNSUPPORTED_CODE = -32002;
+
+export class CollectorError extends Error {
+  code: number;
+
+  constructor(code: number, message: string) {
+    super(message);
+    this.code = code;
+  }
+}
+
+interface PendingCall {
+  resolve: (result: any) => void;
+  reject: (error: Error) => void;
+  timer: NodeJS.Timeout;
+  onEvent?: (event: any) => void;
+  resetTimer?: () => void;
+}
+
+/**
+ * Manages the long-lived telegram_collector.py process: one connected
+ * Telethon client per account of a credential set, reused across analyses,
+ * restarted automatically when it dies or stops answering health checks.
+ */
+export class CollectorProcess {
+  private child: ChildProcessWithoutNullStreams | null = null;
+  private pending = new Map<number, PendingCall>();
+  private nextId = 1;
+  private restartAttempts = 0;
+  private healthTimer: NodeJS.Timeout | null = null;
+  private stopped = false;
+  private ready: Promise<void> | null = null;
+  // Last `listen` request, replayed whenever the process is restarted
+  private subscription: Record<string, any> | null = null;
+
+  constructor(
+    private apiId: string,
+    private apiHash: string,
+    // The first account also listens for pushed updates and owns the archive
+    private phones: string[],
+  ) {}
+
+  get key(): string {
+    return collectorKey(this.apiId, this.apiHash, this.phones);
+  }
+
+  start(): Promise<void> {
+    if (this.ready) return this.ready;
+    this.stopped = false;
+
+    this.ready = new Promise<void>((resolve, reject) => {
+      console.log('Starting Telegram collector process...');
+      const spawnedAt = performance.now();
+      const child = spawn("python3", ["telegram_collector.py", this.apiId, this.apiHash, this.phones.join(",")], {
+        cwd: "server/services",
+        stdio: ["pipe", "pipe", "pipe"],
+      });
+      this.child = child;
+
+      const onReady = (params: any) => {
+        this.restartAttempts = 0;
+        collectorSpawnDuration.observe({ authorized: !!params?.authorized }, (performance.now() - spawnedAt) / 1000);
+        if (params?.authorized) {
+          console.log(`Telegram collector ready (authenticated as ${params.user})`);
+        } else {
+          console.warn(`Telegram collector started without an authorized session: ${params?.error}`);
+        }
+        resolve();
+        if (params?.authorized && this.subscription) {
+          this.call("listen", this.subscription, LISTEN_TIMEOUT_MS)
+            .catch((error) => console.error('Failed to resume listening to channels:', error));
+        }
+      };
+
+      createInterface({ input: child.stdout }).on("line", (line) => this.handleLine(line, onReady));
+      createInterface({ input: child.stderr }).on("line", (line) => console.log(`[collector] ${line}`));
+
+      child.on("error", (error) => {
+        console.error('Failed to spawn Telegram collector:', error);
+        reject(error);
+      });
+
+      child.on("exit", (code, signal) => {
+        console.warn(`Telegram collector exited (code ${code}, signal ${signal})`);
+        reject(new Error("Telegram collector exited during startup"));
+        this.handleExit();
+      });
+    });
+
+    // A failed start is retried by the exit handler; keep callers from crashing on it
+    this.ready.catch(() => {});
+    this.startHealthChecks();
+    return this.ready;
+  }
+
+  /**
+   * Send a request to the collector. With `onEvent`, streamed notifications for
+   * this request are delivered as they arrive and the timeout becomes an
+   * inactivity timeout that restarts on every event. A request that times out
+   * or whose `signal` is aborted is cancelled in the collector as well.
+   */
+  async call<T = any>(
+    method: string,
+    params: Record<string, any> = {},
+    timeoutMs = 60000,
+    onEvent?: (event: any) => void,
+    signal?: AbortSignal,
+  ): Promise<T> {
+    signal?.throwIfAborted();
+    await this.start();
+    if (!this.child) {
+      throw new Error("Telegram collector is not running");
+    }
+
+    const id = this.nextId++;
+    const child = this.child;
+    return new Promise<T>((resolve, reject) => {
+      const abandon = (error: unknown) => {
+        if (!this.pending.has(id)) return;
+        clearTimeout(call.timer);
+        this.pending.delete(id);
+        call.reject(error);
+        if (this.child === child) {
+          this.call("cancel", { requestId: id }, HEALTH_CHECK_TIMEOUT_MS).catch(() => {});
+        }
+      };
+      const expire = () => abandon(new Error(`Telegram collector timeout after ${timeoutMs / 1000} seconds (${method})`));
+      const onAbort = () => abandon(signal!.reason);
+
+      const call: PendingCall = {
+        resolve: (result) => {
+          signal?.removeEventListener("abort", onAbort);
+          resolve(result);
+        },
+        reject: (error) => {
+          signal?.removeEventListener("abort", onAbort);
+          reject(error);
+        },
+        timer: setTimeout(expire, timeoutMs),
+        onEvent,
+      };
+      if (onEvent) {
+        call.resetTimer = () => {
+          clearTimeout(call.timer);
+          call.timer = setTimeout(expire, timeoutMs);
+        };
+      }
+
+      this.pending.set(id, call);
+      signal?.addEventListener("abort", onAbort, { once: true });
+      child.stdin.write(JSON.stringify({ jsonrpc: "2.0", id, method, params }) + "\n");
+    });
+  }
+
+  /**
+   * Keep a pushed rolling window of `channels` in the collector, so collections
+   * covered by it return without asking Telegram. Survives collector restarts.
+   */
+  async listen(channels: string[], windowMinutes: number): Promise<any> {
+    this.subscription = { channels, windowMinutes };
+    return this.call("listen", this.subscription, LISTEN_TIMEOUT_MS);
+  }
+
+  async stop(): Promise<void> {
+    this.stopped = true;
+    this.stopHealthChecks();
+    if (!this.child) return;
+
+    const child = this.child;
+    const exited = new Promise<void>((resolve) => child.once("exit", () => resolve()));
+    try {
+      await this.call("shutdown", {}, 5000);
+    } catch {
+      child.kill("SIGTERM");
+    }
+    await exited;
+  }
+
+  private handleLine(line: string, onReady: (params: any) => void) {
+    let frame: any;
+    const parseStarted = performance.now();
+    try {
+      frame = JSON.parse(line);
+    } catch {
+      console.log(`[collector] ${line}`);
+      return;
+    }
+
+    if (frame.method === "span") {
+      observeCollectorSpan(frame.params);
+      return;
+    }
+
+    if (frame.method === "ready") {
+      onReady(frame.params);
+      return;
+    }
+
+    if (frame.method?.endsWith(".event")) {
+      const streaming = this.pending.get(frame.params?.requestId);
+      if (streaming?.onEvent) {
+        streaming.resetTimer?.();
+        streaming.onEvent(frame.params);
+      }
+      return;
+    }
+
+    collectorParseDuration.observe({}, (performance.now() - parseStarted) / 1000);
+    const call = this.pending.get(frame.id);
+    if (!call) return;
+    this.pending.delete(frame.id);
+    clearTimeout(call.timer);
+
+    if (frame.error) {
+      call.reject(new CollectorError(frame.error.code, frame.error.message));
+    } else {
+      call.resolve(frame.result);
+    }
+  }
+
+  private handleExit() {
+    this.child = null;
+    this.ready = null;
+
+    const error = new Error("Telegram collector process exited");
+    this.pending.forEach((call) => {
+      clearTimeout(call.timer);
+      call.reject(error);
+    });
+    this.pending.clear();
+
+    if (this.stopped) return;
+
+    // Exponential backoff so a broken environment doesn't spin
+    const delay = Math.min(MAX_RESTART_DELAY_MS, 1000 * 2 ** this.restartAttempts);
+    this.restartAttempts++;
+    console.log(`Restarting Telegram collector in ${delay / 1000}s`);
+    setTimeout(() => {
+      if (!this.stopped) this.start();
+    }, delay);
+  }
+
+  private startHealthChecks() {
+    if (this.healthTimer) return;
+    this.healthTimer = setInterval(async () => {
+      if (!this.child) return;
+      const child = this.child;
+      try {
+        await this.call("ping", {}, HEALTH_CHECK_TIMEOUT_MS);
+      } catch (error) {
+        if (child === this.child) {
+          console.error('Telegram collector failed health check, restarting:', error);
+          child.kill("SIGKILL");
+        }
+      }
+    }, HEALTH_CHECK_INTERVAL_MS);
+    this.healthTimer.unref();
+  }
+
+  private stopHealthChecks() {
+    if (this.healthTimer) {
+      clearInterval(this.healthTimer);
+      this.healthTimer = null;
+    }
+  }
+}
+
+function collectorKey(apiId: string, apiHash: string, phones: string[]): string {
+  return `${apiId}:${apiHash}:${phones.join(",")}`;
+}
+
+let activeCollector: CollectorProcess | null = null;
+
+// One session file can only be driven by one process, so a credential change replaces the collector
+export function getCollector(apiId: string, apiHash: string, phones: string[]): CollectorProcess {
+  const key = collectorKey(apiId, apiHash, phones);
+  if (activeCollector && activeCollector.key === key) {
+    return activeCollector;
+  }
+
+  if (activeCollector) {
+    activeCollector.stop().catch((error) => console.error('Failed to stop previous collector:', error));
+  }
+  activeCollector = new CollectorProcess(apiId, apiHash, phones);
+  return activeCollector;
+}
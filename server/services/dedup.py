@@ -0,0 +1,123 @@
+"""
+Cross-channel near-duplicate detection.
+Many channels repost or lightly rephrase the same item. Messages are reduced
+to MinHash signatures over word shingles of their normalized text, candidate
+pairs are found with LSH banding and confirmed by estimated Jaccard
+similarity, and each group is collapsed into one representative that keeps
+the list of channels that reported it.
+"""
+
+import hashlib
+import re
+import struct
+
+from message_store import ENGAGEMENT_FIELDS
+
+NUM_PERM = 32
+BANDS = 8               # 8 bands x 4 rows
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+DEFAULT_THRESHOLD = 0.6
+
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# Fixed coefficients so signatures are reproducible across runs and processes
+_PERMS = [
+    struct.unpack('<QQ', hashlib.blake2b(f"perm-{i}".encode(), digest_size=16).digest())
+    for i in range(NUM_PERM)
+]
+
+_URL_RE = re.compile(r'https?://\S+|t\.me/\S+|www\.\S+')
+_MENTION_RE = re.compile(r'[@#]\w+')
+_NON_WORD_RE = re.compile(r'[^\w\s]+')
+
+
+def normalize(text):
+    text = _URL_RE.sub(' ', text.lower())
+    text = _MENTION_RE.sub(' ', text)
+    text = _NON_WORD_RE.sub(' ', text)
+    return ' '.join(text.split())
+
+
+def _hash(token):
+    return struct.unpack('<I', hashlib.blake2b(token.encode(), digest_size=4).digest())[0]
+
+
+def shingles(normalized):
+    words = normalized.split()
+    if len(words) <= SHINGLE_SIZE:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash(shingle_set):
+    hashes = [_hash(s) for s in shingle_set]
+    return tuple(
+        min(((a * h + b) % _PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMS
+    )
+
+
+def similarity(sig_a, sig_b):
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def group_duplicates(messages, threshold=DEFAULT_THRESHOLD):
+    """Collapse near-duplicate messages.
+
+    Returns one representative per group (the earliest message), annotated with
+    'duplicateCount' and 'sourceChannels'; singletons keep a count of 1. A
+    group's engagement counts are the sums over its members.
+    """
+    parent = list(range(len(messages)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    signatures = []
+    exact = {}
+    buckets = {}
+    for index, message in enumerate(messages):
+        normalized = normalize(message['text'])
+        if not normalized:
+            # Emoji-, link- or mention-only: nothing to compare, so it stays on its own
+            signatures.append(None)
+            continue
+        if normalized in exact:
+            union(exact[normalized], index)
+            signatures.append(None)
+            continue
+        exact[normalized] = index
+
+        signature = minhash(shingles(normalized))
+        signatures.append(signature)
+        for band in range(BANDS):
+            key = (band, signature[band * ROWS:(band + 1) * ROWS])
+            for other in buckets.setdefault(key, []):
+                if find(other) != find(index) and similarity(signature, signatures[other]) >= threshold:
+                    union(other, index)
+            buckets[key].append(index)
+
+    groups = {}
+    for index in range(len(messages)):
+        groups.setdefault(find(index), []).append(messages[index])
+
+    result = []
+    for members in groups.values():
+        representative = dict(min(members, key=lambda m: (m['date'], m['id'])))
+        channels = list(dict.fromkeys(m['channel'] for m in members))
+        representative['duplicateCount'] = len(members)
+        representative['sourceChannels'] = channels
+        if len(members) > 1:
+            for field in ENGAGEMENT_FIELDS:
+                representative[field] = sum(m.get(field, 0) for m in members)
+        result.append(representative)
+    return result
@@ -0,0 +1,75 @@
+"""
+On-disk cache of resolved channel entities.
+Resolving '@username' is one of the most heavily rate-limited Telegram calls,
+so we remember each channel's id and access_hash next to the session file and
+build InputPeerChannel directly from them. Entries are revalidated after a TTL
+and dropped as soon as a request made with them fails.
+"""
+
+import sqlite3
+import time
+
+from telethon.tl.types import Channel, InputPeerChannel
+
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+class EntityCache:
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS entities (
+                username TEXT PRIMARY KEY,
+                channel_id INTEGER,
+                access_hash INTEGER,
+                is_channel INTEGER NOT NULL,
+                resolved_at REAL NOT NULL
+            )
+        """)
+        self.db.commit()
+
+    @staticmethod
+    def _key(username):
+        return username.lstrip('@').lower()
+
+    def get(self, username):
+        """Return (peer, is_channel) for a fresh entry, or None if it must be resolved"""
+        row = self.db.execute(
+            "SELECT channel_id, access_hash, is_channel, resolved_at FROM entities WHERE username = ?",
+            (self._key(username),)
+        ).fetchone()
+
+        if row is None or time.time() - row[3] > self.ttl:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        channel_id, access_hash, is_channel, _ = row
+        if not is_channel:
+            return None, False
+        return InputPeerChannel(channel_id, access_hash), True
+
+    def put(self, username, entity):
+        is_channel = isinstance(entity, Channel)
+        self.db.execute(
+            "INSERT OR REPLACE INTO entities (username, channel_id, access_hash, is_channel, resolved_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (self._key(username), entity.id if is_channel else None,
+             entity.access_hash if is_channel else None, int(is_channel), time.time())
+        )
+        self.db.commit()
+
+    def invalidate(self, username):
+        self.db.execute("DELETE FROM entities WHERE username = ?", (self._key(username),))
+        self.db.commit()
+
+    def stats(self):
+        size = self.db.execute("SELECT COUNT(*) FROM entities").fetchone()[0]
+        return {'entries': size, 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        self.db.close()
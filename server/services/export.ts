@@ -0,0 +1,174 @@
+import { createReadStream } from "fs";
+import { stat, unlink } from "fs/promises";
+import { pipeline } from "stream/promises";
+import type { Response } from "express";
+import type { Analysis } from "@shared/schema";
+import type { TelegramMessage } from "./telegram";
+
+export type ExportFormat = "ndjson" | "csv" | "parquet";
+export const EXPORT_FORMATS: ExportFormat[] = ["ndjson", "csv", "parquet"];
+
+// Column name and its Parquet type (see exporter.py); CSV uses the names as its header
+export type ExportColumn = [string, "string" | "int64" | "float64" | "bool" | "timestamp" | "string[]"];
+
+// A Parquet file being written by the collector, one row group per write
+export interface ParquetFile {
+  write(rows: Record<string, any>[]): Promise<void>;
+  close(): Promise<{ path: string; rows: number }>;
+  abort(): Promise<void>;
+}
+
+export interface ExportOptions<T> {
+  format: ExportFormat;
+  filename: string;
+  columns: ExportColumn[];
+  // Pages pulled one at a time; the next is only requested once the client has taken the previous one
+  pages: AsyncIterable<T[]>;
+  // Flat row for CSV and Parquet; NDJSON writes the items as they are
+  row: (item: T) => Record<string, any>;
+  openParquet: (columns: ExportColumn[]) => Promise<ParquetFile>;
+}
+
+export const MESSAGE_COLUMNS: ExportColumn[] = [
+  ["channel", "string"],
+  ["id", "int64"],
+  ["date", "timestamp"],
+  ["text", "string"],
+  ["url", "string"],
+  ["views", "int64"],
+  ["forwards", "int64"],
+  ["replies", "int64"],
+  ["reactions", "int64"],
+];
+
+export const ANALYSIS_COLUMNS: ExportColumn[] = [
+  ["id", "int64"],
+  ["configId", "int64"],
+  ["status", "string"],
+  ["startedAt", "timestamp"],
+  ["completedAt", "timestamp"],
+  ["messagesCollected", "int64"],
+  ["channelsProcessed", "int64"],
+  ["error", "string"],
+  ["topics", "string[]"],
+  ["report", "string"],
+];
+
+export function messageRow(message: TelegramMessage): Record<string, any> {
+  return { ...message, date: new Date(message.date * 1000) };
+}
+
+// Topic names as their own column; the full report as JSON text
+export function analysisRow(analysis: Analysis): Record<string, any> {
+  const topics: Array<{ topic?: string }> = (analysis.report as any)?.topics || [];
+  return {
+    ...analysis,
+    topics: topics.map(t => t.topic || ""),
+    report: analysis.report === null ? null : JSON.stringify(analysis.report),
+  };
+}
+
+const CONTENT_TYPES: Record<ExportFormat, string> = {
+  ndjson: "application/x-ndjson",
+  csv: "text/csv; charset=utf-8",
+  parquet: "application/vnd.apache.parquet",
+};
+
+class ClientGoneError extends Error {}
+
+/**
+ * Stream an export to `res` as an attachment. Memory stays bounded by one
+ * page whatever the export's size: NDJSON and CSV are written page by page
+ * with backpressure, Parquet pages go to the collector's writer and the
+ * finished file is streamed from disk. A failure after the headers went out
+ * destroys the response, so a truncated export never looks complete.
+ */
+export async function streamExport<T>(res: Response, options: ExportOptions<T>): Promise<void> {
+  const { format, filename, columns, pages, row } = options;
+  if (format === "parquet") {
+    return streamParquet(res, options);
+  }
+
+  res.writeHead(200, {
+    "Content-Type": CONTENT_TYPES[format],
+    "Content-Disposition": `attachment; filename="${filename}.${format}"`,
+  });
+  try {
+    if (format === "csv") {
+      await write(res, csvLine(columns.map(([name]) => name)));
+    }
+    for await (const page of pages) {
+      const chunk = format === "csv"
+        ? page.map(item => { const values = row(item); return csvLine(columns.map(([name]) => values[name])); }).join("")
+        : page.map(item => JSON.stringify(item) + "\n").join("");
+      await write(res, chunk);
+    }
+    res.end();
+  } catch (error) {
+    if (!(error instanceof ClientGoneError)) {
+      console.error(`Export ${filename} failed:`, error);
+    }
+    res.destroy();
+  }
+}
+
+async function streamParquet<T>(res: Response, { filename, columns, pages, row, openParquet }: ExportOptions<T>): Promise<void> {
+  const file = await openParquet(columns);
+  let path: string;
+  try {
+    for await (const page of pages) {
+      if (res.destroyed) {
+        throw new ClientGoneError();
+      }
+      await file.write(page.map(row));
+    }
+    ({ path } = await file.close());
+  } catch (error) {
+    await file.abort().catch(() => undefined);
+    if (error instanceof ClientGoneError) return;
+    throw error;
+  }
+
+  try {
+    res.writeHead(200, {
+      "Content-Type": CONTENT_TYPES.parquet,
+      "Content-Disposition": `attachment; filename="${filename}.parquet"`,
+      "Content-Length": (await stat(path)).size,
+    });
+    await pipeline(createReadStream(path), res);
+  } catch (error) {
+    res.destroy();
+  } finally {
+    await unlink(path).catch(() => undefined);
+  }
+}
+
+// Write a chunk, waiting for the client to drain the socket buffer when it's full
+async function write(res: Response, chunk: string): Promise<void> {
+  if (res.destroyed) {
+    throw new ClientGoneError();
+  }
+  if (!res.write(chunk)) {
+    await new Promise<void>(resolve => {
+      const done = () => {
+        res.off("drain", done);
+        res.off("close", done);
+        resolve();
+      };
+      res.on("drain", done);
+      res.on("close", done);
+    });
+  }
+}
+
+function csvValue(value: any): string {
+  if (value === null || value === undefined) return "";
+  const text = value instanceof Date ? value.toISOString()
+    : typeof value === "object" ? JSON.stringify(value)
+    : String(value);
+  return /[",\r\n]/.test(text) ? `"${text.replace(/"/g, '""')}"` : text;
+}
+
+function csvLine(values: any[]): string {
+  return values.map(csvValue).join(",") + "\r\n";
+}
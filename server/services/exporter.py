@@ -0,0 +1,71 @@
+"""
+Parquet files for the server's bulk exports.
+The server streams NDJSON and CSV itself; Parquet needs a columnar writer, so
+it opens an export here, sends the rows in chunks and streams the finished
+file. Every chunk is written as its own row group, so memory stays bounded by
+the chunk size however long the export. pyarrow is optional: without it
+Parquet exports are refused and the other formats are unaffected.
+"""
+
+import os
+import tempfile
+from datetime import datetime, timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+def available():
+    return pa is not None
+
+
+def _arrow_type(name):
+    return {
+        'string': pa.string(),
+        'int64': pa.int64(),
+        'float64': pa.float64(),
+        'bool': pa.bool_(),
+        'timestamp': pa.timestamp('s', tz='UTC'),
+        'string[]': pa.list_(pa.string()),
+    }[name]
+
+
+def _timestamp(value):
+    """Unix seconds or an ISO 8601 string (as JSON.stringify writes dates)"""
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc)
+    return datetime.fromisoformat(value)
+
+
+class ParquetExport:
+    def __init__(self, columns, directory=None):
+        """`columns` is [[name, type]] with types from _arrow_type()"""
+        self.schema = pa.schema([(name, _arrow_type(kind)) for name, kind in columns])
+        self.timestamps = [name for name, kind in columns if kind == 'timestamp']
+        fd, self.path = tempfile.mkstemp(prefix='export-', suffix='.parquet', dir=directory)
+        os.close(fd)
+        self.writer = pq.ParquetWriter(self.path, self.schema, compression='zstd')
+        self.rows = 0
+
+    def write(self, rows):
+        for row in rows:
+            for name in self.timestamps:
+                row[name] = _timestamp(row.get(name))
+        self.writer.write_table(pa.Table.from_pylist(rows, schema=self.schema))
+        self.rows += len(rows)
+
+    def close(self):
+        """Finish the file; the caller streams it and deletes it"""
+        self.writer.close()
+        return {'path': self.path, 'rows': self.rows, 'bytes': os.path.getsize(self.path)}
+
+    def abort(self):
+        try:
+            self.writer.close()
+        finally:
+            os.remove(self.path)
@@ -0,0 +1,149 @@
+import { test } from "node:test";
+import assert from "node:assert/strict";
+import type { Job } from "@shared/schema";
+import { MemStorage } from "../storage";
+import { JobQueue, StageTimeoutError, withTimeout } from "./job-queue";
+
+async function until(condition: () => Promise<boolean>) {
+  for (let i = 0; i < 100; i++) {
+    if (await condition()) return;
+    await new Promise(resolve => setTimeout(resolve, 10));
+  }
+  assert.fail("timed out waiting for the job queue");
+}
+
+async function status(storage: MemStorage, id: number): Promise<string | undefined> {
+  return (await storage.getJob(id))?.status;
+}
+
+test("identical jobs are coalesced while pending or running", async () => {
+  const storage = new MemStorage();
+  const queue = new JobQueue(storage, {});
+
+  const first = await queue.enqueue("analysis", "analysis:1", { analysisId: 1 });
+  const second = await queue.enqueue("analysis", "analysis:1", { analysisId: 2 });
+  const other = await queue.enqueue("analysis", "analysis:2", { analysisId: 3 });
+  assert.equal(first.created, true);
+  assert.deepEqual([second.created, second.job.id], [false, first.job.id]);
+  assert.equal(other.created, true);
+
+  await storage.updateJob(first.job.id, { status: "completed" });
+  const again = await queue.enqueue("analysis", "analysis:1", { analysisId: 4 });
+  assert.equal(again.created, true);
+  assert.notEqual(again.job.id, first.job.id);
+});
+
+test("concurrent identical requests create one job", async () => {
+  const storage = new MemStorage();
+  const queue = new JobQueue(storage, {});
+
+  const results = await Promise.all([1, 2, 3].map(analysisId => queue.enqueue("analysis", "analysis:1", { analysisId })));
+  assert.equal(results.filter(result => result.created).length, 1);
+  assert.equal(new Set(results.map(result => result.job.id)).size, 1);
+});
+
+test("jobs run once and failures are reported once", async () => {
+  const storage = new MemStorage();
+  const ran: number[] = [];
+  const failures: string[] = [];
+  const queue = new JobQueue(storage, {
+    analysis: async (job) => {
+      ran.push(job.id);
+      if ((job.payload as { fail?: boolean }).fail) throw new Error("collector unavailable");
+    },
+  }, { workers: 1, onFailure: async (job, error) => { failures.push(`${job.id}: ${error.message}`); } });
+  await queue.start();
+
+  const ok = await queue.enqueue("analysis", "a", {});
+  const failing = await queue.enqueue("analysis", "b", { fail: true });
+  const unknown = await queue.enqueue("export", "c", {});
+  await until(async () => (await storage.getActiveJob("a")) === undefined
+    && (await storage.getActiveJob("b")) === undefined && (await storage.getActiveJob("c")) === undefined);
+
+  assert.deepEqual(ran, [ok.job.id, failing.job.id]);
+  assert.equal(await status(storage, ok.job.id), "completed");
+  assert.equal(await status(storage, failing.job.id), "failed");
+  assert.equal((await storage.getJob(failing.job.id))?.error, "collector unavailable");
+  assert.equal(await status(storage, unknown.job.id), "failed");
+  assert.deepEqual(failures, [`${failing.job.id}: collector unavailable`, `${unknown.job.id}: No handler for job type export`]);
+});
+
+test("interrupted jobs are retried until they run out of attempts", async () => {
+  const storage = new MemStorage();
+  const retried = (await storage.createJob({ type: "analysis", dedupKey: "a", payload: {} }))!;
+  const exhausted = (await storage.createJob({ type: "analysis", dedupKey: "b", payload: {} }))!;
+  await storage.updateJob(retried.id, { status: "running", attempts: 1 });
+  await storage.updateJob(exhausted.id, { status: "running", attempts: 3 });
+
+  const ran: Job[] = [];
+  const failed: number[] = [];
+  const queue = new JobQueue(storage, { analysis: async (job) => { ran.push(job); } },
+    { workers: 1, onFailure: async (job) => { failed.push(job.id); } });
+  await queue.start();
+  await until(async () => (await status(storage, retried.id)) === "completed");
+
+  assert.deepEqual(ran.map(job => [job.id, job.attempts]), [[retried.id, 2]]);
+  assert.equal(await status(storage, exhausted.id), "failed");
+  assert.deepEqual(failed, [exhausted.id]);
+});
+
+test("jobs another live process is running are not taken over", async () => {
+  const storage = new MemStorage();
+  const job = (await storage.createJob({ type: "analysis", dedupKey: "a", payload: {} }))!;
+  await storage.claimNextJob("other");
+
+  const ran: number[] = [];
+  const queue = new JobQueue(storage, { analysis: async (job) => { ran.push(job.id); } }, { workers: 1 });
+  await queue.start();
+  await new Promise(resolve => setTimeout(resolve, 50));
+  assert.deepEqual(ran, []);
+  assert.equal((await storage.getJob(job.id))?.lockedBy, "other");
+});
+
+test("a lease lapses only when its worker stops heartbeating", async () => {
+  const storage = new MemStorage();
+  const mine = (await storage.createJob({ type: "analysis", dedupKey: "a", payload: {} }))!;
+  const theirs = (await storage.createJob({ type: "analysis", dedupKey: "b", payload: {} }))!;
+  await storage.claimNextJob("live");
+  await storage.claimNextJob("dead");
+
+  const minuteAgo = new Date(Date.now() - 60000);
+  await storage.updateJob(mine.id, { heartbeatAt: minuteAgo });
+  await storage.updateJob(theirs.id, { heartbeatAt: minuteAgo });
+  assert.deepEqual(await storage.requeueInterruptedJobs(minuteAgo), []);
+
+  // Renewing someone else's lease is a no-op
+  await storage.heartbeatJobs("live", [mine.id, theirs.id]);
+  const requeued = await storage.requeueInterruptedJobs(new Date(Date.now() - 1000));
+  assert.deepEqual(requeued.map(job => [job.id, job.status, job.lockedBy]), [[theirs.id, "pending", null]]);
+  assert.equal((await storage.getJob(mine.id))?.lockedBy, "live");
+  // ...until it too stops renewing
+  assert.equal((await storage.requeueInterruptedJobs(new Date(Date.now() + 1000))).length, 1);
+});
+
+test("withTimeout rejects with the stage that timed out and aborts it", async () => {
+  assert.equal(await withTimeout(async () => 1, 1000, "collect"), 1);
+
+  let stageSignal: AbortSignal | undefined;
+  await assert.rejects(withTimeout((signal) => {
+    stageSignal = signal;
+    return new Promise(() => {});
+  }, 10, "analyze"), (error: Error) => error instanceof StageTimeoutError && error.stage === "analyze");
+  assert.equal(stageSignal?.aborted, true);
+});
+
+test("a failed job aborts the work its handler started", async () => {
+  const storage = new MemStorage();
+  let jobSignal: AbortSignal | undefined;
+  const queue = new JobQueue(storage, {
+    analysis: async (job, signal) => {
+      jobSignal = signal;
+      await withTimeout(() => new Promise(() => {}), 10, "collect", signal);
+    },
+  }, { workers: 1 });
+  await queue.start();
+  const { job } = await queue.enqueue("analysis", "a", {});
+  await until(async () => (await status(storage, job.id)) === "failed");
+  assert.equal(jobSignal?.aborted, true);
+  assert.equal((await storage.getJob(job.id))?.error, "collect timed out after 0 seconds");
+});
@@ -0,0 +1,180 @@
+import { randomUUID } from "crypto";
+import { hostname } from "os";
+import type { Job } from "@shared/schema";
+import type { IStorage } from "../storage";
+
+// `signal` is aborted once the job has failed or finished, so work it started can stop
+export type JobHandler = (job: Job, signal: AbortSignal) => Promise<void>;
+
+const DEFAULT_WORKERS = parseInt(process.env.JOB_WORKERS || "2", 10);
+const POLL_INTERVAL_MS = 5000;
+const MAX_ATTEMPTS = 3;
+// Running jobs are heartbeated this often; one whose heartbeat is older than the lease is
+// taken to belong to a dead process and is re-queued by whichever process notices first
+const HEARTBEAT_INTERVAL_MS = 15000;
+const LEASE_MS = 60000;
+
+export class StageTimeoutError extends Error {
+  constructor(public stage: string, timeoutMs: number) {
+    super(`${stage} timed out after ${Math.round(timeoutMs / 1000)} seconds`);
+  }
+}
+
+/**
+ * Run a stage with a signal that is aborted when it takes longer than
+ * `timeoutMs` (or when `parent` is aborted), rejecting with StageTimeoutError
+ * right away rather than waiting for the stage to notice.
+ */
+export function withTimeout<T>(run: (signal: AbortSignal) => Promise<T>, timeoutMs: number, stage: string, parent?: AbortSignal): Promise<T> {
+  const controller = new AbortController();
+  const abortWithParent = () => controller.abort(parent!.reason);
+  parent?.addEventListener("abort", abortWithParent, { once: true });
+  if (parent?.aborted) controller.abort(parent.reason);
+
+  let timer: NodeJS.Timeout;
+  const aborted = new Promise<never>((_, reject) => {
+    timer = setTimeout(() => controller.abort(new StageTimeoutError(stage, timeoutMs)), timeoutMs);
+    controller.signal.addEventListener("abort", () => reject(controller.signal.reason), { once: true });
+    if (controller.signal.aborted) reject(controller.signal.reason);
+  });
+  return Promise.race([Promise.resolve().then(() => run(controller.signal)), aborted]).finally(() => {
+    clearTimeout(timer);
+    parent?.removeEventListener("abort", abortWithParent);
+  });
+}
+
+/**
+ * Durable job queue backed by the `jobs` table. A fixed pool of workers
+ * claims pending jobs one at a time; identical pending or running jobs are
+ * coalesced by dedup key. Several processes can share the table: each leases
+ * the jobs it runs and keeps the lease alive, and jobs whose lease lapsed
+ * (their process died or restarted) are re-queued.
+ */
+export class JobQueue {
+  private handlers: Record<string, JobHandler>;
+  private workers: number;
+  private running = 0;
+  private started = false;
+  private pollTimer: NodeJS.Timeout | null = null;
+  private heartbeatTimer: NodeJS.Timeout | null = null;
+  // Identifies this process's leases
+  private workerId = `${hostname()}:${process.pid}:${randomUUID().slice(0, 8)}`;
+  private active = new Set<number>();
+  private onFailure?: (job: Job, error: Error) => Promise<void>;
+
+  constructor(
+    private storage: IStorage,
+    handlers: Record<string, JobHandler>,
+    options: { workers?: number; onFailure?: (job: Job, error: Error) => Promise<void> } = {},
+  ) {
+    this.handlers = handlers;
+    this.workers = options.workers || DEFAULT_WORKERS;
+    this.onFailure = options.onFailure;
+  }
+
+  async start(): Promise<void> {
+    if (this.started) return;
+    this.started = true;
+
+    await this.recover();
+
+    this.pollTimer = setInterval(() => this.drain(), POLL_INTERVAL_MS);
+    this.pollTimer.unref();
+    this.heartbeatTimer = setInterval(() => {
+      this.storage.heartbeatJobs(this.workerId, Array.from(this.active))
+        .then(() => this.recover())
+        .catch((error) => console.error("Job heartbeat error:", error));
+    }, HEARTBEAT_INTERVAL_MS);
+    this.heartbeatTimer.unref();
+    this.drain();
+  }
+
+  // Re-queue jobs whose process stopped heartbeating, giving up on those interrupted too often
+  private async recover() {
+    const interrupted = await this.storage.requeueInterruptedJobs(new Date(Date.now() - LEASE_MS));
+    for (const job of interrupted) {
+      if (job.attempts >= MAX_ATTEMPTS) {
+        await this.fail(job, new Error(`Interrupted ${job.attempts} times, giving up`));
+      } else {
+        console.log(`Recovered interrupted ${job.type} job ${job.id}`);
+      }
+    }
+    if (interrupted.length > 0) this.drain();
+  }
+
+  /**
+   * Queue a job unless an identical one is already pending or running.
+   * Returns the job that will do the work and whether it was newly created.
+   */
+  async enqueue(type: string, dedupKey: string, payload: Record<string, any>): Promise<{ job: Job; created: boolean }> {
+    for (;;) {
+      const existing = await this.storage.getActiveJob(dedupKey);
+      if (existing) {
+        return { job: existing, created: false };
+      }
+
+      const job = await this.storage.createJob({ type, dedupKey, payload });
+      if (job) {
+        this.drain();
+        return { job, created: true };
+      }
+      // An identical request created it first; share that one (or retry if it already finished)
+    }
+  }
+
+  // Fill free worker slots; a worker that finished a job immediately looks for the next one
+  private drain() {
+    while (this.started && this.running < this.workers) {
+      this.running++;
+      this.runNext()
+        .then((ran) => {
+          this.running--;
+          if (ran) this.drain();
+        })
+        .catch((error) => {
+          this.running--;
+          console.error("Job worker error:", error);
+        });
+    }
+  }
+
+  private async runNext(): Promise<boolean> {
+    const job = await this.storage.claimNextJob(this.workerId);
+    if (!job) return false;
+    this.active.add(job.id);
+    try {
+      await this.run(job);
+    } finally {
+      this.active.delete(job.id);
+    }
+    return true;
+  }
+
+  private async run(job: Job) {
+    const handler = this.handlers[job.type];
+    if (!handler) {
+      await this.fail(job, new Error(`No handler for job type ${job.type}`));
+      return;
+    }
+
+    console.log(`Running ${job.type} job ${job.id} (attempt ${job.attempts})`);
+    const controller = new AbortController();
+    try {
+      await handler(job, controller.signal);
+      await this.storage.updateJob(job.id, { status: "completed", completedAt: new Date() });
+    } catch (error) {
+      controller.abort(error);
+      await this.fail(job, error instanceof Error ? error : new Error(String(error)));
+    } finally {
+      controller.abort();
+    }
+  }
+
+  private async fail(job: Job, error: Error) {
+    console.error(`${job.type} job ${job.id} failed:`, error.message);
+    await this.storage.updateJob(job.id, { status: "failed", error: error.message, completedAt: new Date() });
+    if (this.onFailure) {
+      await this.onFailure(job, error).catch((err) => console.error("Job failure handler error:", err));
+    }
+  }
+}
@@ -0,0 +1,157 @@
+"""
+Push-based rolling window of channel messages.
+Instead of scanning every channel's history on each run, the collector can
+listen for NewMessage updates on its connected client. Each channel is
+backfilled once (through the archive, so usually only the gap is fetched) and
+from then on kept current by the updates alone: arriving messages are held in
+memory for instant reads and written through to the message archive.
+Telegram only pushes updates for channels the account has joined.
+"""
+
+import asyncio
+import collections
+import time
+
+from telethon import events, utils
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.channels import JoinChannelRequest
+
+from telegram_simple import (clean_channel_name, resolve_channel, fetch_incremental, message_record,
+                             DEFAULT_BACKFILL_LIMIT, DEFAULT_CONCURRENCY, DEFAULT_CHANNEL_TIMEOUT)
+
+DEFAULT_WINDOW_MINUTES = 24 * 60
+
+
+class LiveWindow:
+    def __init__(self, store, entity_cache, limiter):
+        self.store = store
+        self.entity_cache = entity_cache
+        self.limiter = limiter
+        self.client = None
+        self.window_seconds = DEFAULT_WINDOW_MINUTES * 60
+        self.subscribed = []      # channel names from the last subscribe call
+        self.peers = {}           # marked peer id -> channel name
+        self.messages = {}        # channel name -> deque of messages, oldest first
+        self.live_since = {}      # channel name -> start of its gap-free coverage
+        self.received = 0
+
+    def attach(self, client):
+        """Receive updates on `client`; coverage built on a previous connection is discarded"""
+        if self.client is client:
+            return
+        if self.client is not None:
+            self.client.remove_event_handler(self.on_message)
+        self.client = client
+        # Updates sent while we were disconnected are lost, so every channel needs a new backfill
+        self.peers.clear()
+        self.messages.clear()
+        self.live_since.clear()
+        client.add_event_handler(self.on_message, events.NewMessage())
+
+    async def subscribe(self, client, channels, window_minutes=DEFAULT_WINDOW_MINUTES, join=True,
+                        timeout=DEFAULT_CHANNEL_TIMEOUT, concurrency=DEFAULT_CONCURRENCY):
+        """Listen to exactly `channels`, backfilling the ones not already live.
+
+        With `join`, channels the account isn't a member of are joined so Telegram pushes their updates.
+        Returns one report per channel.
+        """
+        self.attach(client)
+        window_seconds = window_minutes * 60
+        if window_seconds > self.window_seconds:
+            # Existing coverage only reaches back over the old window
+            self.live_since.clear()
+        self.window_seconds = window_seconds
+
+        names = list(dict.fromkeys(clean_channel_name(c) for c in channels if c.strip()))
+        self.subscribed = names
+        for peer_id, name in list(self.peers.items()):
+            if name not in names:
+                del self.peers[peer_id]
+                self.messages.pop(name, None)
+                self.live_since.pop(name, None)
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def subscribe_one(name):
+            async with semaphore:
+                return await self._subscribe_channel(client, name, join, timeout)
+
+        return await asyncio.gather(*(subscribe_one(name) for name in names))
+
+    async def _subscribe_channel(self, client, name, join, timeout):
+        if name in self.live_since:
+            return {'channel': name, 'status': 'ok', 'messages': len(self.messages[name])}
+
+        try:
+            peer, _ = await resolve_channel(client, name, self.limiter, timeout, self.entity_cache)
+            if join:
+                await self.limiter.acquire()
+                await asyncio.wait_for(client(JoinChannelRequest(peer)), timeout)
+
+            # Route updates before backfilling so nothing posted meanwhile falls between the two
+            self.peers[utils.get_peer_id(peer)] = name
+            cutoff_ts = int(time.time()) - self.window_seconds
+            await fetch_incremental(client, peer, name, cutoff_ts, self.store, self.limiter, timeout,
+                                    backfill_limit=DEFAULT_BACKFILL_LIMIT)
+
+            # The archive now holds the backfill plus anything pushed while it ran
+            window = self.store.window(name, cutoff_ts)
+            self.messages[name] = collections.deque(reversed(window))
+            self.live_since[name] = max(cutoff_ts, self.store.get_state(name)[1])
+            print(f"Listening to {name} ({len(window)} messages in window)")
+            return {'channel': name, 'status': 'ok', 'messages': len(window)}
+        except FloodWaitError as e:
+            self.limiter.flood_wait(e.seconds)
+            error = f"FloodWait of {e.seconds}s"
+        except asyncio.TimeoutError:
+            error = f"Timed out after {timeout}s"
+        except Exception as e:
+            error = str(e)
+
+        print(f"Could not listen to {name}: {error}")
+        return {'channel': name, 'status': 'error', 'messages': 0, 'error': error}
+
+    async def on_message(self, event):
+        name = self.peers.get(event.chat_id)
+        if name is None:
+            return
+
+        self.received += 1
+        record = message_record(event.message, name)
+        if record:
+            self.store.add_messages([record])
+
+        if name not in self.live_since:
+            return  # still backfilling; the archive copy is picked up when it finishes
+
+        if record:
+            self.messages[name].append(record)
+        self._prune(name)
+        last_id, covered_since, _ = self.store.get_state(name)
+        self.store.set_state(name, max(last_id, event.message.id), covered_since, checked_at=time.time())
+
+    def _prune(self, name):
+        cutoff_ts = time.time() - self.window_seconds
+        messages = self.messages[name]
+        while messages and messages[0]['date'] < cutoff_ts:
+            messages.popleft()
+
+    def covers(self, name, since):
+        """True when the window for `name` is gap-free from `since` up to now"""
+        if self.client is None or not self.client.is_connected() or name not in self.live_since:
+            return False
+        return since >= max(self.live_since[name], time.time() - self.window_seconds)
+
+    def window(self, name, since):
+        """Messages for a live channel dated at or after `since`, newest first"""
+        self._prune(name)
+        return [m for m in reversed(self.messages[name]) if m['date'] >= since]
+
+    def stats(self):
+        return {
+            'channels': len(self.subscribed),
+            'live': len(self.live_since),
+            'buffered': sum(len(m) for m in self.messages.values()),
+            'received': self.received,
+            'windowMinutes': self.window_seconds // 60,
+        }
@@ -0,0 +1,95 @@
+import { createHash } from "crypto";
+import type { TelegramMessage } from "./telegram";
+
+export interface LLMCacheStats {
+  entries: number;
+  hits: number;
+  misses: number;
+  evictions: number;
+}
+
+interface CacheEntry<T> {
+  value: T;
+  storedAt: number;
+}
+
+const DEFAULT_MAX_ENTRIES = parseInt(process.env.LLM_CACHE_MAX_ENTRIES || "500", 10);
+const DEFAULT_MAX_AGE_MS = parseInt(process.env.LLM_CACHE_MAX_AGE_MINUTES || "360", 10) * 60 * 1000;
+
+/**
+ * Content-addressed cache for LLM results. Keys hash the model, the system
+ * prompt and a fingerprint of the messages, so identical requests are
+ * answered without calling OpenAI. Bounded by entry count (LRU) and age.
+ */
+export class LLMCache {
+  private entries = new Map<string, CacheEntry<unknown>>();
+  private hits = 0;
+  private misses = 0;
+  private evictions = 0;
+
+  constructor(
+    private maxEntries = DEFAULT_MAX_ENTRIES,
+    private maxAgeMs = DEFAULT_MAX_AGE_MS,
+  ) {}
+
+  static key(...parts: string[]): string {
+    const hash = createHash("sha256");
+    parts.forEach(part => hash.update(part).update("\u0000"));
+    return hash.digest("hex");
+  }
+
+  get<T>(key: string): T | undefined {
+    const entry = this.entries.get(key);
+    if (!entry) {
+      this.misses++;
+      return undefined;
+    }
+
+    if (Date.now() - entry.storedAt > this.maxAgeMs) {
+      this.entries.delete(key);
+      this.evictions++;
+      this.misses++;
+      return undefined;
+    }
+
+    // Re-insert to mark as most recently used
+    this.entries.delete(key);
+    this.entries.set(key, entry);
+    this.hits++;
+    return entry.value as T;
+  }
+
+  set<T>(key: string, value: T): void {
+    this.entries.delete(key);
+    this.entries.set(key, { value, storedAt: Date.now() });
+
+    while (this.entries.size > this.maxEntries) {
+      const oldest = this.entries.keys().next().value as string;
+      this.entries.delete(oldest);
+      this.evictions++;
+    }
+  }
+
+  stats(): LLMCacheStats {
+    return {
+      entries: this.entries.size,
+      hits: this.hits,
+      misses: this.misses,
+      evictions: this.evictions,
+    };
+  }
+}
+
+/**
+ * Order-independent fingerprint of a message set: the same messages collected
+ * in a different order (or from a re-run) hash to the same value.
+ */
+export function fingerprintMessages(messages: TelegramMessage[]): string {
+  const ids = messages
+    .map(m => `${m.channel}:${m.id}:${m.duplicateCount || 1}:${createHash("sha1").update(m.text).digest("hex")}`)
+    .sort();
+  return LLMCache.key(...ids);
+}
+
+// Shared by every OpenAIService instance in the process
+export const llmCache = new LLMCache();
@@ -0,0 +1,312 @@
+"""
+Local archive of collected messages.
+Every message is kept keyed by (channel, message id) with indexes on channel
+and date. Per channel we also track the newest message id seen, how far back
+the archived history is complete and when Telegram was last checked, so later
+runs only fetch the gap the archive doesn't cover. Message text and channel
+are full-text indexed with FTS5, kept in sync by triggers, and every edited
+text is logged for the semantic index to re-embed.
+"""
+
+import re
+import sqlite3
+import time
+
+# Engagement counts as of collection time, stored next to the text
+ENGAGEMENT_FIELDS = ('views', 'forwards', 'replies', 'reactions')
+
+_MESSAGES_TABLE = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        -- The rowid; AUTOINCREMENT so a pruned message's rowid, which the semantic index may still hold, is never reused
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        date INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        url TEXT,
+        views INTEGER NOT NULL DEFAULT 0,
+        forwards INTEGER NOT NULL DEFAULT 0,
+        replies INTEGER NOT NULL DEFAULT 0,
+        reactions INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (channel, id)
+    );
+"""
+
+_QUERY_TOKEN = re.compile(r'"([^"]*)"|(-?)([^\W_]+)(\*?)')
+
+
+def fts_query(text):
+    """FTS5 query for free text: quoted phrases, a leading '-' excludes a word, a trailing '*' is a prefix"""
+    include, exclude = [], []
+    for phrase, minus, word, star in _QUERY_TOKEN.findall(text):
+        if phrase.strip():
+            include.append('"' + phrase.replace('"', '') + '"')
+        elif word:
+            (exclude if minus else include).append(f'"{word}"{star}')
+    if not include:
+        return None
+    query = ' '.join(include)
+    return f"{query} NOT {' NOT '.join(exclude)}" if exclude else query
+
+
+class MessageStore:
+    def __init__(self, path, retention=None):
+        self.path = path
+        self.retention = retention  # seconds to keep messages, None keeps everything
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self._upgrade_messages()
+        self.db.executescript(_MESSAGES_TABLE.format(name='messages') + """
+            CREATE INDEX IF NOT EXISTS idx_messages_date ON messages (date);
+            CREATE INDEX IF NOT EXISTS idx_messages_channel_date ON messages (channel, date);
+            CREATE TABLE IF NOT EXISTS channel_state (
+                channel TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL,
+                covered_since INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS boilerplate (
+                channel TEXT NOT NULL,
+                line TEXT NOT NULL,
+                seen_at REAL NOT NULL,
+                PRIMARY KEY (channel, line)
+            );
+            CREATE TABLE IF NOT EXISTS text_edits (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                message INTEGER NOT NULL
+            );
+            CREATE TRIGGER IF NOT EXISTS messages_text_edited AFTER UPDATE OF text ON messages
+            WHEN old.text IS NOT new.text BEGIN
+                INSERT INTO text_edits (message) VALUES (new.rowid);
+            END;
+        """)
+        self._create_text_index()
+        self.db.commit()
+
+    def _upgrade_messages(self):
+        """Rebuild a messages table from before AUTOINCREMENT rowids (and engagement counts), keeping every rowid
+
+        Indexes and triggers go with the old table and are recreated by __init__; the
+        full-text index refers to rowids, which don't change, so it stays valid.
+        """
+        row = self.db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'messages'").fetchone()
+        if row is None or 'AUTOINCREMENT' in row[0].upper():
+            return
+        columns = {info[1] for info in self.db.execute("PRAGMA table_info(messages)")}
+        engagement = ', '.join(field if field in columns else '0' for field in ENGAGEMENT_FIELDS)
+        self.db.executescript("BEGIN;" + _MESSAGES_TABLE.format(name='messages_upgraded') + f"""
+            INSERT INTO messages_upgraded (seq, channel, id, date, text, url, {', '.join(ENGAGEMENT_FIELDS)})
+            SELECT rowid, channel, id, date, text, url, {engagement} FROM messages ORDER BY rowid;
+            DROP TABLE messages;
+            ALTER TABLE messages_upgraded RENAME TO messages;
+            COMMIT;
+        """)
+
+    def _create_text_index(self):
+        """External-content FTS5 table over messages, built once for archives that predate it"""
+        exists = self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+        self.db.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                text, channel, content = 'messages', content_rowid = 'rowid',
+                tokenize = 'unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, text, channel) VALUES (new.rowid, new.text, new.channel);
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, text, channel)
+                VALUES ('delete', old.rowid, old.text, old.channel);
+            END;
+            -- Re-fetches mostly refresh engagement; only an edited text touches the index
+            CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF text ON messages
+            WHEN old.text IS NOT new.text BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, text, channel)
+                VALUES ('delete', old.rowid, old.text, old.channel);
+                INSERT INTO messages_fts (rowid, text, channel) VALUES (new.rowid, new.text, new.channel);
+            END;
+        """)
+        if not exists:
+            self.db.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+    def get_state(self, channel):
+        """Return (last_id, covered_since, checked_at) or None if the channel was never collected"""
+        return self.db.execute(
+            "SELECT last_id, covered_since, updated_at FROM channel_state WHERE channel = ?", (channel,)
+        ).fetchone()
+
+    def set_state(self, channel, last_id, covered_since, checked_at=None):
+        """Record the channel's coverage; `checked_at` is only moved when Telegram was asked for new messages"""
+        if checked_at is None:
+            self.db.execute(
+                "UPDATE channel_state SET last_id = ?, covered_since = ? WHERE channel = ?",
+                (last_id, covered_since, channel)
+            )
+        else:
+            self.db.execute(
+                "INSERT OR REPLACE INTO channel_state (channel, last_id, covered_since, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (channel, last_id, covered_since, checked_at)
+            )
+        self.db.commit()
+
+    def is_fresh(self, channel, since, max_staleness):
+        """True when the archive covers everything from `since` and was checked recently enough"""
+        state = self.get_state(channel)
+        return bool(state) and state[1] <= since and time.time() - state[2] <= max_staleness
+
+    def add_messages(self, messages):
+        # Upsert rather than replace: a re-fetched message keeps its rowid, which the semantic index follows
+        self.db.executemany(
+            "INSERT INTO messages (channel, id, date, text, url, views, forwards, replies, reactions) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (channel, id) DO UPDATE SET date = excluded.date, text = excluded.text, url = excluded.url, "
+            "views = excluded.views, forwards = excluded.forwards, replies = excluded.replies, "
+            "reactions = excluded.reactions",
+            [(m['channel'], m['id'], m['date'], m['text'], m.get('url'),
+              *(m.get(field, 0) for field in ENGAGEMENT_FIELDS)) for m in messages]
+        )
+        self.db.commit()
+
+    def window(self, channel, since):
+        """Archived messages for a channel dated at or after `since` (unix seconds), newest first"""
+        rows = self.db.execute(
+            "SELECT id, text, date, channel, url, views, forwards, replies, reactions FROM messages "
+            "WHERE channel = ? AND date >= ? ORDER BY id DESC",
+            (channel, since)
+        )
+        return [{'id': r[0], 'text': r[1], 'date': r[2], 'channel': r[3], 'url': r[4],
+                 **dict(zip(ENGAGEMENT_FIELDS, r[5:]))} for r in rows]
+
+    def rows_after(self, rowid, limit):
+        """Messages in insertion order after `rowid`: [(rowid, channel, id, date, text)]"""
+        return self.db.execute(
+            "SELECT rowid, channel, id, date, text FROM messages WHERE rowid > ? ORDER BY rowid LIMIT ?", (rowid, limit)
+        ).fetchall()
+
+    def edits_after(self, seq, limit):
+        """Messages whose text changed after edit `seq`, oldest edit first: [(seq, rowid, channel, id, date, text)]"""
+        return self.db.execute(
+            "SELECT e.seq, m.rowid, m.channel, m.id, m.date, m.text FROM text_edits e "
+            "JOIN messages m ON m.rowid = e.message WHERE e.seq > ? ORDER BY e.seq LIMIT ?", (seq, limit)
+        ).fetchall()
+
+    def forget_edits(self, seq):
+        """Drop the edit log up to `seq` once it has been applied"""
+        self.db.execute("DELETE FROM text_edits WHERE seq <= ?", (seq,))
+        self.db.commit()
+
+    def reserve_rowids(self, rowid):
+        """Never assign rowids up to `rowid`, e.g. ones pruned messages had that the semantic index still holds"""
+        self.db.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'messages' AND seq < ?", (rowid, rowid))
+        self.db.execute(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'messages', ? "
+            "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'messages')", (rowid,)
+        )
+        self.db.commit()
+
+    def max_rowid(self):
+        return self.db.execute("SELECT COALESCE(MAX(rowid), 0) FROM messages").fetchone()[0]
+
+    def lookup(self, keys):
+        """Archived messages for (channel, id) pairs, in the same order; pruned ones are left out"""
+        result = []
+        for channel, message_id in keys:
+            r = self.db.execute(
+                "SELECT id, text, date, channel, url, views, forwards, replies, reactions FROM messages "
+                "WHERE channel = ? AND id = ?", (channel, message_id)
+            ).fetchone()
+            if r:
+                result.append({'id': r[0], 'text': r[1], 'date': r[2], 'channel': r[3], 'url': r[4],
+                               **dict(zip(ENGAGEMENT_FIELDS, r[5:]))})
+        return result
+
+    def search(self, query, limit=20, offset=0, channels=None, since=None, until=None):
+        """Messages matching a free-text query (see fts_query()), best match first.
+
+        Each carries a 'snippet' with the matches marked and its bm25 'rank' (lower is better).
+        """
+        match = fts_query(query)
+        if match is None:
+            return []
+        conditions, params = ["messages_fts MATCH ?"], [match]
+        if channels is not None:
+            conditions.append(f"m.channel IN ({', '.join('?' * len(channels))})")
+            params.extend(channels)
+        if since is not None:
+            conditions.append("m.date >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("m.date < ?")
+            params.append(until)
+        rows = self.db.execute(
+            "SELECT m.id, m.text, m.date, m.channel, m.url, m.views, m.forwards, m.replies, m.reactions, "
+            "snippet(messages_fts, 0, '«', '»', '…', 24), bm25(messages_fts, 1.0, 0.5) AS rank "
+            "FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid "
+            f"WHERE {' AND '.join(conditions)} ORDER BY rank, m.date DESC LIMIT ? OFFSET ?",
+            (*params, limit, offset)
+        )
+        return [{'id': r[0], 'text': r[1], 'date': r[2], 'channel': r[3], 'url': r[4],
+                 **dict(zip(ENGAGEMENT_FIELDS, r[5:9])), 'snippet': r[9], 'rank': round(r[10], 4)} for r in rows]
+
+    def export_page(self, after=None, limit=5000, channels=None, since=None, until=None):
+        """One page of archived messages oldest first, keyset-paginated on (date, rowid).
+
+        Returns (messages, cursor of the last one) - pass the cursor back as `after` for
+        the next page; a page shorter than `limit` is the last one.
+        """
+        conditions, params = [], []
+        if after is not None:
+            conditions.append("(date, rowid) > (?, ?)")
+            params.extend(after)
+        if channels is not None:
+            conditions.append(f"channel IN ({', '.join('?' * len(channels))})")
+            params.extend(channels)
+        if since is not None:
+            conditions.append("date >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("date < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.db.execute(
+            "SELECT rowid, channel, id, date, text, url, views, forwards, replies, reactions FROM messages "
+            f"{where} ORDER BY date, rowid LIMIT ?",
+            (*params, limit)
+        ).fetchall()
+        messages = [{'channel': r[1], 'id': r[2], 'date': r[3], 'text': r[4], 'url': r[5],
+                     **dict(zip(ENGAGEMENT_FIELDS, r[6:]))} for r in rows]
+        return messages, [rows[-1][3], rows[-1][0]] if rows else None
+
+    def boilerplate(self, channel, since=0):
+        """Boilerplate line keys learned for a channel (see preprocess.py), seen at or after `since`"""
+        rows = self.db.execute("SELECT line FROM boilerplate WHERE channel = ? AND seen_at >= ?", (channel, since))
+        return {r[0] for r in rows}
+
+    def remember_boilerplate(self, channel, lines):
+        now = time.time()
+        self.db.executemany(
+            "INSERT OR REPLACE INTO boilerplate (channel, line, seen_at) VALUES (?, ?, ?)",
+            [(channel, line, now) for line in lines]
+        )
+        self.db.commit()
+
+    def prune(self, limit=-1):
+        """Drop up to `limit` messages older than the retention period, if one is set; returns how many"""
+        if not self.retention:
+            return 0
+        cutoff = int(time.time() - self.retention)
+        deleted = self.db.execute(
+            "DELETE FROM messages WHERE rowid IN (SELECT rowid FROM messages WHERE date < ? LIMIT ?)", (cutoff, limit)
+        ).rowcount
+        self.db.execute("UPDATE channel_state SET covered_since = ? WHERE covered_since < ?", (cutoff, cutoff))
+        self.db.execute("DELETE FROM text_edits WHERE message NOT IN (SELECT rowid FROM messages)")
+        self.db.commit()
+        return deleted
+
+    def stats(self):
+        messages = self.db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        channels = self.db.execute("SELECT COUNT(*) FROM channel_state").fetchone()[0]
+        return {'messages': messages, 'channels': channels}
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,175 @@
+import { llmCache } from "./llm-cache";
+
+type Labels = Record<string, string | number | boolean | null | undefined>;
+
+// Seconds; covers sub-millisecond parses up to multi-minute collections
+const DEFAULT_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300];
+
+function labelKey(labels: Labels): string {
+  return Object.keys(labels)
+    .filter(name => labels[name] !== undefined && labels[name] !== null)
+    .sort()
+    .map(name => `${name}="${String(labels[name]).replace(/\\/g, "\\\\").replace(/"/g, '\\"').replace(/\n/g, "\\n")}"`)
+    .join(",");
+}
+
+function seriesName(name: string, key: string, extra = ""): string {
+  const labels = [key, extra].filter(Boolean).join(",");
+  return labels ? `${name}{${labels}}` : name;
+}
+
+interface Metric {
+  render(): string[];
+}
+
+export class Counter implements Metric {
+  private values = new Map<string, number>();
+
+  constructor(public name: string, private help: string) {}
+
+  inc(labels: Labels = {}, value = 1) {
+    const key = labelKey(labels);
+    this.values.set(key, (this.values.get(key) || 0) + value);
+  }
+
+  render(): string[] {
+    const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} counter`];
+    this.values.forEach((value, key) => lines.push(`${seriesName(this.name, key)} ${value}`));
+    return lines;
+  }
+}
+
+export class Gauge implements Metric {
+  constructor(public name: string, private help: string, private collect: () => Array<[Labels, number]>) {}
+
+  render(): string[] {
+    const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} gauge`];
+    this.collect().forEach(([labels, value]) => lines.push(`${seriesName(this.name, labelKey(labels))} ${value}`));
+    return lines;
+  }
+}
+
+export class Histogram implements Metric {
+  private series = new Map<string, { counts: number[]; sum: number; count: number }>();
+
+  constructor(public name: string, private help: string, private buckets = DEFAULT_BUCKETS) {}
+
+  observe(labels: Labels, seconds: number) {
+    const key = labelKey(labels);
+    let series = this.series.get(key);
+    if (!series) {
+      series = { counts: new Array(this.buckets.length).fill(0), sum: 0, count: 0 };
+      this.series.set(key, series);
+    }
+    const bucket = this.buckets.findIndex(bound => seconds <= bound);
+    if (bucket >= 0) series.counts[bucket]++;
+    series.sum += seconds;
+    series.count++;
+  }
+
+  // Time an async operation; failures are recorded with error="true"
+  async time<T>(labels: Labels, fn: () => Promise<T>): Promise<T> {
+    const started = performance.now();
+    try {
+      const result = await fn();
+      this.observe(labels, (performance.now() - started) / 1000);
+      return result;
+    } catch (error) {
+      this.observe({ ...labels, error: true }, (performance.now() - started) / 1000);
+      throw error;
+    }
+  }
+
+  render(): string[] {
+    const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} histogram`];
+    this.series.forEach((series, key) => {
+      let cumulative = 0;
+      this.buckets.forEach((bound, i) => {
+        cumulative += series.counts[i];
+        lines.push(`${seriesName(`${this.name}_bucket`, key, `le="${bound}"`)} ${cumulative}`);
+      });
+      lines.push(`${seriesName(`${this.name}_bucket`, key, 'le="+Inf"')} ${series.count}`);
+      lines.push(`${seriesName(`${this.name}_sum`, key)} ${series.sum}`);
+      lines.push(`${seriesName(`${this.name}_count`, key)} ${series.count}`);
+    });
+    return lines;
+  }
+}
+
+/**
+ * Sum and count without buckets, for labels with many values (one series
+ * pair per channel instead of one per bucket).
+ */
+export class Summary implements Metric {
+  private series = new Map<string, { sum: number; count: number }>();
+
+  constructor(public name: string, private help: string) {}
+
+  observe(labels: Labels, seconds: number) {
+    const key = labelKey(labels);
+    const series = this.series.get(key) || { sum: 0, count: 0 };
+    series.sum += seconds;
+    series.count++;
+    this.series.set(key, series);
+  }
+
+  render(): string[] {
+    const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} summary`];
+    this.series.forEach((series, key) => {
+      lines.push(`${seriesName(`${this.name}_sum`, key)} ${series.sum}`);
+      lines.push(`${seriesName(`${this.name}_count`, key)} ${series.count}`);
+    });
+    return lines;
+  }
+}
+
+class Registry {
+  private metrics: Metric[] = [];
+
+  register<T extends Metric>(metric: T): T {
+    this.metrics.push(metric);
+    return metric;
+  }
+
+  // Prometheus text exposition format
+  render(): string {
+    return this.metrics.flatMap(metric => metric.render()).join("\n") + "\n";
+  }
+}
+
+export const registry = new Registry();
+
+export const analysisStageDuration = registry.register(new Histogram(
+  "analysis_stage_duration_seconds", "Duration of each analysis stage (queue, collect, analyze, total)"));
+export const collectorSpanDuration = registry.register(new Histogram(
+  "collector_span_duration_seconds", "Timing spans reported by the Python collector (connect, resolve, fetch, ...)"));
+export const collectorChannelFetch = registry.register(new Summary(
+  "collector_channel_fetch_seconds", "Time spent fetching history per channel"));
+export const collectorSpawnDuration = registry.register(new Histogram(
+  "collector_spawn_duration_seconds", "Time from spawning the collector process until it is ready"));
+export const collectorParseDuration = registry.register(new Histogram(
+  "collector_response_parse_duration_seconds", "JSON.parse time for collector responses", [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1]));
+export const llmRequestDuration = registry.register(new Histogram(
+  "llm_request_duration_seconds", "OpenAI chat completion latency"));
+export const llmPromptTokens = registry.register(new Counter(
+  "llm_prompt_tokens_total", "Prompt tokens sent to OpenAI"));
+export const llmQueueWait = registry.register(new Histogram(
+  "llm_queue_wait_seconds", "Time OpenAI requests wait in the shared scheduler for their priority and rate budget"));
+export const llmSchedulerEvents = registry.register(new Counter(
+  "llm_scheduler_events_total", "OpenAI scheduler retries, rate limit responses (429), requests given up on and aborted ones"));
+export const promptMessagesSelected = registry.register(new Counter(
+  "llm_prompt_messages_total", "Collected messages kept for (selected=true) or dropped from (selected=false) the prompt budget"));
+export const dbQueryDuration = registry.register(new Histogram(
+  "db_query_duration_seconds", "Storage call latency by method", [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5]));
+registry.register(new Gauge("llm_cache_events", "LLM result cache entries, hits, misses and evictions since start",
+  () => Object.entries(llmCache.stats()).map(([kind, value]) => [{ kind }, value])));
+
+// Spans forwarded by telegram_collector.py as 'span' notifications
+export function observeCollectorSpan(span: { name: string; durationMs: number; labels?: Labels; error?: string | null }) {
+  const seconds = span.durationMs / 1000;
+  const labels = span.labels || {};
+  collectorSpanDuration.observe({ span: span.name, error: span.error ? true : undefined }, seconds);
+  if (span.name === "fetch" && labels.channel) {
+    collectorChannelFetch.observe({ channel: labels.channel }, seconds);
+  }
+}
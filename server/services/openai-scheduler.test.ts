@@ -0,0 +1,29 @@
+import { test } from "node:test";
+import assert from "node:assert/strict";
+import { OpenAIScheduler, PRIORITY_PART } from "./openai-scheduler";
+
+test("an aborted request leaves the queue without running", async () => {
+  const scheduler = new OpenAIScheduler(1000, 100000, 1);
+  // Holds the only in-flight slot
+  scheduler.schedule({ priority: PRIORITY_PART, tokens: 10 }, () => new Promise(() => {}));
+
+  const controller = new AbortController();
+  let ran = false;
+  const queued = scheduler.schedule({ priority: PRIORITY_PART, tokens: 10, signal: controller.signal }, async () => {
+    ran = true;
+    return { result: 1 };
+  });
+  assert.equal(scheduler.stats().queued, 1);
+
+  controller.abort(new Error("stage timed out"));
+  await assert.rejects(queued, /stage timed out/);
+  assert.equal(scheduler.stats().queued, 0);
+  assert.equal(ran, false);
+});
+
+test("a request whose signal is already aborted is never queued", async () => {
+  const scheduler = new OpenAIScheduler();
+  await assert.rejects(scheduler.schedule({ priority: PRIORITY_PART, tokens: 10, signal: AbortSignal.abort(new Error("gone")) },
+    async () => ({ result: 1 })), /gone/);
+  assert.equal(scheduler.stats().queued, 0);
+});
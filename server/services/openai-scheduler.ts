@@ -0,0 +1,276 @@
+import OpenAI from "openai";
+import { Gauge, llmQueueWait, llmSchedulerEvents, registry } from "./metrics";
+
+// Defaults until the first response reports the account's actual limits in its headers
+const DEFAULT_RPM = parseInt(process.env.OPENAI_RPM || "500", 10);
+const DEFAULT_TPM = parseInt(process.env.OPENAI_TPM || "200000", 10);
+const MAX_IN_FLIGHT = parseInt(process.env.OPENAI_MAX_IN_FLIGHT || "32", 10);
+const MAX_RETRIES = 5;
+const BASE_BACKOFF_MS = 1000;
+const MAX_BACKOFF_MS = 60000;
+
+// Higher runs first: a final or single-request report before the parts of a map-reduce
+export const PRIORITY_PART = 0;
+export const PRIORITY_FINAL = 1;
+export const PRIORITY_INTERACTIVE = 2;
+
+export interface ScheduledResult<T> {
+  result: T;
+  // Response headers, to follow the account's x-ratelimit-* state
+  headers?: Headers;
+  // Tokens the request actually used, to return what the estimate over-reserved
+  usedTokens?: number;
+}
+
+interface QueuedRequest {
+  priority: number;
+  seq: number;
+  tokens: number;
+  attempt: number;
+  queuedAt: number;
+  signal?: AbortSignal;
+  run: () => Promise<ScheduledResult<any>>;
+  resolve: (result: any) => void;
+  reject: (error: unknown) => void;
+}
+
+// Refills continuously at capacity per minute, like OpenAI's own limiter
+class Bucket {
+  level: number;
+  private updatedAt = Date.now();
+
+  constructor(public capacity: number) {
+    this.level = capacity;
+  }
+
+  refill(now = Date.now()) {
+    this.level = Math.min(this.capacity, this.level + ((now - this.updatedAt) / 60000) * this.capacity);
+    this.updatedAt = now;
+  }
+
+  // Milliseconds until `amount` is available (0 when it already is)
+  waitFor(amount: number): number {
+    this.refill();
+    return this.level >= amount ? 0 : Math.ceil(((amount - this.level) / this.capacity) * 60000);
+  }
+}
+
+// "6m0s", "1.5s", "20ms" as used by x-ratelimit-reset-* headers
+function parseDuration(value: string | null): number | null {
+  if (!value) return null;
+  let ms = 0;
+  let matched = false;
+  for (const [, amount, unit] of Array.from(value.matchAll(/(\d+(?:\.\d+)?)(ms|s|m|h)/g))) {
+    matched = true;
+    ms += parseFloat(amount) * { ms: 1, s: 1000, m: 60000, h: 3600000 }[unit as "ms" | "s" | "m" | "h"];
+  }
+  return matched ? ms : null;
+}
+
+function retryAfterMs(headers: Headers | undefined): number | null {
+  if (!headers?.get) return null;
+  const ms = parseFloat(headers.get("retry-after-ms") || "");
+  if (!isNaN(ms)) return ms;
+  const seconds = parseFloat(headers.get("retry-after") || "");
+  if (!isNaN(seconds)) return seconds * 1000;
+  return parseDuration(headers.get("x-ratelimit-reset-tokens")) ?? parseDuration(headers.get("x-ratelimit-reset-requests"));
+}
+
+function isRetryable(error: unknown): boolean {
+  if (error instanceof OpenAI.APIConnectionError) return true;
+  if (error instanceof OpenAI.APIError) {
+    const status = error.status ?? 0;
+    return status === 408 || status === 409 || status === 429 || status >= 500;
+  }
+  return false;
+}
+
+/**
+ * Process-wide queue in front of one OpenAI API key. Every request declares
+ * its token cost up front (estimated prompt plus max_tokens, which OpenAI
+ * counts against the limit) and waits until both the requests-per-minute and
+ * tokens-per-minute budgets have room, highest priority first and FIFO within
+ * a priority. Budgets follow the x-ratelimit-* headers of each response. A 429
+ * pauses the whole queue for as long as the server asks, and failed requests
+ * retry with jittered exponential backoff in their original queue position.
+ */
+export class OpenAIScheduler {
+  private requests: Bucket;
+  private tokens: Bucket;
+  private queue: QueuedRequest[] = [];
+  private inFlight = 0;
+  private seq = 0;
+  private pausedUntil = 0;
+  private timer: NodeJS.Timeout | null = null;
+
+  constructor(rpm = DEFAULT_RPM, tpm = DEFAULT_TPM, private maxInFlight = MAX_IN_FLIGHT) {
+    this.requests = new Bucket(rpm);
+    this.tokens = new Bucket(tpm);
+  }
+
+  /**
+   * Run `run` once the budgets allow. An aborted `signal` takes the request out
+   * of the queue (or stops its retries) and rejects with the abort reason; a
+   * request already sent should pass the signal on to the client itself.
+   */
+  schedule<T>(options: { priority: number; tokens: number; signal?: AbortSignal }, run: () => Promise<ScheduledResult<T>>): Promise<T> {
+    const { signal } = options;
+    return new Promise<T>((resolve, reject) => {
+      if (signal?.aborted) {
+        return reject(signal.reason);
+      }
+      const request: QueuedRequest = {
+        priority: options.priority,
+        seq: this.seq++,
+        tokens: options.tokens,
+        attempt: 0,
+        queuedAt: Date.now(),
+        signal,
+        run,
+        resolve: (result) => {
+          signal?.removeEventListener("abort", onAbort);
+          resolve(result);
+        },
+        reject: (error) => {
+          signal?.removeEventListener("abort", onAbort);
+          reject(error);
+        },
+      };
+      const onAbort = () => {
+        const index = this.queue.indexOf(request);
+        if (index >= 0) {
+          this.queue.splice(index, 1);
+          llmSchedulerEvents.inc({ event: "aborted" });
+          request.reject(signal!.reason);
+          this.pump();
+        }
+      };
+      signal?.addEventListener("abort", onAbort, { once: true });
+      this.enqueue(request);
+    });
+  }
+
+  stats() {
+    this.requests.refill();
+    this.tokens.refill();
+    return {
+      queued: this.queue.length,
+      inFlight: this.inFlight,
+      requestsAvailable: Math.floor(this.requests.level),
+      tokensAvailable: Math.floor(this.tokens.level),
+    };
+  }
+
+  private enqueue(request: QueuedRequest) {
+    // Sorted by priority, then arrival; a retried request keeps its place
+    let index = this.queue.length;
+    while (index > 0 && this.before(request, this.queue[index - 1])) index--;
+    this.queue.splice(index, 0, request);
+    this.pump();
+  }
+
+  private before(a: QueuedRequest, b: QueuedRequest): boolean {
+    return a.priority > b.priority || (a.priority === b.priority && a.seq < b.seq);
+  }
+
+  private pump() {
+    if (this.timer) {
+      clearTimeout(this.timer);
+      this.timer = null;
+    }
+    while (this.queue.length > 0 && this.inFlight < this.maxInFlight) {
+      const next = this.queue[0];
+      // A request larger than the whole budget would never fit; it waits for a full bucket instead
+      const tokens = Math.min(next.tokens, this.tokens.capacity);
+      const wait = Math.max(this.pausedUntil - Date.now(), this.requests.waitFor(1), this.tokens.waitFor(tokens));
+      if (wait > 0) {
+        // Strictly in order: a smaller request behind it doesn't overtake a waiting one
+        this.timer = setTimeout(() => this.pump(), wait);
+        return;
+      }
+      this.queue.shift();
+      this.requests.level -= 1;
+      this.tokens.level -= tokens;
+      this.start(next, tokens);
+    }
+  }
+
+  private async start(request: QueuedRequest, reserved: number) {
+    this.inFlight++;
+    if (request.attempt === 0) {
+      llmQueueWait.observe({}, (Date.now() - request.queuedAt) / 1000);
+    }
+    try {
+      const { result, headers, usedTokens } = await request.run();
+      if (usedTokens !== undefined) {
+        this.tokens.level = Math.min(this.tokens.capacity, this.tokens.level + reserved - usedTokens);
+      }
+      this.follow(headers);
+      request.resolve(result);
+    } catch (error) {
+      const headers = error instanceof OpenAI.APIError ? (error.headers as Headers | undefined) : undefined;
+      this.follow(headers);
+      if (request.signal?.aborted) {
+        request.reject(request.signal.reason);
+      } else if (!isRetryable(error) || request.attempt >= MAX_RETRIES) {
+        llmSchedulerEvents.inc({ event: "failed" });
+        request.reject(error);
+      } else {
+        const serverDelay = retryAfterMs(headers);
+        if (error instanceof OpenAI.APIError && error.status === 429) {
+          llmSchedulerEvents.inc({ event: "rate_limited" });
+          // The limit is shared, so nothing else goes out until it resets either
+          this.pausedUntil = Math.max(this.pausedUntil, Date.now() + (serverDelay ?? BASE_BACKOFF_MS));
+        }
+        // Full jitter, but never sooner than the server asked
+        const backoff = Math.random() * Math.min(MAX_BACKOFF_MS, BASE_BACKOFF_MS * 2 ** request.attempt);
+        const delay = Math.max(serverDelay ?? 0, backoff);
+        llmSchedulerEvents.inc({ event: "retry" });
+        console.warn(`OpenAI request failed (${error instanceof Error ? error.message : error}), retrying in ${Math.round(delay)}ms`);
+        request.attempt++;
+        setTimeout(() => {
+          if (request.signal?.aborted) {
+            request.reject(request.signal.reason);
+          } else {
+            this.enqueue(request);
+          }
+        }, delay);
+      }
+    } finally {
+      this.inFlight--;
+      this.pump();
+    }
+  }
+
+  // Adopt the limits and remaining budget the API reports
+  private follow(headers: Headers | undefined) {
+    if (!headers?.get) return;
+    const limitRequests = parseInt(headers.get("x-ratelimit-limit-requests") || "", 10);
+    const limitTokens = parseInt(headers.get("x-ratelimit-limit-tokens") || "", 10);
+    const remainingRequests = parseInt(headers.get("x-ratelimit-remaining-requests") || "", 10);
+    const remainingTokens = parseInt(headers.get("x-ratelimit-remaining-tokens") || "", 10);
+    this.requests.refill();
+    this.tokens.refill();
+    if (limitRequests > 0) this.requests.capacity = limitRequests;
+    if (limitTokens > 0) this.tokens.capacity = limitTokens;
+    if (!isNaN(remainingRequests)) this.requests.level = Math.min(this.requests.level, remainingRequests);
+    if (!isNaN(remainingTokens)) this.tokens.level = Math.min(this.tokens.level, remainingTokens);
+  }
+}
+
+// One client (and its keep-alive connection pool) and one scheduler per API key, shared by every analysis
+const shared = new Map<string, { client: OpenAI; scheduler: OpenAIScheduler }>();
+
+export function sharedOpenAI(apiKey: string): { client: OpenAI; scheduler: OpenAIScheduler } {
+  let entry = shared.get(apiKey);
+  if (!entry) {
+    // Retries are the scheduler's job, so they count against the budgets
+    entry = { client: new OpenAI({ apiKey, maxRetries: 0 }), scheduler: new OpenAIScheduler() };
+    shared.set(apiKey, entry);
+  }
+  return entry;
+}
+
+registry.register(new Gauge("llm_scheduler_state", "OpenAI scheduler queue length, requests in flight and remaining budgets",
+  () => Array.from(shared.values()).flatMap(({ scheduler }, index) =>
+    Object.entries(scheduler.stats()).map(([kind, value]) => [{ kind, key: index }, value] as [Record<string, string | number>, number]))));
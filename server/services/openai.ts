@@ -1,5 +1,9 @@
 import OpenAI from "openai";
 import type { TelegramMessage } from "./telegram";
+import { LLMCache, llmCache, fingerprintMessages } from "./llm-cache";
+import { llmPromptTokens, llmRequestDuration, promptMessagesSelected } from "./metrics";
+import { estimateTokens, selectForBudget, promptTokens, PROMPT_TEXT_CHARS } from "./ranking";
+import { OpenAIScheduler, PRIORITY_FINAL, PRIORITY_INTERACTIVE, PRIORITY_PART, sharedOpenAI } from "./openai-scheduler";
 
 export interface IntelligenceReport {
   topics: Array<{
@@ -23,14 +27,54 @@ export interface IntelligenceReport {
   };
 }
 
+export interface OpenAIServiceOptions {
+  // Token budget for the message text of a single request; larger sets are map-reduced
+  batchTokenBudget?: number;
+  // How many batch summaries run in parallel
+  mapConcurrency?: number;
+  // Token budget for all message text of a report; the highest-signal messages are kept (0 keeps all)
+  promptTokenBudget?: number;
+}
+
+interface TopicSummary {
+  topic: string;
+  briefing: string;
+}
+
+const MODEL = "gpt-4o-mini";
+const DEFAULT_BATCH_TOKEN_BUDGET = parseInt(process.env.OPENAI_BATCH_TOKEN_BUDGET || "6000", 10);
+const DEFAULT_MAP_CONCURRENCY = parseInt(process.env.OPENAI_MAP_CONCURRENCY || "4", 10);
+const DEFAULT_PROMPT_TOKEN_BUDGET = parseInt(process.env.OPENAI_PROMPT_TOKEN_BUDGET || "24000", 10);
+
+async function mapWithConcurrency<T, R>(items: T[], concurrency: number, fn: (item: T, index: number) => Promise<R>): Promise<R[]> {
+  const results = new Array<R>(items.length);
+  let next = 0;
+  const workers = Array.from({ length: Math.max(1, Math.min(concurrency, items.length)) }, async () => {
+    while (next < items.length) {
+      const index = next++;
+      results[index] = await fn(items[index], index);
+    }
+  });
+  await Promise.all(workers);
+  return results;
+}
+
 export class OpenAIService {
   private openai: OpenAI;
+  private scheduler: OpenAIScheduler;
+  private batchTokenBudget: number;
+  private mapConcurrency: number;
+  private promptTokenBudget: number;
 
-  constructor(apiKey: string) {
-    this.openai = new OpenAI({ apiKey });
+  constructor(apiKey: string, options: OpenAIServiceOptions = {}) {
+    // Every analysis using the key shares its client and rate budget
+    ({ client: this.openai, scheduler: this.scheduler } = sharedOpenAI(apiKey));
+    this.batchTokenBudget = options.batchTokenBudget || DEFAULT_BATCH_TOKEN_BUDGET;
+    this.mapConcurrency = options.mapConcurrency || DEFAULT_MAP_CONCURRENCY;
+    this.promptTokenBudget = options.promptTokenBudget ?? DEFAULT_PROMPT_TOKEN_BUDGET;
   }
 
-  async generateIntelligenceReport(messages: TelegramMessage[], promptTemplate?: string, timeWindowMinutes?: number): Promise<IntelligenceReport> {
+  async generateIntelligenceReport(messages: TelegramMessage[], promptTemplate?: string, timeWindowMinutes?: number, signal?: AbortSignal): Promise<IntelligenceReport> {
     if (messages.length === 0) {
       throw new Error("No messages to analyze");
     }
@@ -44,49 +88,45 @@ export class OpenAIService {
     
     const systemPrompt = promptTemplate;
     const timeWindow = timeWindowMinutes || 60;
-    
-    // Create consolidated text batch
-    const consolidatedText = this.createConsolidatedText(messages, timeWindow);
+    const collected = messages;
     
     try {
-      // Using gpt-4o-mini as requested by the user
-      const response = await this.openai.chat.completions.create({
-        model: "gpt-4o-mini",
-        messages: [
-          {
-            role: "system",
-            content: `${systemPrompt}
-
-Return your response in this exact JSON format:
-{
-  "topics": [{
-    "topic": "topic name",
-    "briefing": "briefing text without any bullet points or lists"
-  }],
-  "metadata": {
-    "totalMessages": ${messages.length},
-    "channelsAnalyzed": ${new Set(messages.map(m => m.channel)).size},
-    "processingTime": "will be calculated"
-  }
-}`
-          },
-          {
-            role: "user",
-            content: consolidatedText
-          }
-        ],
-        response_format: { type: "json_object" },
-        temperature: 0.3,
-        max_tokens: 1500,
-      });
-
-      const analysisResult = JSON.parse(response.choices[0].message.content || "{}");
+      messages = selectForBudget(collected, this.promptTokenBudget);
+      promptMessagesSelected.inc({ selected: true }, messages.length);
+      promptMessagesSelected.inc({ selected: false }, collected.length - messages.length);
+      if (messages.length < collected.length) {
+        console.log(`Ranked ${collected.length} messages, keeping the ${messages.length} with the most signal within ${this.promptTokenBudget} tokens`);
+      }
+      
+      // Identical (model, prompt, message set) requests are answered from the cache
+      const reportKey = LLMCache.key(MODEL, systemPrompt, String(timeWindow), fingerprintMessages(messages));
+      let topics = llmCache.get<TopicSummary[]>(reportKey);
+      
+      if (topics) {
+        console.log(`Using cached analysis for ${messages.length} messages`);
+      } else {
+        const lines = this.formatMessageLines(messages);
+        const totalTokens = lines.reduce((sum, line) => sum + estimateTokens(line), 0);
+        
+        const clusters = this.groupByCluster(messages);
+        
+        if (totalTokens <= this.batchTokenBudget) {
+          // Create consolidated text batch
+          const consolidatedText = this.createConsolidatedText(messages, timeWindow);
+          topics = await this.requestTopics(systemPrompt, consolidatedText, messages, 1500, PRIORITY_FINAL, signal);
+        } else if (clusters.clustered.length >= 2) {
+          topics = await this.clusterTopics(systemPrompt, clusters.clustered, clusters.unclustered, timeWindow, signal);
+        } else {
+          topics = await this.mapReduceTopics(systemPrompt, messages, timeWindow, signal);
+        }
+        llmCache.set(reportKey, topics);
+      }
       
       const processingTime = ((Date.now() - startTime) / 1000).toFixed(2);
       
       // Structure the response according to our interface
       const report: IntelligenceReport = {
-        topics: (analysisResult.topics || []).map((topic: any) => ({
+        topics: topics.map((topic: any) => ({
           topic: topic.topic || "",
           briefing: topic.briefing || "",
           keyPoints: [], // Remove keyPoints as we don't want bullet points
@@ -95,11 +135,11 @@ Return your response in this exact JSON format:
         })),
         events: [], // Remove events section entirely
         metadata: {
-          totalMessages: messages.length,
-          channelsAnalyzed: new Set(messages.map(m => m.channel)).size,
-          timeRange: this.getTimeRange(messages),
+          totalMessages: collected.length,
+          channelsAnalyzed: new Set(collected.map(m => m.channel)).size,
+          timeRange: this.getTimeRange(collected),
           processingTime: `${processingTime}s`,
-          model: "gpt-4o"
+          model: MODEL
         }
       };
 
@@ -110,22 +150,216 @@ Return your response in this exact JSON format:
     }
   }
 
-  private createConsolidatedText(messages: TelegramMessage[], timeWindowMinutes: number = 60): string {
-    // Sort messages by timestamp
-    const sortedMessages = [...messages].sort((a, b) => a.date - b.date);
+  /**
+   * Map-reduce for message sets that don't fit one request: token-budgeted
+   * batches are summarized in parallel, then one reduce call merges the
+   * partial topics into the final report.
+   */
+  private async mapReduceTopics(systemPrompt: string, messages: TelegramMessage[], timeWindowMinutes: number, signal?: AbortSignal): Promise<TopicSummary[]> {
+    const batches = this.splitIntoBatches(messages);
+    console.log(`Summarizing ${messages.length} messages in ${batches.length} batches (concurrency ${this.mapConcurrency})`);
     
-    // Only provide the raw messages, no hardcoded instructions
-    let consolidatedText = `Messages from ${messages.length} channels in the last ${timeWindowMinutes} minutes:
+    // Batch prompts don't mention their position, so an unchanged batch hits the cache on the next run
+    const partials = await mapWithConcurrency(batches, this.mapConcurrency, (batch) => {
+      const batchText = `Part of the messages from the last ${timeWindowMinutes} minutes:
 
-`;
+${this.formatMessageLines(batch).join("")}`;
+      return this.requestTopics(
+        `${systemPrompt}
+
+You are only seeing part of the messages; summarize the topics in this part, they will be merged later.`,
+        batchText,
+        null,
+        800,
+        PRIORITY_PART,
+        signal,
+      );
+    });
+    
+    const partialText = partials
+      .map((topics, index) => `Part ${index + 1}:\n` + topics.map(t => `- ${t.topic}: ${t.briefing}`).join("\n"))
+      .join("\n\n");
+    
+    return this.requestTopics(
+      `${systemPrompt}
+
+You are given topic summaries produced from consecutive parts of ${messages.length} messages collected in the last ${timeWindowMinutes} minutes. Merge topics that describe the same subject and write the final briefings.`,
+      partialText,
+      messages,
+      1500,
+      PRIORITY_FINAL,
+      signal,
+    );
+  }
+
+  /**
+   * For message sets the collector grouped by topic (clustering.py): one
+   * request per cluster, in parallel, each with the cluster's most central
+   * messages that fit the batch budget. Every request already covers a single
+   * subject, so the topics are concatenated without a merge call; messages
+   * close to no cluster share one last request.
+   */
+  private async clusterTopics(systemPrompt: string, clusters: TelegramMessage[][], unclustered: TelegramMessage[], timeWindowMinutes: number, signal?: AbortSignal): Promise<TopicSummary[]> {
+    const requests = clusters.map(cluster => ({
+      messages: this.mostCentral(cluster),
+      size: cluster.length,
+      instruction: "These messages were grouped by subject beforehand; summarize them as one topic, or a few if they clearly cover separate stories.",
+    }));
+    if (unclustered.length > 0) {
+      requests.push({
+        messages: selectForBudget(unclustered, this.batchTokenBudget),
+        size: unclustered.length,
+        instruction: "These messages fit none of the main subjects of the period; summarize only what is newsworthy, possibly nothing.",
+      });
+    }
+    console.log(`Summarizing ${clusters.length} topic clusters and ${unclustered.length} unclustered messages in ${requests.length} requests (concurrency ${this.mapConcurrency})`);
+    
+    const partials = await mapWithConcurrency(requests, this.mapConcurrency, (request) => {
+      const clusterText = `${request.messages.length} of ${request.size} related messages from the last ${timeWindowMinutes} minutes:
+
+${this.formatMessageLines(request.messages).join("")}`;
+      return this.requestTopics(`${systemPrompt}
 
-    sortedMessages.forEach((msg, index) => {
+${request.instruction}`, clusterText, null, 800, PRIORITY_PART, signal);
+    });
+    return partials.flat();
+  }
+
+  private groupByCluster(messages: TelegramMessage[]): { clustered: TelegramMessage[][]; unclustered: TelegramMessage[] } {
+    const clusters = new Map<number, TelegramMessage[]>();
+    const unclustered: TelegramMessage[] = [];
+    for (const message of messages) {
+      if (message.cluster === undefined || message.cluster < 0) {
+        unclustered.push(message);
+        continue;
+      }
+      if (!clusters.has(message.cluster)) clusters.set(message.cluster, []);
+      clusters.get(message.cluster)!.push(message);
+    }
+    // Collector ids are numbered by decreasing size, so the largest topics come first in the report
+    const clustered = Array.from(clusters.keys()).sort((a, b) => a - b).map(id => clusters.get(id)!);
+    return { clustered, unclustered };
+  }
+
+  // A cluster's messages closest to its centroid whose prompt lines fit in the batch budget
+  private mostCentral(cluster: TelegramMessage[]): TelegramMessage[] {
+    const ordered = [...cluster].sort((a, b) => (b.centrality || 0) - (a.centrality || 0));
+    const selected: TelegramMessage[] = [];
+    let used = 0;
+    for (const message of ordered) {
+      const tokens = promptTokens(message);
+      if (used + tokens > this.batchTokenBudget) continue;
+      selected.push(message);
+      used += tokens;
+    }
+    return selected;
+  }
+
+  private async requestTopics(systemPrompt: string, userContent: string, messages: TelegramMessage[] | null, maxTokens: number, priority = PRIORITY_FINAL, signal?: AbortSignal): Promise<TopicSummary[]> {
+    const metadataFormat = messages ? `,
+  "metadata": {
+    "totalMessages": ${messages.length},
+    "channelsAnalyzed": ${new Set(messages.map(m => m.channel)).size},
+    "processingTime": "will be calculated"
+  }` : "";
+    const systemContent = `${systemPrompt}
+
+Return your response in this exact JSON format:
+{
+  "topics": [{
+    "topic": "topic name",
+    "briefing": "briefing text without any bullet points or lists"
+  }]${metadataFormat}
+}`;
+    
+    const cacheKey = LLMCache.key(MODEL, systemContent, userContent, String(maxTokens));
+    const cached = llmCache.get<TopicSummary[]>(cacheKey);
+    if (cached) {
+      return cached;
+    }
+    
+    // Reserves the prompt estimate plus max_tokens, which is what OpenAI counts against the limit
+    const tokens = estimateTokens(systemContent) + estimateTokens(userContent) + maxTokens;
+    const response = await this.scheduler.schedule({ priority, tokens, signal }, async () => {
+      // Using gpt-4o-mini as requested by the user
+      const { data, response: http } = await llmRequestDuration.time({ model: MODEL }, () => this.openai.chat.completions.create({
+        model: MODEL,
+        messages: [
+          {
+            role: "system",
+            content: systemContent
+          },
+          {
+            role: "user",
+            content: userContent
+          }
+        ],
+        response_format: { type: "json_object" },
+        temperature: 0.3,
+        max_tokens: maxTokens,
+      }, { signal }).withResponse());
+      return { result: data, headers: http.headers, usedTokens: data.usage?.total_tokens };
+    });
+    llmPromptTokens.inc({ model: MODEL }, response.usage?.prompt_tokens || 0);
+
+    const analysisResult = JSON.parse(response.choices[0].message.content || "{}");
+    const topics: TopicSummary[] = analysisResult.topics || [];
+    llmCache.set(cacheKey, topics);
+    return topics;
+  }
+
+  /**
+   * Split chronologically sorted messages into batches within the token budget.
+   * Boundaries are content-defined (a batch past half the budget closes after a
+   * message whose id hashes to 0 mod 8), so messages added at the end of the
+   * window leave earlier batches - and their cached summaries - unchanged.
+   */
+  private splitIntoBatches(messages: TelegramMessage[]): TelegramMessage[][] {
+    const sortedMessages = [...messages].sort((a, b) => a.date - b.date);
+    const batches: TelegramMessage[][] = [];
+    let current: TelegramMessage[] = [];
+    let currentTokens = 0;
+    
+    for (const msg of sortedMessages) {
+      const tokens = promptTokens(msg);
+      if (current.length > 0 && currentTokens + tokens > this.batchTokenBudget) {
+        batches.push(current);
+        current = [];
+        currentTokens = 0;
+      }
+      current.push(msg);
+      currentTokens += tokens;
+      
+      const boundary = parseInt(LLMCache.key(msg.channel, String(msg.id)).slice(0, 8), 16) % 8 === 0;
+      if (boundary && currentTokens >= this.batchTokenBudget / 2) {
+        batches.push(current);
+        current = [];
+        currentTokens = 0;
+      }
+    }
+    if (current.length > 0) {
+      batches.push(current);
+    }
+    return batches;
+  }
+
+  private formatMessageLines(messages: TelegramMessage[]): string[] {
+    // Sort messages by timestamp
+    const sortedMessages = [...messages].sort((a, b) => a.date - b.date);
+    
+    return sortedMessages.map((msg, index) => {
       const date = new Date(msg.date * 1000);
       const timeStr = date.toLocaleTimeString('es-ES', { hour: '2-digit', minute: '2-digit' });
-      consolidatedText += `${index + 1}. [${timeStr}] ${msg.text.substring(0, 300)}${msg.text.length > 300 ? '...' : ''}\n`;
+      const reach = (msg.duplicateCount || 1) > 1 ? ` (reported by ${msg.sourceChannels?.length || msg.duplicateCount} channels)` : '';
+      return `${index + 1}. [${timeStr}] ${msg.text.substring(0, PROMPT_TEXT_CHARS)}${msg.text.length > PROMPT_TEXT_CHARS ? '...' : ''}${reach}\n`;
     });
+  }
+
+  private createConsolidatedText(messages: TelegramMessage[], timeWindowMinutes: number = 60): string {
+    // Only provide the raw messages, no hardcoded instructions
+    return `Messages from ${messages.length} channels in the last ${timeWindowMinutes} minutes:
 
-    return consolidatedText;
+` + this.formatMessageLines(messages).join("");
   }
 
   private groupMessagesByChannel(messages: TelegramMessage[]): Record<string, TelegramMessage[]> {
@@ -186,9 +420,13 @@ Messages:
   private getTimeRange(messages: TelegramMessage[]): string {
     if (messages.length === 0) return "No messages";
     
-    const timestamps = messages.map(m => m.date);
-    const earliest = Math.min(...timestamps);
-    const latest = Math.max(...timestamps);
+    // A loop rather than Math.min(...dates), which overflows the stack on large collections
+    let earliest = messages[0].date;
+    let latest = earliest;
+    for (const message of messages) {
+      if (message.date < earliest) earliest = message.date;
+      if (message.date > latest) latest = message.date;
+    }
     
     const earliestDate = new Date(earliest * 1000);
     const latestDate = new Date(latest * 1000);
@@ -198,7 +436,7 @@ Messages:
 
   async testConnection(): Promise<boolean> {
     try {
-      await this.openai.models.list();
+      await this.scheduler.schedule({ priority: PRIORITY_INTERACTIVE, tokens: 0 }, async () => ({ result: await this.openai.models.list() }));
       return true;
     } catch (error) {
       return false;
@@ -0,0 +1,236 @@
+"""
+Text preprocessing between collection and analysis.
+Strips the boilerplate each channel appends to its posts (lines recurring in
+a large share of the channel's messages, remembered in the archive across
+runs), normalizes markdown, links, emoji runs and whitespace, and tags every
+message with a detected language and a token estimate. Large batches are
+split by channel across a process pool so the CPU work never runs on the
+event loop serving network I/O.
+"""
+
+import asyncio
+import math
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+from tracing import span
+
+# Batches at least this large go to the process pool; smaller ones to a thread
+PROCESS_POOL_MIN_MESSAGES = 2000
+# A line is boilerplate once it recurs in this share of a channel's messages...
+BOILERPLATE_SHARE = 0.3
+# ...and in at least this many of them
+BOILERPLATE_MIN_MESSAGES = 3
+# Learned boilerplate not seen again for this long is forgotten
+BOILERPLATE_TTL = 30 * 24 * 3600
+MAX_LINK_CHARS = 40
+
+_URL = re.compile(r'https?://[^\s<>()\[\]"]+')
+_MARKDOWN_LINK = re.compile(r'\[([^\]]*)\]\((https?://[^)\s]+)\)')
+_MARKDOWN_EMPHASIS = re.compile(r'(\*\*|__|~~|`)')
+_EMOJI = '\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF'
+# An emoji followed by more emoji, variation selectors, joiners or skin tones
+_EMOJI_RUN = re.compile(f'([{_EMOJI}])[{_EMOJI}\uFE0F\u200D]+')
+_INVISIBLE = re.compile('[\u200B\u200C\u200E\u200F\u2060\uFEFF]')
+_WHITESPACE = re.compile(r'\s+')
+_NON_WORD = re.compile(r'[\W_]+')
+_WORD = re.compile(r'[^\W\d_]+')
+
+_STOPWORDS = {
+    'en': {'the', 'and', 'of', 'to', 'in', 'is', 'that', 'for', 'with', 'was', 'on', 'are', 'this', 'about', 'from',
+           'by', 'at', 'has', 'have', 'will'},
+    'es': {'el', 'la', 'de', 'que', 'y', 'en', 'los', 'se', 'del', 'las', 'por', 'un', 'para', 'con'},
+    'fr': {'le', 'la', 'les', 'de', 'des', 'et', 'est', 'une', 'du', 'dans', 'qui', 'pour', 'pas'},
+    'de': {'der', 'die', 'und', 'das', 'ist', 'nicht', 'mit', 'den', 'ein', 'zu', 'von', 'auf', 'sich'},
+    'it': {'il', 'di', 'che', 'e', 'la', 'per', 'un', 'non', 'della', 'sono', 'con', 'gli', 'una'},
+    'pt': {'o', 'de', 'que', 'e', 'do', 'da', 'em', 'um', 'para', 'com', 'não', 'uma', 'os', 'dos'},
+}
+# Characters per token by script, for the estimate sent with each message
+_CHARS_PER_TOKEN = {'latin': 4.0, 'cyrillic': 3.0, 'cjk': 1.0, 'other': 3.0}
+
+
+def line_key(line):
+    """Boilerplate lines are matched ignoring case, punctuation, emoji and links"""
+    return _NON_WORD.sub(' ', _URL.sub(' ', line.lower())).strip()
+
+
+def normalize_link(url):
+    """Scheme, query and fragment removed, long paths cut"""
+    parts = urlsplit(url.rstrip('.,;:!?'))
+    host = parts.netloc.lower().removeprefix('www.')
+    if host == 't.me':
+        # Channel or post links: the handle is what matters
+        segments = [s for s in parts.path.split('/') if s]
+        return f"t.me/{segments[0]}" if segments else host
+    link = host + parts.path.rstrip('/')
+    return link if len(link) <= MAX_LINK_CHARS else link[:MAX_LINK_CHARS - 1] + '…'
+
+
+def normalize_text(text):
+    text = _INVISIBLE.sub('', text)
+    text = _MARKDOWN_LINK.sub(lambda m: f"{m.group(1)} ({normalize_link(m.group(2))})" if m.group(1).strip()
+                              else normalize_link(m.group(2)), text)
+    text = _MARKDOWN_EMPHASIS.sub('', text)
+    text = _URL.sub(lambda m: normalize_link(m.group(0)), text)
+    text = _EMOJI_RUN.sub(r'\1', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def script_counts(text):
+    counts = {'latin': 0, 'cyrillic': 0, 'cjk': 0, 'other': 0}
+    extra = {'arabic': 0, 'hebrew': 0, 'kana': 0, 'hangul': 0}
+    for char in text:
+        if not char.isalpha():
+            continue
+        code = ord(char)
+        if code < 0x250:
+            counts['latin'] += 1
+        elif 0x400 <= code < 0x530:
+            counts['cyrillic'] += 1
+        elif 0x3040 <= code < 0x3100:
+            counts['cjk'] += 1
+            extra['kana'] += 1
+        elif 0xAC00 <= code < 0xD7B0:
+            counts['cjk'] += 1
+            extra['hangul'] += 1
+        elif 0x4E00 <= code < 0xA000:
+            counts['cjk'] += 1
+        else:
+            counts['other'] += 1
+            if 0x600 <= code < 0x700:
+                extra['arabic'] += 1
+            elif 0x590 <= code < 0x600:
+                extra['hebrew'] += 1
+    return counts, extra
+
+
+def detect_language(text, counts=None, extra=None):
+    """ISO 639-1 code from script and stopwords, or 'und' when unsure"""
+    if counts is None:
+        counts, extra = script_counts(text)
+    script = max(counts, key=counts.get)
+    if counts[script] == 0:
+        return 'und'
+    if script == 'cyrillic':
+        return 'uk' if re.search(r'[іїєґІЇЄҐ]', text) else 'ru'
+    if script == 'cjk':
+        return 'ja' if extra['kana'] else 'ko' if extra['hangul'] else 'zh'
+    if script == 'other':
+        if extra['arabic']:
+            return 'fa' if re.search(r'[پچژگ]', text) else 'ar'
+        return 'he' if extra['hebrew'] else 'und'
+
+    words = _WORD.findall(text.lower())
+    hits = {lang: sum(1 for w in words if w in stopwords) for lang, stopwords in _STOPWORDS.items()}
+    best = max(hits, key=hits.get)
+    return best if hits[best] > 0 else 'und'
+
+
+def estimate_tokens(text, counts):
+    letters = sum(counts.values()) or 1
+    chars_per_token = sum(_CHARS_PER_TOKEN[s] * n for s, n in counts.items()) / letters
+    return math.ceil(len(text) / chars_per_token)
+
+
+def learn_boilerplate(messages):
+    """Line keys recurring in enough of one channel's messages"""
+    if len(messages) < BOILERPLATE_MIN_MESSAGES:
+        return set()
+    seen = {}
+    for message in messages:
+        for key in {line_key(line) for line in message['text'].splitlines()}:
+            if len(key) >= 3:
+                seen[key] = seen.get(key, 0) + 1
+    threshold = max(BOILERPLATE_MIN_MESSAGES, BOILERPLATE_SHARE * len(messages))
+    return {key for key, count in seen.items() if count >= threshold}
+
+
+def preprocess_channel(messages, known_boilerplate=()):
+    """Preprocess one channel's messages: returns (messages, boilerplate learned from them).
+
+    Each message keeps its fields with 'text' replaced by the cleaned text and
+    'lang' and 'tokens' added; messages with nothing left are dropped.
+    """
+    learned = learn_boilerplate(messages)
+    boilerplate = learned | set(known_boilerplate)
+    result = []
+    for message in messages:
+        lines = [line for line in message['text'].splitlines() if line_key(line) not in boilerplate]
+        text = normalize_text('\n'.join(lines))
+        if not text:
+            continue
+        counts, extra = script_counts(text)
+        result.append({**message, 'text': text, 'lang': detect_language(text, counts, extra),
+                       'tokens': estimate_tokens(text, counts)})
+    return result, learned
+
+
+def preprocess_batch(groups):
+    """preprocess_channel() over [(channel, messages, known boilerplate)], for one pool task"""
+    return [(channel, *preprocess_channel(messages, known)) for channel, messages, known in groups]
+
+
+class Preprocessor:
+    def __init__(self, store=None, workers=None, pool_min_messages=PROCESS_POOL_MIN_MESSAGES):
+        self.store = store
+        self.workers = workers or int(os.environ.get('PREPROCESS_WORKERS', 0)) or os.cpu_count() or 1
+        self.pool_min_messages = pool_min_messages
+        self.pool = None
+        self.counters = {'messages': 0, 'dropped': 0, 'charsIn': 0, 'charsOut': 0, 'pooledBatches': 0}
+
+    def _pool(self):
+        if self.pool is None:
+            # spawn: forking a process with a running event loop and open SQLite handles isn't safe
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.pool
+
+    async def run(self, messages):
+        """Preprocessed `messages` (any mix of channels), in their original order per channel"""
+        if not messages:
+            return []
+        by_channel = {}
+        for message in messages:
+            by_channel.setdefault(message['channel'], []).append(message)
+        groups = [(channel, channel_messages, self._known(channel))
+                  for channel, channel_messages in by_channel.items()]
+
+        loop = asyncio.get_running_loop()
+        with span('preprocess', messages=len(messages), channels=len(groups)):
+            if len(messages) >= self.pool_min_messages and self.workers > 1:
+                self.counters['pooledBatches'] += 1
+                pool = self._pool()
+                chunks = [groups[i::self.workers] for i in range(self.workers)]
+                parts = await asyncio.gather(*(loop.run_in_executor(pool, preprocess_batch, chunk)
+                                               for chunk in chunks if chunk))
+                processed = [item for part in parts for item in part]
+            else:
+                processed = await loop.run_in_executor(None, preprocess_batch, groups)
+
+        result = []
+        for channel, cleaned, learned in processed:
+            if learned and self.store is not None:
+                self.store.remember_boilerplate(channel, learned)
+            result.extend(cleaned)
+
+        self.counters['messages'] += len(messages)
+        self.counters['dropped'] += len(messages) - len(result)
+        self.counters['charsIn'] += sum(len(m['text']) for m in messages)
+        self.counters['charsOut'] += sum(len(m['text']) for m in result)
+        return result
+
+    def _known(self, channel):
+        if self.store is None:
+            return frozenset()
+        return frozenset(self.store.boilerplate(channel, time.time() - BOILERPLATE_TTL))
+
+    def stats(self):
+        return dict(self.counters)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
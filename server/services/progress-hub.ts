@@ -0,0 +1,132 @@
+import type { Analysis } from "@shared/schema";
+import type { IStorage } from "../storage";
+
+type AnalysisState = Omit<Analysis, "report"> & { report?: unknown };
+type Listener = (state: AnalysisState) => void;
+
+// Intermediate progress reaches the database at most this often per analysis
+const FLUSH_INTERVAL_MS = 2000;
+// Finished analyses stay in memory briefly for late subscribers and status reads
+const RETAIN_FINISHED_MS = 5 * 60 * 1000;
+// Analyses that never reach a terminal state (e.g. a crashed worker) are dropped after this long
+const MAX_TRACKED_MS = 60 * 60 * 1000;
+
+export function isTerminal(status: string | null | undefined): boolean {
+  return status === "completed" || status === "failed";
+}
+
+/**
+ * In-memory progress of running analyses. Every update is pushed to
+ * subscribers immediately (the SSE stream); intermediate updates are
+ * coalesced and written behind to storage, terminal states are written
+ * before update() resolves. Reads of a tracked analysis never hit storage.
+ */
+export class ProgressHub {
+  private states = new Map<number, AnalysisState>();
+  private listeners = new Map<number, Set<Listener>>();
+  private pending = new Map<number, Partial<Analysis>>();
+  private timers = new Map<number, NodeJS.Timeout>();
+  // Writes per analysis are chained so a late intermediate write can't overwrite a terminal one
+  private writes = new Map<number, Promise<unknown>>();
+  private expiry = new Map<number, NodeJS.Timeout>();
+
+  constructor(private storage: IStorage) {}
+
+  track(analysis: Analysis) {
+    if (!this.states.has(analysis.id)) {
+      const { report, ...state } = analysis;
+      this.states.set(analysis.id, isTerminal(analysis.status) ? { ...state, report } : state);
+      this.expire(analysis.id, isTerminal(analysis.status) ? RETAIN_FINISHED_MS : MAX_TRACKED_MS);
+    }
+  }
+
+  get(id: number): AnalysisState | undefined {
+    return this.states.get(id);
+  }
+
+  async update(id: number, updates: Partial<Analysis>): Promise<void> {
+    const { report, ...progress } = updates;
+    const current = this.states.get(id);
+    if (current) {
+      const state: AnalysisState = { ...current, ...progress };
+      if (report !== undefined) {
+        state.report = report;
+      }
+      this.states.set(id, state);
+      this.listeners.get(id)?.forEach(listener => listener(state));
+    }
+    this.pending.set(id, { ...this.pending.get(id), ...updates });
+
+    if (isTerminal(updates.status)) {
+      await this.flush(id);
+      if (this.states.has(id)) this.expire(id, RETAIN_FINISHED_MS);
+    } else if (!this.timers.has(id)) {
+      this.timers.set(id, setTimeout(() => {
+        this.flush(id).catch(error => console.error(`Failed to persist progress for analysis ${id}:`, error));
+      }, FLUSH_INTERVAL_MS));
+    }
+  }
+
+  subscribe(id: number, listener: Listener): () => void {
+    if (!this.listeners.has(id)) {
+      this.listeners.set(id, new Set());
+    }
+    this.listeners.get(id)!.add(listener);
+    return () => {
+      const listeners = this.listeners.get(id);
+      listeners?.delete(listener);
+      if (listeners && listeners.size === 0) {
+        this.listeners.delete(id);
+        // Once the terminal write has landed, storage serves the finished analysis on its own
+        if (isTerminal(this.states.get(id)?.status)) {
+          (this.writes.get(id) || Promise.resolve()).catch(() => {}).then(() => {
+            if (!this.listeners.has(id)) this.forget(id);
+          });
+        }
+      }
+    };
+  }
+
+  // Finished analyses are kept while someone is still streaming them; unfinished ones are not
+  private expire(id: number, afterMs: number) {
+    clearTimeout(this.expiry.get(id));
+    const timer = setTimeout(() => {
+      this.expiry.delete(id);
+      if (!isTerminal(this.states.get(id)?.status)) {
+        this.flush(id).catch(error => console.error(`Failed to persist progress for analysis ${id}:`, error));
+        this.forget(id);
+      } else if (!this.listeners.get(id)?.size) {
+        this.forget(id);
+      }
+    }, afterMs);
+    timer.unref();
+    this.expiry.set(id, timer);
+  }
+
+  private forget(id: number) {
+    clearTimeout(this.expiry.get(id));
+    this.expiry.delete(id);
+    this.states.delete(id);
+  }
+
+  private flush(id: number): Promise<unknown> {
+    clearTimeout(this.timers.get(id));
+    this.timers.delete(id);
+
+    const updates = this.pending.get(id);
+    this.pending.delete(id);
+    const previous = this.writes.get(id) || Promise.resolve();
+    if (!updates) {
+      return previous;
+    }
+
+    const write = previous
+      .catch(() => {})
+      .then(() => this.storage.updateAnalysis(id, updates));
+    this.writes.set(id, write);
+    write.finally(() => {
+      if (this.writes.get(id) === write) this.writes.delete(id);
+    }).catch(() => {});
+    return write;
+  }
+}
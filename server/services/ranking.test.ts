@@ -0,0 +1,67 @@
+import { test } from "node:test";
+import assert from "node:assert/strict";
+import type { TelegramMessage } from "./telegram";
+import { promptTokens, selectForBudget } from "./ranking";
+
+function message(id: number, fields: Partial<TelegramMessage> = {}): TelegramMessage {
+  return {
+    id,
+    text: `Message ${id}: the regional council approved the new transport budget after a long debate`,
+    date: 1_700_000_000 + id * 60,
+    channel: "@news",
+    ...fields,
+  };
+}
+
+function tokens(messages: TelegramMessage[]): number {
+  return messages.reduce((sum, m) => sum + promptTokens(m), 0);
+}
+
+test("a budget of 0, or one that everything fits in, keeps every message", () => {
+  const messages = [message(1), message(2), message(3)];
+  assert.equal(selectForBudget(messages, 0), messages);
+  assert.equal(selectForBudget(messages, tokens(messages)), messages);
+});
+
+test("the selection fits the budget and keeps the original order", () => {
+  const messages = Array.from({ length: 50 }, (_, i) => message(i + 1, { views: (i * 37) % 100 }));
+  const budget = Math.floor(tokens(messages) / 3);
+  const selected = selectForBudget(messages, budget);
+
+  assert.ok(selected.length > 0 && selected.length < messages.length);
+  assert.ok(tokens(selected) <= budget);
+  assert.deepEqual(selected.map(m => m.id), [...selected.map(m => m.id)].sort((a, b) => a - b));
+});
+
+test("stories reported by several channels and well-read posts win", () => {
+  const messages = [
+    message(1, { views: 100 }),
+    message(2, { views: 100, sourceChannels: ["@news", "@wire", "@daily"] }),
+    message(3, { views: 100 }),
+    message(4, { views: 5000 }),
+    message(5, { views: 100 }),
+  ];
+  const selected = selectForBudget(messages, promptTokens(messages[0]) * 2);
+  assert.deepEqual(selected.map(m => m.id), [2, 4]);
+});
+
+test("without engagement data the newest messages are kept", () => {
+  const messages = Array.from({ length: 10 }, (_, i) => message(i + 1));
+  const selected = selectForBudget(messages, promptTokens(messages[0]) * 3);
+  assert.deepEqual(selected.map(m => m.id), [8, 9, 10]);
+});
+
+test("a message too large for what is left doesn't stop smaller ones", () => {
+  const long = message(1, { views: 10000, text: "x".repeat(2000), tokens: 2000 });
+  const short = [message(2), message(3)];
+  const budget = promptTokens(short[0]) * 2 + 5;
+  assert.ok(promptTokens(long) > budget);
+
+  const selected = selectForBudget([long, ...short], budget);
+  assert.deepEqual(selected.map(m => m.id), [2, 3]);
+});
+
+test("the collector's token estimate is scaled to the truncated text", () => {
+  const full = message(1, { text: "слово ".repeat(100), tokens: 300 });
+  assert.equal(promptTokens(full), 150 + 10);
+});
@@ -0,0 +1,76 @@
+import type { TelegramMessage } from "./telegram";
+
+// Text per message that reaches the prompt, and the line's numbering/time overhead
+export const PROMPT_TEXT_CHARS = 300;
+const LINE_OVERHEAD_TOKENS = 10;
+
+// Rough token estimate (~4 characters per token) good enough for budgeting
+export function estimateTokens(text: string): number {
+  return Math.ceil(text.length / 4);
+}
+
+export function promptTokens(message: TelegramMessage): number {
+  if (message.tokens !== undefined) {
+    // The collector's estimate accounts for the script (Cyrillic and CJK take more tokens per character)
+    return Math.ceil(message.tokens * Math.min(1, PROMPT_TEXT_CHARS / Math.max(1, message.text.length))) + LINE_OVERHEAD_TOKENS;
+  }
+  return estimateTokens(message.text.substring(0, PROMPT_TEXT_CHARS)) + LINE_OVERHEAD_TOKENS;
+}
+
+function median(values: number[]): number {
+  if (values.length === 0) return 0;
+  const sorted = [...values].sort((a, b) => a - b);
+  const middle = Math.floor(sorted.length / 2);
+  return sorted.length % 2 ? sorted[middle] : (sorted[middle - 1] + sorted[middle]) / 2;
+}
+
+/**
+ * Signal score of each message. Audiences differ by orders of magnitude
+ * between channels, so views count relative to the channel's median; shares,
+ * replies and reactions count per view; a story reported by several channels
+ * weighs most. Very short messages (stickers' captions, "👇") are damped.
+ */
+export function scoreMessages(messages: TelegramMessage[]): number[] {
+  const viewsByChannel = new Map<string, number[]>();
+  messages.forEach(message => {
+    if (!viewsByChannel.has(message.channel)) viewsByChannel.set(message.channel, []);
+    viewsByChannel.get(message.channel)!.push(message.views || 0);
+  });
+  const medianViews = new Map(Array.from(viewsByChannel, ([channel, views]) => [channel, median(views)]));
+
+  return messages.map(message => {
+    const views = message.views || 0;
+    const channelMedian = medianViews.get(message.channel) || 0;
+    const relativeViews = channelMedian > 0 ? views / channelMedian : 1;
+    const interactions = 3 * (message.forwards || 0) + 2 * (message.replies || 0) + (message.reactions || 0);
+    const interactionRate = views > 0 ? (1000 * interactions) / views : 0;
+    const reach = message.sourceChannels?.length || message.duplicateCount || 1;
+
+    const score = 2 * Math.log2(reach) + Math.log2(1 + relativeViews) + 0.5 * Math.log2(1 + interactionRate);
+    return score * Math.min(1, message.text.length / 80);
+  });
+}
+
+/**
+ * The highest-signal messages whose prompt lines fit in `tokenBudget`, in
+ * their original order. A budget of 0 keeps everything.
+ */
+export function selectForBudget(messages: TelegramMessage[], tokenBudget: number): TelegramMessage[] {
+  if (tokenBudget <= 0) return messages;
+  const tokens = messages.map(promptTokens);
+  if (tokens.reduce((sum, t) => sum + t, 0) <= tokenBudget) return messages;
+
+  const scores = scoreMessages(messages);
+  // Ties (no engagement data, e.g. pushed messages) go to the newest
+  const order = messages.map((_, index) => index)
+    .sort((a, b) => scores[b] - scores[a] || messages[b].date - messages[a].date);
+
+  const selected = new Set<number>();
+  let used = 0;
+  for (const index of order) {
+    if (used + tokens[index] > tokenBudget) continue;
+    selected.add(index);
+    used += tokens[index];
+  }
+  return messages.filter((_, index) => selected.has(index));
+}
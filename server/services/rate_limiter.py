@@ -0,0 +1,53 @@
+"""
+Shared token-bucket limiter for Telegram API calls.
+Every collection worker draws from the same bucket, and a FloodWaitError
+reported by any of them pauses the whole bucket for the requested time.
+"""
+
+import asyncio
+import time
+
+
+class RateLimiter:
+    def __init__(self, rate=5.0, burst=10):
+        self.rate = rate            # tokens added per second
+        self.burst = burst          # bucket capacity
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.flood_waits = 0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Wait until a request may be sent"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def flood_wait(self, seconds):
+        """Pause every caller for the time Telegram asked us to wait"""
+        self.flood_waits += 1
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        print(f"FloodWait: pausing Telegram requests for {seconds}s")
+
+    def stats(self):
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'floodWaits': self.flood_waits,
+            'blockedFor': round(max(0.0, self.blocked_until - time.monotonic()), 1),
+        }
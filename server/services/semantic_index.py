@@ -0,0 +1,322 @@
+"""
+Semantic search over the message archive.
+Every archived message is embedded offline with a hashed n-gram projection
+(words and character trigrams hashed with a sign into a small dense vector,
+so no model or external service is involved) and appended to memory-mapped
+NumPy arrays next to the archive. The index follows the archive by rowid, so
+each update only embeds what was added since the last one, plus the messages
+whose text was edited since (the archive logs those).
+
+Small indexes are searched brute force in chunks; from IVF_MIN_ROWS on,
+vectors are also assigned to k-means lists (IVF) and a query only scores the
+lists nearest to it. Either way only the rows being scored are read from
+disk, never the whole corpus. Messages pruned from the archive stay in the
+index and are dropped from results when their text is looked up. Updates run
+on one thread while searches run on others: a search works on a snapshot of
+the row count, lists and centroids taken under the index lock, and updates
+only swap those under it.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from message_store import MessageStore
+from preprocess import BOILERPLATE_TTL, line_key, normalize_text
+
+DIMENSIONS = 256
+# Messages embedded per archive read
+UPDATE_BATCH = 5000
+# Below this many vectors every query is brute force
+IVF_MIN_ROWS = 50_000
+# Lists are retrained once the index has doubled since the last training
+RETRAIN_GROWTH = 2
+TRAIN_SAMPLE = 50_000
+TRAIN_ITERATIONS = 10
+DEFAULT_PROBES = 16
+# Filtered down to this many rows, a query scores them all instead of probing lists
+EXACT_SEARCH_ROWS = 20_000
+# Rows scored per step, bounding the memory a query takes
+SCORE_CHUNK = 262_144
+SEED = 20240601
+
+_WORD = re.compile(r'[^\W_]+')
+
+
+def features(text):
+    """(feature, weight) pairs: words, and the character trigrams of each word for inflected forms"""
+    for word in _WORD.findall(text.lower()):
+        yield word, 1.0
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            yield padded[i:i + 3], 0.5
+
+
+def embed(text, dimensions=DIMENSIONS):
+    """L2-normalized float32 vector; all zeros for text without words"""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for feature, weight in features(text):
+        hashed = zlib.crc32(feature.encode())
+        # Low bits pick the dimension, the top bit the sign, so collisions cancel out on average
+        vector[hashed % dimensions] += -weight if hashed & 0x80000000 else weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def _spherical_kmeans(vectors, lists, rng):
+    centroids = vectors[rng.choice(len(vectors), lists, replace=False)].copy()
+    for _ in range(TRAIN_ITERATIONS):
+        labels = (vectors @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Lists that lost every vector keep their previous centroid
+        centroids = np.where(norms > 0, sums / np.where(norms > 0, norms, 1), centroids)
+    return centroids.astype(np.float32)
+
+
+class SemanticIndex:
+    """Append-only vector index in `directory`: vectors, (channel, id) keys, dates and IVF list per row"""
+
+    ARRAYS = {
+        'vectors': (np.float16, DIMENSIONS),
+        'ids': (np.int64, None),
+        'channels': (np.int32, None),
+        'dates': (np.int64, None),
+        'lists': (np.int32, None),
+    }
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # 'cursor' is the last archive rowid embedded, 'edits' the last archive text edit applied
+        self.meta = {'count': 0, 'cursor': 0, 'edits': 0, 'channels': [], 'trainedAt': 0, 'dimensions': DIMENSIONS}
+        meta_path = self._path('meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get('dimensions') == DIMENSIONS:
+                self.meta = {'edits': 0, **meta}
+        self.channel_ids = {channel: i for i, channel in enumerate(self.meta['channels'])}
+        # Rows appended after the last saved count (an interrupted update) are discarded
+        for name, (dtype, width) in self.ARRAYS.items():
+            path = self._path(f"{name}.bin")
+            with open(path, 'ab') as f:
+                f.truncate(self.meta['count'] * np.dtype(dtype).itemsize * (width or 1))
+        centroids_path = self._path('centroids.npy')
+        self.centroids = np.load(centroids_path) if self.meta['trainedAt'] and os.path.exists(centroids_path) else None
+        self._maps = {}
+        # Held while the row count, lists or centroids change, and while a search snapshots them
+        self.lock = threading.RLock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _array(self, name, count=None):
+        """Read-only memory map of the first `count` rows of an array"""
+        count = self.meta['count'] if count is None else count
+        dtype, width = self.ARRAYS[name]
+        if count == 0:
+            return np.zeros((0, width) if width else 0, dtype=dtype)
+        cached = self._maps.get(name)
+        if cached is None or cached[0] != count:
+            shape = (count, width) if width else (count,)
+            cached = (count, np.memmap(self._path(f"{name}.bin"), dtype=dtype, mode='r', shape=shape))
+            self._maps[name] = cached
+        return cached[1]
+
+    def _save_meta(self):
+        path = self._path('meta.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(path + '.tmp', path)
+
+    def update(self, store_path):
+        """Embed archive messages added or edited since the last update; returns how many were embedded.
+
+        Runs on a worker thread, so it reads the archive through its own connection.
+        """
+        store = MessageStore(store_path)
+        embedded = 0
+        boilerplate = {}
+        # The same boilerplate the preprocessor strips (preprocess.Preprocessor._known)
+        since = time.time() - BOILERPLATE_TTL
+
+        def vectorize(rows):
+            vectors = np.empty((len(rows), DIMENSIONS), dtype=np.float32)
+            for i, (channel, text) in enumerate(rows):
+                if channel not in boilerplate:
+                    boilerplate[channel] = store.boilerplate(channel, since)
+                lines = [line for line in text.splitlines() if line_key(line) not in boilerplate[channel]]
+                vectors[i] = embed(normalize_text('\n'.join(lines)))
+            return vectors
+
+        try:
+            # Edits first: messages past the cursor are embedded with their current text below anyway
+            while True:
+                edits = store.edits_after(self.meta['edits'], UPDATE_BATCH)
+                if not edits:
+                    break
+                indexed = [e for e in edits if e[1] <= self.meta['cursor']]
+                if indexed:
+                    embedded += self._replace([(e[2], e[3]) for e in indexed],
+                                              vectorize([(e[2], e[5]) for e in indexed]))
+                self.meta['edits'] = edits[-1][0]
+                self._save_meta()
+                store.forget_edits(self.meta['edits'])
+
+            while True:
+                rows = store.rows_after(self.meta['cursor'], UPDATE_BATCH)
+                if not rows:
+                    break
+                self._append(rows, vectorize([(r[1], r[4]) for r in rows]))
+                embedded += len(rows)
+        finally:
+            store.close()
+
+        count = self.meta['count']
+        if count >= IVF_MIN_ROWS and count >= RETRAIN_GROWTH * self.meta['trainedAt']:
+            self.train()
+        return embedded
+
+    def _append(self, rows, vectors):
+        with self.lock:
+            for _, channel, _, _, _ in rows:
+                if channel not in self.channel_ids:
+                    self.channel_ids[channel] = len(self.meta['channels'])
+                    self.meta['channels'].append(channel)
+            columns = {
+                'vectors': vectors.astype(np.float16),
+                'ids': np.array([r[2] for r in rows], dtype=np.int64),
+                'channels': np.array([self.channel_ids[r[1]] for r in rows], dtype=np.int32),
+                'dates': np.array([r[3] for r in rows], dtype=np.int64),
+                'lists': (self._nearest_lists(vectors) if self.centroids is not None
+                          else np.full(len(rows), -1, dtype=np.int32)),
+            }
+            for name, values in columns.items():
+                with open(self._path(f"{name}.bin"), 'ab') as f:
+                    f.write(values.tobytes())
+            # Rows count once the metadata says so; until then a restart truncates them away
+            self.meta['count'] += len(rows)
+            self.meta['cursor'] = rows[-1][0]
+            self._save_meta()
+
+    def _replace(self, keys, vectors):
+        """Overwrite the vectors (and lists) of the indexed (channel, id) `keys`; returns how many were found"""
+        with self.lock:
+            count = self.meta['count']
+            ids = self._array('ids', count)
+            rows = np.flatnonzero(np.isin(ids, [message_id for _, message_id in keys]))
+            channel_column = self._array('channels', count)
+            position = {(self.meta['channels'][channel_column[row]], int(ids[row])): int(row) for row in rows}
+            found = [(position[key], i) for i, key in enumerate(keys) if key in position]
+            lists = self._nearest_lists(vectors) if self.centroids is not None else None
+            # The files are mapped shared, so searches see the new rows right away
+            with open(self._path('vectors.bin'), 'r+b') as f:
+                for row, i in found:
+                    f.seek(row * DIMENSIONS * np.dtype(np.float16).itemsize)
+                    f.write(vectors[i].astype(np.float16).tobytes())
+            if lists is not None:
+                with open(self._path('lists.bin'), 'r+b') as f:
+                    for row, i in found:
+                        f.seek(row * np.dtype(np.int32).itemsize)
+                        f.write(lists[i:i + 1].tobytes())
+        return len(found)
+
+    def _nearest_lists(self, vectors, centroids=None):
+        centroids = self.centroids if centroids is None else centroids
+        return (vectors.astype(np.float32) @ centroids.T).argmax(axis=1).astype(np.int32)
+
+    def train(self):
+        """(Re)build the IVF lists: k-means over a sample, then every row assigned to its nearest list"""
+        with self.lock:
+            count = self.meta['count']
+            vectors = self._array('vectors', count)
+        rng = np.random.default_rng(SEED)
+        sample = np.sort(rng.choice(count, min(count, TRAIN_SAMPLE), replace=False))
+        lists = min(4096, max(16, round(math.sqrt(count))))
+        centroids = _spherical_kmeans(vectors[sample].astype(np.float32), lists, rng)
+
+        # Written aside and swapped in, so searches running meanwhile keep a consistent view
+        path = self._path('lists.bin')
+        with open(path + '.tmp', 'wb') as f:
+            for start in range(0, count, SCORE_CHUNK):
+                f.write(self._nearest_lists(vectors[start:start + SCORE_CHUNK], centroids).tobytes())
+        np.save(self._path('centroids.tmp.npy'), centroids)
+        with self.lock:
+            os.replace(path + '.tmp', path)
+            os.replace(self._path('centroids.tmp.npy'), self._path('centroids.npy'))
+            self.centroids = centroids
+            self._maps.pop('lists', None)
+            self.meta['trainedAt'] = count
+            self._save_meta()
+        print(f"Trained {lists} search lists over {count} messages")
+
+    def search(self, query, limit=20, since=None, channels=None, probes=DEFAULT_PROBES):
+        """Top `limit` rows by cosine similarity: ([(channel, id, score)], rows scored)"""
+        # Stored texts were normalized before embedding, so the query is too
+        q = embed(normalize_text(query))
+        # One consistent view: an update or retraining meanwhile doesn't change what this search reads
+        with self.lock:
+            count = self.meta['count']
+            centroids = self.centroids
+            channel_names = list(self.meta['channels'])
+            arrays = {name: self._array(name, count) for name in self.ARRAYS}
+        if count == 0 or not q.any():
+            return [], 0
+
+        # Filters first: a selective one leaves few enough rows to score exactly
+        candidates = None
+        if channels is not None:
+            channels = set(channels)
+            wanted = [i for i, name in enumerate(channel_names) if name in channels]
+            candidates = np.flatnonzero(np.isin(arrays['channels'], wanted))
+        if since is not None:
+            dates = arrays['dates']
+            candidates = np.flatnonzero(dates >= since) if candidates is None else candidates[dates[candidates] >= since]
+
+        remaining = count if candidates is None else len(candidates)
+        if centroids is not None and remaining > EXACT_SEARCH_ROWS:
+            # Rows added since training are already assigned to the current lists
+            probed = np.zeros(len(centroids), dtype=bool)
+            probed[np.argsort(centroids @ q)[::-1][:probes]] = True
+            lists = arrays['lists']
+            candidates = np.flatnonzero(probed[lists]) if candidates is None else candidates[probed[lists[candidates]]]
+
+        vectors = arrays['vectors']
+        total = count if candidates is None else len(candidates)
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        for start in range(0, total, SCORE_CHUNK):
+            if candidates is None:
+                rows = np.arange(start, min(start + SCORE_CHUNK, total))
+                chunk = vectors[start:start + SCORE_CHUNK]
+            else:
+                rows = candidates[start:start + SCORE_CHUNK]
+                chunk = vectors[rows]
+            scores = chunk.astype(np.float32) @ q
+            best_rows = np.concatenate((best_rows, rows))
+            best_scores = np.concatenate((best_scores, scores))
+            if len(best_scores) > limit:
+                keep = np.argpartition(best_scores, -limit)[-limit:]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+
+        order = np.argsort(best_scores)[::-1]
+        ids = arrays['ids']
+        channel_column = arrays['channels']
+        results = [(channel_names[channel_column[best_rows[i]]], int(ids[best_rows[i]]),
+                    round(float(best_scores[i]), 4)) for i in order if best_scores[i] > 0]
+        return results, total
+
+    def stats(self):
+        return {
+            'messages': self.meta['count'],
+            'lists': 0 if self.centroids is None else len(self.centroids),
+            'bytes': sum(os.path.getsize(self._path(f"{name}.bin")) for name in self.ARRAYS),
+        }
@@ -1,115 +1,179 @@
+import { getCollector, CollectorError, SETUP_REQUIRED_CODE } from "./collector";
+import type { ExportColumn, ParquetFile } from "./export";
+
 export interface TelegramMessage {
   id: number;
   text: string;
   date: number;
   channel: string;
   url?: string;
+  // Set when the collector collapsed near-duplicates reposted across channels
+  duplicateCount?: number;
+  sourceChannels?: string[];
+  // Engagement as of collection time (summed over a collapsed group)
+  views?: number;
+  forwards?: number;
+  replies?: number;
+  reactions?: number;
+  // Added by the collector's preprocessing: detected language and token estimate of the cleaned text
+  lang?: string;
+  tokens?: number;
+  // Added by the collector's topic clustering: cluster id (-1 when close to none) and similarity to its centroid
+  cluster?: number;
+  centrality?: number;
+}
+
+export interface ClusterSummary {
+  id: number;
+  size: number;
+  terms: string[];
+}
+
+export interface ChannelReport {
+  channel: string;
+  status: "ok" | "error";
+  messages: number;
+  floodWaits: number;
+  elapsedMs: number;
+  error?: string;
+  // False when the window held more than the collector's backfill budget; it is then only complete from `coveredSince` (unix seconds)
+  complete?: boolean;
+  coveredSince?: number;
+}
+
+export interface CollectionResult {
+  messages: TelegramMessage[];
+  channels: ChannelReport[];
+  total: number;
+  unique?: number;
+  clusters?: ClusterSummary[];
+}
+
+export interface SearchResponse {
+  results: Array<TelegramMessage & { score: number }>;
+  // Messages in the index, and how many of them the query scored
+  indexed: number;
+  scored: number;
+  // True while a large backlog of archived messages is still being indexed
+  indexing: boolean;
+}
+
+export interface TextSearchResponse {
+  // Best match first; `snippet` marks the matched words with « », `rank` is bm25 (lower is better)
+  results: Array<TelegramMessage & { snippet: string; rank: number }>;
+  nextOffset: number | null;
 }
 
+export interface CollectionProgress {
+  channelsDone: number;
+  channelsTotal: number;
+  messagesCollected: number;
+  report: ChannelReport;
+}
+
+// Channels collected in parallel by the collector's worker pool, per account
+const COLLECTION_CONCURRENCY = 8;
+// Channels checked against Telegram more recently than this are served straight from the local archive
+const ARCHIVE_MAX_STALENESS_SECONDS = 60;
+// The pushed window is kept somewhat longer than the analysis window so a slightly larger request still hits it
+const LIVE_WINDOW_MIN_MINUTES = 60;
+// A first search may wait for a few thousand archived messages to be indexed
+const SEARCH_TIMEOUT_MS = 30000;
+// Archived messages per export page
+const EXPORT_PAGE_SIZE = 5000;
+// Topic clusters the collector groups messages into before summarization (0 disables clustering)
+const TOPIC_CLUSTERS = parseInt(process.env.TOPIC_CLUSTERS || "12", 10);
+
 export class TelegramService {
   private apiId: string;
   private apiHash: string;
   private phone: string;
+  private additionalPhones: string[];
 
-  constructor(apiId: string, apiHash: string, phone: string) {
+  constructor(apiId: string, apiHash: string, phone: string, additionalPhones: string[] = []) {
     this.apiId = apiId;
     this.apiHash = apiHash;
     this.phone = phone;
+    this.additionalPhones = additionalPhones;
   }
 
-  async getRecentMessages(channels: string[], minutesBack: number = 60): Promise<TelegramMessage[]> {
+  private get phones(): string[] {
+    return Array.from(new Set([this.phone, ...this.additionalPhones.map(phone => phone.trim()).filter(Boolean)]));
+  }
+
+  async getRecentMessages(
+    channels: string[],
+    minutesBack: number = 60,
+    onProgress?: (progress: CollectionProgress) => void,
+    signal?: AbortSignal,
+  ): Promise<TelegramMessage[]> {
     try {
       console.log(`Using Telegram MTProto to get messages from ${channels.length} channels`);
       
-      // Limit channels to prevent timeouts and rate limits
-      const maxChannels = 20;
-      if (channels.length > maxChannels) {
-        console.warn(`Too many channels (${channels.length}). Processing first ${maxChannels} channels only.`);
-        channels = channels.slice(0, maxChannels);
-      }
-      
-      // Execute Python script using Telethon
-      const { exec } = await import('child_process');
-      const { promisify } = await import('util');
-      const execAsync = promisify(exec);
-      
-      const channelsJson = JSON.stringify(channels);
-      const pythonCommand = `cd server/services && python3 telegram_simple.py "${this.apiId}" "${this.apiHash}" "${this.phone}" '${channelsJson}' ${minutesBack}`;
+      const collector = getCollector(this.apiId, this.apiHash, this.phones);
       
-      console.log('Executing Telegram MTProto client...');
       console.log(`Processing ${channels.length} channels with ${minutesBack} minutes lookback`);
-      console.log('Command:', pythonCommand);
-      
-      // Add timeout to prevent hanging - increased for large channel lists
-      const timeoutMs = Math.max(60000, channels.length * 10000); // 10 seconds per channel, minimum 60 seconds
-      const { stdout, stderr } = await Promise.race([
-        execAsync(pythonCommand),
-        new Promise<never>((_, reject) => 
-          setTimeout(() => reject(new Error(`Telegram script timeout after ${timeoutMs/1000} seconds`)), timeoutMs)
-        )
-      ]);
       
-      console.log('Python script stdout:', stdout);
-      if (stderr) {
-        console.log('Python script stderr:', stderr);
-      }
-      
-      // Check for authentication setup requirements
-      if (stdout.includes('SETUP_REQUIRED') || stdout.includes('ERROR: No authenticated session found') || 
-          stdout.includes('ERROR: Session expired or invalid')) {
-        throw new Error('AUTHENTICATION_REQUIRED: Please run authentication setup first. Command: python3 server/services/telegram_auth_setup.py ' + this.apiId + ' ' + this.apiHash + ' ' + this.phone);
-      }
+      // Results stream in per channel, so this is the longest we wait without hearing anything
+      const idleTimeoutMs = 120000;
+      const messages: TelegramMessage[] = [];
+      let channelsDone = 0;
+      let messagesCollected = 0;
       
-      if (stderr && !stderr.includes('Warning') && !stderr.includes('DeprecationWarning')) {
-        console.error('Telegram MTProto error:', stderr);
-        throw new Error(`Telegram authentication failed: ${stderr}`);
-      }
-      
-      if (!stdout || stdout.trim() === '') {
-        console.error('No output from Telegram script');
-        throw new Error('No response from Telegram - check credentials and network');
-      }
-      
-      // Parse the output to extract messages
-      const startMarker = 'TELEGRAM_MESSAGES_START';
-      const endMarker = 'TELEGRAM_MESSAGES_END';
-      
-      const startIndex = stdout.indexOf(startMarker);
-      const endIndex = stdout.indexOf(endMarker);
-      
-      if (startIndex === -1 || endIndex === -1) {
-        // If no message markers found, check if there's useful error info
-        if (stdout.includes('Error:') || stdout.includes('ERROR:')) {
-          const errorLine = stdout.split('\n').find(line => line.includes('Error:') || line.includes('ERROR:'));
-          throw new Error(`Telegram client error: ${errorLine || 'Unknown error'}`);
+      const onEvent = (event: any) => {
+        if (event.event === 'message') {
+          messages.push(event.message);
+        } else if (event.event === 'channel_done' || event.event === 'channel_error') {
+          channelsDone++;
+          messagesCollected += event.messages || 0;
+          onProgress?.({
+            channelsDone,
+            channelsTotal: Math.max(channels.length, channelsDone),
+            messagesCollected,
+            report: event as ChannelReport,
+          });
         }
-        console.log('No message markers found in output, assuming no messages');
-        return [];
-      }
-      
-      const jsonString = stdout.substring(startIndex + startMarker.length, endIndex).trim();
-      
-      if (!jsonString) {
-        console.log('No messages found in the specified time range');
-        return [];
-      }
+      };
       
-      let result;
+      let result: CollectionResult;
       try {
-        result = JSON.parse(jsonString);
-      } catch (parseError) {
-        console.error('Failed to parse JSON from Python script:', jsonString);
-        throw new Error('Invalid response format from Telegram script');
+        result = await collector.call(
+          'collect',
+          {
+            channels,
+            minutesBack,
+            concurrency: COLLECTION_CONCURRENCY,
+            maxStaleness: ARCHIVE_MAX_STALENESS_SECONDS,
+            preprocess: true,
+            dedupe: true,
+            maxClusters: TOPIC_CLUSTERS,
+            stream: true,
+          },
+          idleTimeoutMs,
+          onEvent,
+          signal,
+        );
+      } catch (error) {
+        if (error instanceof CollectorError && error.code === SETUP_REQUIRED_CODE) {
+          throw new Error('AUTHENTICATION_REQUIRED: Please run authentication setup first. Command: python3 server/services/telegram_auth_setup.py ' + this.apiId + ' ' + this.apiHash + ' ' + this.phone);
+        }
+        throw error;
       }
       
-      if (result.error) {
-        console.error('Telegram client error:', result.error);
-        throw new Error(`Telegram error: ${result.error}`);
+      const failed = (result?.channels || []).filter(report => report.status === 'error');
+      failed.forEach(report => console.warn(`Channel ${report.channel} failed after ${report.elapsedMs}ms: ${report.error}`));
+      (result?.channels || [])
+        .filter(report => report.complete === false)
+        .forEach(report => console.warn(`Channel ${report.channel} was truncated: only messages since ${new Date(report.coveredSince! * 1000).toISOString()} were collected`));
+      if (result?.channels?.length) {
+        const slowest = [...result.channels].sort((a, b) => b.elapsedMs - a.elapsedMs)[0];
+        console.log(`Collected ${result.channels.length - failed.length}/${result.channels.length} channels (slowest: ${slowest.channel} in ${slowest.elapsedMs}ms)`);
       }
       
-      // result should be an array of TelegramMessage objects
-      const messages: TelegramMessage[] = Array.isArray(result) ? result : [];
-      console.log(`Retrieved ${messages.length} messages from Telegram`);
+      console.log(`Retrieved ${result?.total ?? messages.length} messages from Telegram (${messages.length} after removing cross-channel duplicates)`);
+      if (result?.clusters?.length) {
+        console.log(`Topic clusters: ${result.clusters.map(c => `${c.terms.slice(0, 3).join('/')} (${c.size})`).join(', ')}`);
+      }
       
       return messages;
     } catch (error) {
@@ -118,6 +182,58 @@ export class TelegramService {
     }
   }
 
+  // Spawn the collector and connect its accounts before the first analysis needs them
+  warmUp(): Promise<void> {
+    return getCollector(this.apiId, this.apiHash, this.phones).start();
+  }
+
+  // Subscribe the collector to new messages in `channels` so later collections read its window instantly
+  async listen(channels: string[], windowMinutes: number): Promise<void> {
+    const collector = getCollector(this.apiId, this.apiHash, this.phones);
+    const result = await collector.listen(channels, Math.max(windowMinutes, LIVE_WINDOW_MIN_MINUTES));
+    const failed = (result?.channels || []).filter((report: ChannelReport) => report.status === 'error');
+    failed.forEach((report: ChannelReport) => console.warn(`Not listening to ${report.channel}: ${report.error}`));
+    console.log(`Listening to ${result?.live ?? 0}/${channels.length} channels for new messages`);
+  }
+
+  // Semantic search over everything the collector has archived, from its local index (semantic_index.py)
+  async search(query: string, options: { limit?: number; minutesBack?: number; channels?: string[] } = {}): Promise<SearchResponse> {
+    const collector = getCollector(this.apiId, this.apiHash, this.phones);
+    return collector.call<SearchResponse>('search', { query, ...options }, SEARCH_TIMEOUT_MS);
+  }
+
+  // Full-text search over the archive (FTS5 in the collector's message store); `since`/`until` are unix seconds
+  async searchText(
+    query: string,
+    options: { limit?: number; offset?: number; channels?: string[]; since?: number; until?: number } = {},
+  ): Promise<TextSearchResponse> {
+    const collector = getCollector(this.apiId, this.apiHash, this.phones);
+    return collector.call<TextSearchResponse>('fulltext', { query, ...options }, SEARCH_TIMEOUT_MS);
+  }
+
+  // Every archived message matching the filters, oldest first, one page at a time; `since`/`until` are unix seconds
+  async *exportMessages(filters: { channels?: string[]; since?: number; until?: number } = {}): AsyncGenerator<TelegramMessage[]> {
+    const collector = getCollector(this.apiId, this.apiHash, this.phones);
+    let cursor: [number, number] | null = null;
+    do {
+      const page: { messages: TelegramMessage[]; cursor: [number, number] | null } =
+        await collector.call('export_messages', { ...filters, cursor, limit: EXPORT_PAGE_SIZE });
+      yield page.messages;
+      cursor = page.cursor;
+    } while (cursor);
+  }
+
+  // A Parquet file written by the collector (needs pyarrow there), for exports
+  async openParquet(columns: ExportColumn[]): Promise<ParquetFile> {
+    const collector = getCollector(this.apiId, this.apiHash, this.phones);
+    const { exportId } = await collector.call<{ exportId: number }>('parquet_open', { columns });
+    return {
+      write: async (rows) => { await collector.call('parquet_write', { exportId, rows }); },
+      close: () => collector.call('parquet_close', { exportId }),
+      abort: async () => { await collector.call('parquet_close', { exportId, abort: true }); },
+    };
+  }
+
   async testConnection(): Promise<boolean> {
     try {
       // Validate MTProto credentials format
@@ -139,8 +255,9 @@ export class TelegramService {
       }
 
       // Validate phone number format
-      if (!/^\+?[1-9]\d{1,14}$/.test(this.phone)) {
-        console.log('Invalid phone number format');
+      const invalidPhone = this.phones.find(phone => !/^\+?[1-9]\d{1,14}$/.test(phone));
+      if (invalidPhone) {
+        console.log(`Invalid phone number format: ${invalidPhone}`);
         return false;
       }
 
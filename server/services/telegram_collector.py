@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Long-lived Telegram collector process.
+Keeps a pool of authorized Telethon clients connected (one per account, see
+account_pool.py) and serves collection requests as newline-delimited
+JSON-RPC 2.0 over stdin/stdout. Logs go to stderr.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+
+import exporter
+from account_pool import AccountPool
+from live_window import LiveWindow, DEFAULT_WINDOW_MINUTES
+from message_store import MessageStore
+from preprocess import Preprocessor
+from semantic_index import SemanticIndex
+from tracing import set_sink, span
+from telegram_simple import (SetupRequiredError, clean_channel_name, message_store_path, semantic_index_path,
+                             DEFAULT_BACKFILL_LIMIT, DEFAULT_CONCURRENCY)
+
+# Archive messages a search waits to have indexed first; a larger backlog is indexed in the background
+SEARCH_MAX_CATCH_UP = 5000
+MAX_SEARCH_RESULTS = 100
+MAX_EXPORT_PAGE = 20000
+# Archived messages older than this are pruned (0 keeps everything)
+ARCHIVE_RETENTION_DAYS = float(os.environ.get('ARCHIVE_RETENTION_DAYS', 30))
+PRUNE_INTERVAL = 3600
+# Messages deleted per step, so a large first prune doesn't hold up requests
+PRUNE_BATCH = 10000
+
+# JSON-RPC error codes
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+SETUP_REQUIRED = -32001
+UNSUPPORTED = -32002
+
+# Protocol frames own stdout; everything printed by the collection code goes to stderr
+protocol_out = sys.stdout
+sys.stdout = sys.stderr
+
+
+def send(frame):
+    protocol_out.write(json.dumps(frame, ensure_ascii=False) + "\n")
+    protocol_out.flush()
+
+
+class RpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class CollectorDaemon:
+    def __init__(self, api_id, api_hash, phones):
+        # Each account's limiter is shared by every collection so concurrent requests can't exceed its limits together
+        self.pool = AccountPool(api_id, api_hash, phones)
+        self.started_at = time.time()
+        self.requests_served = 0
+        # The archive belongs to the first account; the others write into it too
+        self.store = MessageStore(message_store_path(phones[0]), retention=ARCHIVE_RETENTION_DAYS * 86400 or None)
+        self.preprocessor = Preprocessor(self.store)
+        self.index = SemanticIndex(semantic_index_path(phones[0]))
+        # Rowids pruned before the archive used AUTOINCREMENT may still be in the index
+        self.store.reserve_rowids(self.index.meta['cursor'])
+        self.index_lock = asyncio.Lock()
+        self.exports = {}
+        self.export_ids = itertools.count(1)
+        # Pushed updates come from one account, the first connected one
+        self.listener = next(iter(self.pool.accounts.values()))
+        self.live = LiveWindow(self.store, self.listener.entity_cache, self.listener.limiter)
+        self.listen_params = None
+        self.connect_lock = asyncio.Lock()
+        self.stopping = asyncio.Event()
+        # Requests in progress by id, so the server can cancel one it gave up on
+        self.in_progress = {}
+
+    @property
+    def user(self):
+        return self.listener.user
+
+    async def ensure_client(self):
+        """Return the listening account's connected client, (re)connecting accounts if needed"""
+        async with self.connect_lock:
+            try:
+                primary = await self.pool.connect()
+            except SetupRequiredError as e:
+                raise RpcError(SETUP_REQUIRED, str(e))
+
+            if primary is not self.listener:
+                print(f"Listening through {primary.phone} instead of {self.listener.phone}")
+                self.listener = primary
+                self.live = LiveWindow(self.store, primary.entity_cache, primary.limiter)
+            if self.listen_params is not None and self.live.client is not primary.client:
+                # A new connection starts without coverage; backfill and listen again in the background
+                self.live.attach(primary.client)
+                asyncio.ensure_future(self.resubscribe(primary.client))
+            return primary.client
+
+    async def resubscribe(self, client):
+        try:
+            await self.live.subscribe(client, **self.listen_params)
+        except Exception as e:
+            print(f"Failed to resume listening: {e}")
+
+    async def rpc_ping(self, params, request_id):
+        return {
+            'connected': self.listener.connected,
+            'user': self.user,
+            'uptime': round(time.time() - self.started_at, 1),
+            'requestsServed': self.requests_served,
+            'accounts': self.pool.stats(),
+            'archive': self.store.stats(),
+            'live': self.live.stats(),
+            'preprocess': self.preprocessor.stats(),
+            'index': self.index.stats(),
+        }
+
+    async def rpc_collect(self, params, request_id):
+        channels = params.get('channels')
+        if not isinstance(channels, list):
+            raise RpcError(INVALID_PARAMS, "'channels' must be a list")
+        minutes_back = int(params.get('minutesBack', 60))
+        concurrency = int(params.get('concurrency', DEFAULT_CONCURRENCY))
+        max_staleness = float(params.get('maxStaleness', 0))
+
+        # Messages and per-channel progress go out as notifications as soon as they are ready
+        def notify(event):
+            send({'jsonrpc': '2.0', 'method': 'collect.event', 'params': {'requestId': request_id, **event}})
+        on_event = notify if params.get('stream') else None
+
+        await self.ensure_client()
+        result = await self.pool.collect(channels, minutes_back, concurrency=concurrency, store=self.store,
+                                         on_event=on_event, max_staleness=max_staleness,
+                                         dedupe=bool(params.get('dedupe')), live=self.live,
+                                         preprocessor=self.preprocessor if params.get('preprocess') else None,
+                                         max_clusters=int(params.get('maxClusters', 0)),
+                                         backfill_limit=int(params.get('backfill', DEFAULT_BACKFILL_LIMIT)))
+        asyncio.ensure_future(self.update_index())
+        return result
+
+    async def update_index(self):
+        """Embed what the archive gained since the last update, on a worker thread"""
+        async with self.index_lock:
+            try:
+                with span('index_update'):
+                    added = await asyncio.get_running_loop().run_in_executor(None, self.index.update, self.store.path)
+                if added:
+                    print(f"Indexed {added} messages for search")
+            except Exception as e:
+                print(f"Failed to update the search index: {e}")
+
+    async def prune_archive(self):
+        """Drop archived messages past the retention period, now and then every PRUNE_INTERVAL"""
+        while not self.stopping.is_set():
+            try:
+                with span('prune') as labels:
+                    deleted = 0
+                    while True:
+                        batch = self.store.prune(PRUNE_BATCH)
+                        deleted += batch
+                        if batch < PRUNE_BATCH:
+                            break
+                        await asyncio.sleep(0)
+                    labels['deleted'] = deleted
+                if deleted:
+                    print(f"Pruned {deleted} archived messages older than {ARCHIVE_RETENTION_DAYS:g} days")
+            except Exception as e:
+                print(f"Failed to prune the archive: {e}")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), PRUNE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def rpc_search(self, params, request_id):
+        query = params.get('query')
+        if not isinstance(query, str) or not query.strip():
+            raise RpcError(INVALID_PARAMS, "'query' must be a non-empty string")
+        limit = min(max(int(params.get('limit', 20)), 1), MAX_SEARCH_RESULTS)
+        channels = params.get('channels')
+        if channels is not None:
+            if not isinstance(channels, list):
+                raise RpcError(INVALID_PARAMS, "'channels' must be a list")
+            channels = [clean_channel_name(c) for c in channels if c.strip()]
+        since = None
+        if params.get('minutesBack'):
+            since = int(time.time() - float(params['minutesBack']) * 60)
+        if self.store.retention:
+            # Vectors of pruned messages are still indexed; don't spend result slots on them
+            since = max(since or 0, int(time.time() - self.store.retention))
+
+        backlog = self.store.max_rowid() - self.index.meta['cursor']
+        if backlog <= SEARCH_MAX_CATCH_UP:
+            await self.update_index()
+        elif not self.index_lock.locked():
+            asyncio.ensure_future(self.update_index())
+
+        with span('search', indexed=self.index.meta['count']):
+            hits, scored = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: self.index.search(query, limit, since=since, channels=channels))
+        messages = self.store.lookup([(channel, message_id) for channel, message_id, _ in hits])
+        scores = {(channel, message_id): score for channel, message_id, score in hits}
+        return {
+            'results': [{**m, 'score': scores[(m['channel'], m['id'])]} for m in messages],
+            'indexed': self.index.meta['count'],
+            'scored': scored,
+            'indexing': backlog > SEARCH_MAX_CATCH_UP,
+        }
+
+    async def rpc_fulltext(self, params, request_id):
+        query = params.get('query')
+        if not isinstance(query, str) or not query.strip():
+            raise RpcError(INVALID_PARAMS, "'query' must be a non-empty string")
+        limit = min(max(int(params.get('limit', 20)), 1), MAX_SEARCH_RESULTS)
+        offset = max(int(params.get('offset', 0)), 0)
+        channels = params.get('channels')
+        if channels is not None:
+            if not isinstance(channels, list):
+                raise RpcError(INVALID_PARAMS, "'channels' must be a list")
+            channels = [clean_channel_name(c) for c in channels if c.strip()]
+        since = int(params['since']) if params.get('since') is not None else None
+        until = int(params['until']) if params.get('until') is not None else None
+
+        with span('fulltext'):
+            # One extra row tells whether there is a next page
+            results = self.store.search(query, limit + 1, offset, channels=channels, since=since, until=until)
+        return {
+            'results': results[:limit],
+            'nextOffset': offset + limit if len(results) > limit else None,
+        }
+
+    async def rpc_export_messages(self, params, request_id):
+        """One page of archived messages for a bulk export, oldest first; pass 'cursor' back for the next"""
+        limit = min(max(int(params.get('limit', 5000)), 1), MAX_EXPORT_PAGE)
+        channels = params.get('channels')
+        if channels is not None:
+            if not isinstance(channels, list):
+                raise RpcError(INVALID_PARAMS, "'channels' must be a list")
+            channels = [clean_channel_name(c) for c in channels if c.strip()]
+        with span('export_page', limit=limit):
+            messages, cursor = self.store.export_page(params.get('cursor'), limit, channels=channels,
+                                                      since=params.get('since'), until=params.get('until'))
+        return {'messages': messages, 'cursor': cursor if len(messages) == limit else None}
+
+    async def rpc_parquet_open(self, params, request_id):
+        if not exporter.available():
+            raise RpcError(UNSUPPORTED, "Parquet export needs pyarrow installed for the collector")
+        columns = params.get('columns')
+        if not isinstance(columns, list) or not columns:
+            raise RpcError(INVALID_PARAMS, "'columns' must be a non-empty list of [name, type]")
+        try:
+            export = exporter.ParquetExport(columns)
+        except KeyError as e:
+            raise RpcError(INVALID_PARAMS, f"Unknown column type {e}")
+        export_id = next(self.export_ids)
+        self.exports[export_id] = export
+        return {'exportId': export_id}
+
+    async def rpc_parquet_write(self, params, request_id):
+        export = self._export(params)
+        with span('parquet_write', rows=len(params.get('rows') or [])):
+            # Encoding and compression are CPU-bound
+            await asyncio.get_running_loop().run_in_executor(None, export.write, params.get('rows') or [])
+        return {'rows': export.rows}
+
+    async def rpc_parquet_close(self, params, request_id):
+        export = self._export(params)
+        del self.exports[params['exportId']]
+        if params.get('abort'):
+            export.abort()
+            return {'aborted': True}
+        return export.close()
+
+    def _export(self, params):
+        export = self.exports.get(params.get('exportId'))
+        if export is None:
+            raise RpcError(INVALID_PARAMS, f"Unknown export {params.get('exportId')}")
+        return export
+
+    async def rpc_listen(self, params, request_id):
+        channels = params.get('channels')
+        if not isinstance(channels, list):
+            raise RpcError(INVALID_PARAMS, "'channels' must be a list")
+        listen_params = {
+            'channels': channels,
+            'window_minutes': int(params.get('windowMinutes', DEFAULT_WINDOW_MINUTES)),
+            'join': bool(params.get('join', True)),
+        }
+
+        # Set after connecting so a first connection isn't resubscribed in the background as well
+        client = await self.ensure_client()
+        self.listen_params = listen_params
+        reports = await self.live.subscribe(client, **listen_params)
+        return {'channels': reports, 'live': self.live.stats()['live']}
+
+    async def rpc_cancel(self, params, request_id):
+        task = self.in_progress.get(params.get('requestId'))
+        if task is not None:
+            task.cancel()
+        return {'cancelled': task is not None}
+
+    async def rpc_shutdown(self, params, request_id):
+        self.stopping.set()
+        return {'stopping': True}
+
+    async def handle(self, request):
+        request_id = request.get('id')
+        method = getattr(self, f"rpc_{request.get('method')}", None)
+        try:
+            if method is None:
+                raise RpcError(METHOD_NOT_FOUND, f"Unknown method: {request.get('method')}")
+            result = await method(request.get('params') or {}, request_id)
+            self.requests_served += 1
+            with span('serialize', method=request.get('method')):
+                send({'jsonrpc': '2.0', 'id': request_id, 'result': result})
+        except RpcError as e:
+            send({'jsonrpc': '2.0', 'id': request_id, 'error': {'code': e.code, 'message': str(e)}})
+        except Exception as e:
+            print(f"Error handling {request.get('method')}: {str(e)}")
+            send({'jsonrpc': '2.0', 'id': request_id, 'error': {'code': INTERNAL_ERROR, 'message': str(e)}})
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=16 * 1024 * 1024)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+        # Connect eagerly so the first analysis doesn't pay for it
+        try:
+            await self.ensure_client()
+            send({'jsonrpc': '2.0', 'method': 'ready', 'params': {'authorized': True, 'user': self.user}})
+        except Exception as e:
+            print(f"ERROR: {e}")
+            send({'jsonrpc': '2.0', 'method': 'ready', 'params': {'authorized': False, 'error': str(e)}})
+
+        tasks = set()
+        stop_wait = asyncio.ensure_future(self.stopping.wait())
+        pruner = asyncio.ensure_future(self.prune_archive()) if self.store.retention else None
+        try:
+            while not self.stopping.is_set():
+                read_line = asyncio.ensure_future(reader.readline())
+                done, _ = await asyncio.wait({read_line, stop_wait}, return_when=asyncio.FIRST_COMPLETED)
+                if read_line not in done:
+                    read_line.cancel()
+                    break
+
+                line = read_line.result()
+                if not line:
+                    break  # parent closed stdin
+                if not line.strip():
+                    continue
+
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Ignoring malformed request: {line[:200]!r}")
+                    continue
+
+                task = asyncio.ensure_future(self.handle(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if request.get('id') is not None:
+                    request_id = request['id']
+                    self.in_progress[request_id] = task
+                    task.add_done_callback(lambda _, request_id=request_id: self.in_progress.pop(request_id, None))
+
+            if tasks:
+                await asyncio.wait(tasks, timeout=10)
+        finally:
+            stop_wait.cancel()
+            if pruner:
+                pruner.cancel()
+            await self.pool.close()
+            for export in self.exports.values():
+                export.abort()
+            self.preprocessor.close()
+            self.store.close()
+
+
+async def main():
+    """Main function for the collector daemon"""
+    if len(sys.argv) < 4:
+        print("Usage: python telegram_collector.py <api_id> <api_hash> <phone>[,<phone>...]")
+        sys.exit(1)
+
+    # Timing spans go to the server as notifications, aggregated there into metrics
+    set_sink(lambda s: send({'jsonrpc': '2.0', 'method': 'span', 'params': s}))
+    phones = [phone.strip() for phone in sys.argv[3].split(',') if phone.strip()]
+    daemon = CollectorDaemon(int(sys.argv[1]), sys.argv[2], phones)
+    await daemon.serve()
+
+if __name__ == "__main__":
+    asyncio.run(main())
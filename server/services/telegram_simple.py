@@ -6,117 +6,574 @@ Handles authentication state properly and provides clear error messages.
 
 import asyncio
 import json
+import math
 import sys
 import os
-from datetime import datetime, timedelta
+import time
+from datetime import datetime, timezone
 from telethon import TelegramClient
-from telethon.errors import SessionPasswordNeededError, PhoneCodeInvalidError, PhoneNumberInvalidError
+from telethon.errors import (SessionPasswordNeededError, PhoneCodeInvalidError, PhoneNumberInvalidError, FloodWaitError,
+                             AuthKeyUnregisteredError, AuthKeyDuplicatedError, SessionRevokedError, SessionExpiredError,
+                             UserDeactivatedError, UserDeactivatedBanError)
 from telethon.tl.types import Channel
 
-async def get_messages_with_session(api_id, api_hash, phone, channels, minutes_back):
-    """Get messages using existing session or provide clear instructions for setup"""
-    
-    # Create session name based on phone
-    session_name = f"telegram_session_{phone.replace('+', '').replace(' ', '')}"
+from clustering import cluster_messages
+from dedup import group_duplicates
+from entity_cache import EntityCache
+from message_store import MessageStore, ENGAGEMENT_FIELDS
+from rate_limiter import RateLimiter
+from tracing import span
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_CHANNEL_TIMEOUT = 60
+# Messages requested per channel walk, and per page of a backfill (one GetHistory request each)
+FETCH_LIMIT = 100
+# Messages a backfill may download per walk when the window holds more than FETCH_LIMIT (0 disables backfill)
+DEFAULT_BACKFILL_LIMIT = 5000
+# The rest of the window is split into at most this many time ranges fetched concurrently,
+# each expected to hold about BACKFILL_RANGE_MESSAGES going by the first page's message rate
+BACKFILL_RANGES = 8
+BACKFILL_RANGE_MESSAGES = 500
+# FloodWaits longer than this fail the channel instead of stalling the whole run
+MAX_FLOOD_WAIT = 60
+MAX_FLOOD_RETRIES = 2
+# Raised mid-collection when the account's session stops being usable
+INVALID_SESSION_ERRORS = (AuthKeyUnregisteredError, AuthKeyDuplicatedError, SessionRevokedError, SessionExpiredError,
+                          UserDeactivatedError, UserDeactivatedBanError)
+# Set to run against telegram_simulator.py instead of Telegram (see that module)
+SIMULATOR_ENV = 'TELEGRAM_SIMULATOR'
+
+
+class SetupRequiredError(Exception):
+    """Raised when the session file is missing or no longer authorized"""
+
+
+def session_name_for(phone):
+    """Session name used by telegram_auth_setup.py for this phone"""
+    name = f"telegram_session_{phone.replace('+', '').replace(' ', '')}"
+    if os.environ.get(SIMULATOR_ENV):
+        # Keep simulated runs from filling the real account's caches and archive
+        return f"simulated_{name}"
+    return name
+
+
+def entity_cache_path(phone):
+    """Entity cache lives next to the session file it belongs to (access hashes are per account)"""
+    return f"{session_name_for(phone)}.entities.db"
+
+
+def message_store_path(phone):
+    return f"{session_name_for(phone)}.messages.db"
+
+
+def semantic_index_path(phone):
+    """Directory of the search index built over the archive at message_store_path()"""
+    return f"{session_name_for(phone)}.index"
+
+
+def setup_command(api_id, api_hash, phone):
+    return f"python3 server/services/telegram_auth_setup.py {api_id} {api_hash} {phone}"
+
+
+async def open_client(api_id, api_hash, phone):
+    """Connect an already authenticated client, raising SetupRequiredError otherwise"""
+    simulation = os.environ.get(SIMULATOR_ENV)
+    if simulation:
+        # Imported lazily: the simulator's benchmark entry point imports this module
+        from telegram_simulator import SimulatedClient, parse_spec
+        client = SimulatedClient(phone, **parse_spec(simulation))
+        await client.connect()
+        return client
+
+    session_name = session_name_for(phone)
     session_file = f"{session_name}.session"
-    
+
     # Check if session file exists
     if not os.path.exists(session_file):
-        print("ERROR: No authenticated session found")
-        print("SETUP_REQUIRED: Please run the authentication setup first")
-        print(f"Command: python3 server/services/telegram_auth_setup.py {api_id} {api_hash} {phone}")
-        return []
-    
+        raise SetupRequiredError("No authenticated session found")
+
     client = TelegramClient(session_name, api_id, api_hash)
-    
-    try:
+    with span('connect'):
         await client.connect()
-        
-        if not await client.is_user_authorized():
-            print("ERROR: Session expired or invalid")
-            print("SETUP_REQUIRED: Please re-run authentication setup")
-            print(f"Command: python3 server/services/telegram_auth_setup.py {api_id} {api_hash} {phone}")
+
+    if not await client.is_user_authorized():
+        await client.disconnect()
+        raise SetupRequiredError("Session expired or invalid")
+
+    return client
+
+
+def clean_channel_name(channel_name):
+    clean_name = channel_name.strip()
+    if not clean_name.startswith('@'):
+        clean_name = '@' + clean_name
+    return clean_name
+
+
+def message_record(message, clean_name):
+    """The dict shape every collection path produces, or None for messages without text"""
+    if not message.text:
+        return None
+    return {
+        'id': message.id,
+        'text': message.text,
+        'date': int(message.date.timestamp()),
+        'channel': clean_name,
+        'url': f"https://t.me/{clean_name.replace('@', '')}/{message.id}",
+        **engagement(message),
+    }
+
+
+def engagement(message):
+    """Counts Telegram already sends with every message (nothing extra is downloaded)"""
+    replies = getattr(message, 'replies', None)
+    reactions = getattr(message, 'reactions', None)
+    return dict(zip(ENGAGEMENT_FIELDS, (
+        getattr(message, 'views', None) or 0,
+        getattr(message, 'forwards', None) or 0,
+        replies.replies if replies else 0,
+        sum(r.count for r in reactions.results) if reactions else 0,
+    )))
+
+
+async def resolve_channel(client, clean_name, limiter, timeout, entity_cache=None):
+    """Return (peer, from_cache), resolving the username only when the cache can't answer"""
+    cached = entity_cache.get(clean_name) if entity_cache else None
+    if cached is not None:
+        peer, is_channel = cached
+        if not is_channel:
+            raise ValueError(f"{clean_name} is not a public channel")
+        return peer, True
+
+    # Get channel entity
+    with span('limiter_wait'):
+        await limiter.acquire()
+    with span('resolve', channel=clean_name):
+        entity = await asyncio.wait_for(client.get_entity(clean_name), timeout)
+    if entity_cache:
+        entity_cache.put(clean_name, entity)
+
+    if not isinstance(entity, Channel):
+        raise ValueError(f"{clean_name} is not a public channel")
+    return entity, False
+
+
+async def fetch_history(client, peer, clean_name, cutoff_ts, limiter, timeout, min_id=0, offset_date=None,
+                        backfill_limit=0):
+    """Page backwards from the newest message (or from `offset_date`) down to the cutoff or to `min_id`.
+
+    Returns (text messages, newest id seen, oldest date seen, why the walk stopped),
+    where the reason is 'cutoff', 'limit' or 'end' (reached min_id or the first message).
+    A walk that hits FETCH_LIMIT first is continued by backfill() for up to
+    `backfill_limit` more messages, and only stops at 'limit' if that runs out too.
+    The timeout applies to the Telegram request, not to time spent waiting on the limiter.
+    """
+    async def walk():
+        messages = []
+        newest_id = min_id
+        newest_date = oldest_date = None
+        oldest_id = 0
+        seen = 0
+        stop = 'end'
+        async for message in client.iter_messages(peer, limit=FETCH_LIMIT, min_id=min_id, offset_date=offset_date):
+            seen += 1
+            newest_id = max(newest_id, message.id)
+            if message.date.timestamp() < cutoff_ts:
+                stop = 'cutoff'
+                break
+
+            oldest_date = int(message.date.timestamp())
+            newest_date = newest_date or oldest_date
+            oldest_id = message.id
+            record = message_record(message, clean_name)
+            if record:
+                messages.append(record)
+        else:
+            if seen >= FETCH_LIMIT:
+                stop = 'limit'
+        return messages, newest_id, oldest_date, stop, newest_date, oldest_id
+
+    with span('limiter_wait'):
+        await limiter.acquire()
+    with span('fetch', channel=clean_name) as labels:
+        messages, newest_id, oldest_date, stop, newest_date, oldest_id = await asyncio.wait_for(walk(), timeout)
+        labels['messages'] = len(messages)
+    if stop != 'limit' or backfill_limit <= 0:
+        return messages, newest_id, oldest_date, stop
+
+    # Messages per second on the first page, to size the ranges for the rest of the window
+    rate = FETCH_LIMIT / max(1, newest_date - oldest_date)
+    older, older_newest_id, older_oldest_date, stop = await backfill(
+        client, peer, clean_name, cutoff_ts, oldest_date, oldest_id, rate, limiter, timeout, min_id, backfill_limit)
+    known = {m['id'] for m in messages}
+    messages.extend(m for m in older if m['id'] not in known)
+    return messages, max(newest_id, older_newest_id), older_oldest_date or oldest_date, stop
+
+
+async def backfill(client, peer, clean_name, cutoff_ts, end_ts, max_id, rate, limiter, timeout, min_id, budget):
+    """Fetch the window from `end_ts` (continuing below message `max_id`) back to the cutoff.
+
+    The span is split into equal time ranges, as many as its expected message count
+    needs, which page backwards concurrently under the shared limiter with `budget`
+    split evenly between them. Results are merged newest first, the shape and stop
+    reason of fetch_history(); where a range ran out of budget, the oldest date seen
+    is where the contiguous part of the window ends.
+    """
+    expected = rate * (end_ts - cutoff_ts)
+    count = max(1, min(BACKFILL_RANGES, math.ceil(expected / BACKFILL_RANGE_MESSAGES), budget // FETCH_LIMIT))
+    bounds = [end_ts - (end_ts - cutoff_ts) * i // count for i in range(count + 1)]
+    ranges = [(bounds[i + 1], bounds[i], max_id if i == 0 else 0) for i in range(count)]
+
+    with span('backfill', channel=clean_name, ranges=count) as labels:
+        tasks = [asyncio.ensure_future(fetch_range(client, peer, clean_name, start, end, start_id, min_id,
+                                                   budget // count, limiter, timeout))
+                 for start, end, start_id in ranges]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # One failed range fails the channel; don't leave the others drawing on the limiter
+            for task in tasks:
+                task.cancel()
+            raise
+
+        messages = []
+        seen_ids = set()
+        newest_id = min_id
+        oldest_date = None
+        stop = 'cutoff'
+        for records, range_newest_id, range_oldest_date, range_stop in results:
+            messages.extend(m for m in records if m['id'] not in seen_ids)
+            seen_ids.update(m['id'] for m in records)
+            newest_id = max(newest_id, range_newest_id)
+            if stop == 'cutoff':
+                oldest_date = range_oldest_date
+                # A range that ran out of budget leaves a gap; one that reached min_id has nothing below it
+                if range_stop != 'cutoff':
+                    stop = range_stop
+        labels['messages'] = len(messages)
+    return messages, newest_id, oldest_date, stop
+
+
+async def fetch_range(client, peer, clean_name, start_ts, end_ts, max_id, min_id, budget, limiter, timeout):
+    """Page backwards through [start_ts, end_ts): from offset_date `end_ts` (or below `max_id`), then by max_id.
+
+    Returns what fetch_history() does for this range: 'cutoff' once it passes start_ts,
+    'limit' after `budget` messages, 'end' at min_id or the first message. Every page
+    is one request, drawn from the limiter and bounded by the timeout.
+    """
+    async def page(limit, position):
+        return [m async for m in client.iter_messages(peer, limit=limit, min_id=min_id, **position)]
+
+    messages = []
+    newest_id = min_id
+    oldest_date = None
+    seen = 0
+    while seen < budget:
+        limit = min(FETCH_LIMIT, budget - seen)
+        position = ({'max_id': max_id} if max_id
+                    else {'offset_date': datetime.fromtimestamp(end_ts, tz=timezone.utc)})
+        with span('limiter_wait'):
+            await limiter.acquire()
+        batch = await asyncio.wait_for(page(limit, position), timeout)
+        for message in batch:
+            seen += 1
+            newest_id = max(newest_id, message.id)
+            if message.date.timestamp() < start_ts:
+                return messages, newest_id, oldest_date, 'cutoff'
+            oldest_date = int(message.date.timestamp())
+            max_id = message.id
+            record = message_record(message, clean_name)
+            if record:
+                messages.append(record)
+        if len(batch) < limit:
+            return messages, newest_id, oldest_date, 'end'
+    return messages, newest_id, oldest_date, 'limit'
+
+
+async def fetch_incremental(client, peer, clean_name, cutoff_ts, store, limiter, timeout, max_staleness=0,
+                            backfill_limit=0):
+    """Fetch only the parts of the window the archive doesn't cover, then serve the window from it.
+
+    The newer gap is everything past the channel's high-water mark and is skipped when the
+    channel was checked less than `max_staleness` seconds ago; the older gap is whatever the
+    requested cutoff reaches beyond the start of the archived coverage.
+    Returns (window, messages downloaded, start of the archive's gap-free coverage).
+    """
+    last_id, covered_since, checked_at = store.get_state(clean_name) or (0, int(time.time()), 0)
+    fetched = 0
+
+    if time.time() - checked_at > max_staleness:
+        new_messages, last_id, oldest_date, stop = await fetch_history(
+            client, peer, clean_name, cutoff_ts, limiter, timeout, min_id=last_id, backfill_limit=backfill_limit)
+        if stop == 'cutoff':
+            # Stopped before reaching the old mark, so older coverage is no longer contiguous
+            covered_since = cutoff_ts
+        elif stop == 'limit':
+            covered_since = oldest_date
+        elif not checked_at:
+            covered_since = 0  # walked the channel's whole history
+        store.add_messages(new_messages)
+        store.set_state(clean_name, last_id, covered_since, checked_at=time.time())
+        fetched += len(new_messages)
+
+    if covered_since > cutoff_ts:
+        offset_date = datetime.fromtimestamp(covered_since, tz=timezone.utc)
+        old_messages, _, oldest_date, stop = await fetch_history(
+            client, peer, clean_name, cutoff_ts, limiter, timeout, offset_date=offset_date,
+            backfill_limit=backfill_limit)
+        if stop == 'cutoff':
+            covered_since = cutoff_ts
+        elif stop == 'limit':
+            covered_since = oldest_date
+        else:
+            covered_since = 0
+        store.add_messages(old_messages)
+        store.set_state(clean_name, last_id, covered_since)
+        fetched += len(old_messages)
+
+    return store.window(clean_name, cutoff_ts), fetched, covered_since
+
+
+async def collect_channel(client, clean_name, cutoff_ts, limiter, timeout, entity_cache=None, store=None,
+                          max_staleness=0, live=None, backfill_limit=DEFAULT_BACKFILL_LIMIT):
+    """Collect recent text messages from a single public channel.
+
+    Returns (messages in the window, messages downloaded from Telegram, the time from
+    which the messages are complete: the cutoff or earlier unless a walk ran out of budget).
+    """
+    if live is not None and live.covers(clean_name, cutoff_ts):
+        # Kept current by pushed updates: served from memory
+        return live.window(clean_name, cutoff_ts), 0, cutoff_ts
+
+    if store is not None and store.is_fresh(clean_name, cutoff_ts, max_staleness):
+        # The archive already covers the whole window: no Telegram request at all
+        return store.window(clean_name, cutoff_ts), 0, cutoff_ts
+
+    async def fetch(peer):
+        if store is not None:
+            return await fetch_incremental(client, peer, clean_name, cutoff_ts, store, limiter, timeout,
+                                           max_staleness, backfill_limit)
+        messages, _, oldest_date, stop = await fetch_history(client, peer, clean_name, cutoff_ts, limiter, timeout,
+                                                             backfill_limit=backfill_limit)
+        return messages, len(messages), oldest_date if stop == 'limit' else cutoff_ts
+
+    peer, from_cache = await resolve_channel(client, clean_name, limiter, timeout, entity_cache)
+    try:
+        return await fetch(peer)
+    except (FloodWaitError, asyncio.TimeoutError):
+        raise
+    except Exception as e:
+        if not from_cache:
+            raise
+        # The cached id/access_hash no longer works: forget it and resolve once more
+        print(f"Cached entity for {clean_name} failed ({e}), resolving again")
+        entity_cache.invalidate(clean_name)
+        peer, _ = await resolve_channel(client, clean_name, limiter, timeout, entity_cache)
+        return await fetch(peer)
+
+
+async def collect_messages(client, channels, minutes_back, limiter=None, concurrency=DEFAULT_CONCURRENCY,
+                           channel_timeout=DEFAULT_CHANNEL_TIMEOUT, entity_cache=None, store=None, on_event=None,
+                           max_staleness=0, dedupe=False, live=None, flood_retries=MAX_FLOOD_RETRIES, stop=None,
+                           preprocessor=None, max_clusters=0, backfill_limit=DEFAULT_BACKFILL_LIMIT):
+    """Collect recent text messages from public channels with a bounded pool of workers.
+
+    Returns the messages plus one report per channel with its status and timing.
+    With `on_event`, messages are streamed as 'message' events instead of being
+    accumulated, framed by 'channel_start' and 'channel_done'/'channel_error' events.
+    With `dedupe`, near-duplicates across channels are collapsed once every channel
+    is done, and with `max_clusters` the messages are grouped by topic (clustering.py);
+    either way messages are only streamed after the last channel event.
+    Channels a `live` window is listening to are answered from it without any request.
+    A `preprocessor` (preprocess.py) cleans the messages before they are streamed
+    or deduplicated.
+    Windows holding more than one page of messages are backfilled with up to
+    `backfill_limit` more per walk; each report's 'complete' says whether the
+    whole window was collected and, when not, 'coveredSince' where it stops.
+    Once the `stop` event is set, workers take no new channels and the untouched
+    ones are returned as 'remaining'. Failed channels carry 'retryAfter' after a
+    FloodWait and 'accountInvalid' when the session stopped working, so a caller
+    with more accounts can move them.
+    """
+    limiter = limiter or RateLimiter()
+    cutoff_ts = int(time.time()) - minutes_back * 60
+
+    queue = asyncio.Queue()
+    for channel_name in dict.fromkeys(clean_channel_name(c) for c in channels if c.strip()):
+        queue.put_nowait(channel_name)
+
+    all_messages = []
+    reports = []
+    total = 0
+    # Messages go out per channel as they are collected, rather than once at the end
+    streaming = on_event is not None and not (dedupe or max_clusters)
+
+    def emit(event, **fields):
+        if on_event:
+            on_event({'event': event, **fields})
+
+    async def worker():
+        nonlocal total
+        while not (stop and stop.is_set()):
+            try:
+                clean_name = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            print(f"Processing channel: {clean_name}")
+            emit('channel_start', channel=clean_name)
+            started = time.monotonic()
+            report = {'channel': clean_name, 'status': 'ok', 'messages': 0, 'fetched': 0, 'floodWaits': 0}
+            for attempt in range(flood_retries + 1):
+                try:
+                    messages, fetched, covered_since = await collect_channel(
+                        client, clean_name, cutoff_ts, limiter, channel_timeout, entity_cache, store, max_staleness,
+                        live, backfill_limit)
+                    if streaming:
+                        for message in (await preprocessor.run(messages) if preprocessor else messages):
+                            emit('message', message=message)
+                    else:
+                        all_messages.extend(messages)
+                    total += len(messages)
+                    report.update(messages=len(messages), fetched=fetched, complete=covered_since <= cutoff_ts)
+                    if not report['complete']:
+                        report['coveredSince'] = covered_since
+                        print(f"Window of {clean_name} is only complete from {covered_since} (cutoff {cutoff_ts})")
+                    print(f"Collected {len(messages)} messages from {clean_name} ({fetched} new from Telegram)")
+                    break
+                except FloodWaitError as e:
+                    report['floodWaits'] += 1
+                    if e.seconds > MAX_FLOOD_WAIT or attempt == flood_retries:
+                        report.update(status='error', error=f"FloodWait of {e.seconds}s", retryAfter=e.seconds)
+                        limiter.flood_wait(e.seconds)
+                        break
+                    limiter.flood_wait(e.seconds)
+                except asyncio.TimeoutError:
+                    report.update(status='error', error=f"Timed out after {channel_timeout}s")
+                    break
+                except INVALID_SESSION_ERRORS as e:
+                    report.update(status='error', error=f"Session no longer valid: {e}", accountInvalid=True)
+                    break
+                except Exception as e:
+                    report.update(status='error', error=str(e))
+                    break
+
+            if report['status'] == 'error':
+                print(f"Error with channel {clean_name}: {report['error']}")
+            report['elapsedMs'] = int((time.monotonic() - started) * 1000)
+            reports.append(report)
+            emit('channel_done' if report['status'] == 'ok' else 'channel_error', **report)
+
+    workers = max(1, min(concurrency, queue.qsize()))
+    await asyncio.gather(*(worker() for _ in range(workers)))
+
+    print(f"Total messages collected: {total}")
+    result = {'messages': all_messages, 'channels': reports, 'total': total}
+    if stop is not None:
+        result['remaining'] = [queue.get_nowait() for _ in range(queue.qsize())]
+
+    if not streaming:
+        await finish_collection(result, on_event, preprocessor, dedupe, max_clusters)
+    return result
+
+
+async def finish_collection(result, on_event=None, preprocessor=None, dedupe=False, max_clusters=0):
+    """Preprocess, deduplicate and cluster a collection result, streaming the messages when `on_event` is given"""
+    if preprocessor is not None:
+        result['messages'] = await preprocessor.run(result['messages'])
+    # CPU-bound, keep it off the event loop serving other requests
+    loop = asyncio.get_running_loop()
+    if dedupe:
+        total = len(result['messages'])
+        with span('dedupe', messages=total):
+            grouped = await loop.run_in_executor(None, group_duplicates, result['messages'])
+        print(f"Deduplicated {total} messages into {len(grouped)} unique items")
+        result.update(messages=grouped, unique=len(grouped))
+    if max_clusters:
+        total = len(result['messages'])
+        with span('cluster', messages=total):
+            clustered, clusters = await loop.run_in_executor(None, cluster_messages, result['messages'], max_clusters)
+        print(f"Clustered {total} messages into {len(clusters)} topics")
+        result.update(messages=clustered, clusters=clusters)
+    if on_event:
+        for message in result['messages']:
+            on_event({'event': 'message', 'message': message})
+        result['messages'] = []
+    return result
+
+
+async def get_messages_with_session(api_id, api_hash, phone, channels, minutes_back, on_event=None):
+    """Get messages using existing session or provide clear instructions for setup"""
+    client = None
+    entity_cache = EntityCache(entity_cache_path(phone))
+    store = MessageStore(message_store_path(phone))
+
+    try:
+        try:
+            client = await open_client(api_id, api_hash, phone)
+        except SetupRequiredError as e:
+            print(f"ERROR: {e}")
+            print("SETUP_REQUIRED: Please run the authentication setup first")
+            print(f"Command: {setup_command(api_id, api_hash, phone)}")
+            if on_event:
+                on_event({'event': 'error', 'error': str(e), 'setupRequired': True})
             return []
-        
+
         # Get user info
         me = await client.get_me()
         print(f"Authenticated as: {me.first_name} {me.last_name or ''}")
-        
-        # Collect messages
-        all_messages = []
-        cutoff_time = datetime.now() - timedelta(minutes=minutes_back)
-        
-        for channel_name in channels:
-            try:
-                # Clean channel name
-                clean_name = channel_name.strip()
-                if not clean_name.startswith('@'):
-                    clean_name = '@' + clean_name
-                
-                print(f"Processing channel: {clean_name}")
-                
-                # Get channel entity
-                entity = await client.get_entity(clean_name)
-                
-                if not isinstance(entity, Channel):
-                    print(f"Warning: {clean_name} is not a public channel")
-                    continue
-                
-                # Collect recent messages
-                message_count = 0
-                async for message in client.iter_messages(entity, limit=100):
-                    if message.date.replace(tzinfo=None) < cutoff_time:
-                        break
-                    
-                    if message.text:
-                        all_messages.append({
-                            'id': message.id,
-                            'text': message.text,
-                            'date': int(message.date.timestamp()),
-                            'channel': clean_name,
-                            'url': f"https://t.me/{clean_name.replace('@', '')}/{message.id}"
-                        })
-                        message_count += 1
-                
-                print(f"Collected {message_count} messages from {clean_name}")
-                
-            except Exception as e:
-                print(f"Error with channel {channel_name}: {str(e)}")
-                continue
-        
-        print(f"Total messages collected: {len(all_messages)}")
-        return all_messages
-        
+
+        result = await collect_messages(client, channels, minutes_back, entity_cache=entity_cache, store=store,
+                                        on_event=on_event)
+        return result['messages']
+
     except Exception as e:
         print(f"Connection error: {str(e)}")
         return []
     finally:
-        if client.is_connected():
+        if client and client.is_connected():
             await client.disconnect()
+        entity_cache.close()
+        store.close()
 
 async def main():
     """Main function for message collection"""
-    if len(sys.argv) < 5:
-        print("Usage: python telegram_simple.py <api_id> <api_hash> <phone> <channels_json> [minutes_back]")
+    args = [arg for arg in sys.argv[1:] if arg != '--ndjson']
+    ndjson = len(args) != len(sys.argv) - 1
+
+    if len(args) < 4:
+        print("Usage: python telegram_simple.py [--ndjson] <api_id> <api_hash> <phone> <channels_json> [minutes_back]")
         sys.exit(1)
-    
+
     try:
-        api_id = int(sys.argv[1])
-        api_hash = sys.argv[2]
-        phone = sys.argv[3]
-        channels = json.loads(sys.argv[4])
-        minutes_back = int(sys.argv[5]) if len(sys.argv) > 5 else 20
-        
+        api_id = int(args[0])
+        api_hash = args[1]
+        phone = args[2]
+        channels = json.loads(args[3])
+        minutes_back = int(args[4]) if len(args) > 4 else 20
+
+        if ndjson:
+            # One JSON record per line on stdout; progress text moves to stderr
+            out = sys.stdout
+            sys.stdout = sys.stderr
+
+            def write_event(event):
+                out.write(json.dumps(event, ensure_ascii=False) + "\n")
+                out.flush()
+
+            await get_messages_with_session(api_id, api_hash, phone, channels, minutes_back, on_event=write_event)
+            return
+
         messages = await get_messages_with_session(api_id, api_hash, phone, channels, minutes_back)
-        
+
         # Output messages in expected format
         print("TELEGRAM_MESSAGES_START")
         print(json.dumps(messages, ensure_ascii=False))
         print("TELEGRAM_MESSAGES_END")
-        
+
     except Exception as e:
         print(f"Error: {str(e)}")
         sys.exit(1)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -1,119 +1,295 @@
 #!/usr/bin/env python3
 """
-Telegram simulator for testing the complete flow without real credentials
+Offline stand-in for Telegram.
+SimulatedClient implements the part of Telethon's TelegramClient the collector
+uses, backed by a seeded, deterministic message generator instead of MTProto,
+with injectable latency, FloodWait errors and unresolvable usernames. Setting
+TELEGRAM_SIMULATOR (e.g. "seed=1,rate=30,latency=50,flood=0.01") makes
+open_client() return one, so the real collection path, the collector daemon
+and the whole app run against it. Run this file directly to measure collector
+throughput without a live account.
 """
+
+import argparse
+import asyncio
+import hashlib
 import json
+import random
+import struct
 import sys
 import time
-import random
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import Channel, ChatPhotoEmpty
+
+MAX_CHANNELS = 10000
+PAGE_SIZE = 100          # messages per simulated GetHistory request, like Telethon
+# Every channel's timeline starts here so ids are stable across runs and processes
+EPOCH = 1_700_000_000
+
+DEFAULTS = {
+    'seed': 1,
+    'rate': 30.0,          # average messages per hour per channel
+    'min_words': 8,
+    'max_words': 60,
+    'latency': 50.0,       # mean milliseconds per request
+    'flood': 0.0,          # probability that a request raises FloodWaitError
+    'flood_seconds': 5,
+    'missing': 0.0,        # fraction of usernames that don't resolve
+    'duplicates': 0.1,     # fraction of messages reposting a story shared across channels
+    'media': 0.1,          # fraction of messages without text
+    'footers': 0.3,        # fraction of channels signing every post with the same footer
+    'now': 0,              # unix time the timelines end at, so repeated walks agree (0 follows the clock)
+}
+
+_SYLLABLES = ['ka', 'lo', 'mi', 're', 'tu', 'sa', 'ne', 'vo', 'di', 'pa', 'ri', 'go', 'le', 'zu', 'ba', 'ti',
+              'mo', 'ser', 'lan', 'dor', 'vis', 'tan', 'mer', 'col']
+
+
+def parse_spec(spec):
+    """Parse "key=value,..." into client options; a bare "1" uses the defaults"""
+    options = {}
+    for part in spec.split(','):
+        if '=' not in part:
+            continue
+        key, value = (s.strip() for s in part.split('=', 1))
+        if key not in DEFAULTS:
+            raise ValueError(f"Unknown simulator option: {key}")
+        options[key] = type(DEFAULTS[key])(value)
+    return options
+
+
+def simulated_channels(count):
+    """Channel usernames for a simulated run"""
+    if count > MAX_CHANNELS:
+        raise ValueError(f"At most {MAX_CHANNELS} simulated channels")
+    return [f"@sim_{i:05d}" for i in range(count)]
+
+
+def _hash(*parts):
+    digest = hashlib.blake2b(':'.join(str(p) for p in parts).encode(), digest_size=8).digest()
+    return struct.unpack('<Q', digest)[0]
+
+
+def _fraction(*parts):
+    return _hash(*parts) / 2 ** 64
+
+
+class SimulatedMessage:
+    def __init__(self, message_id, text, date, views=0, forwards=0, replies=0, reactions=0):
+        self.id = message_id
+        self.text = text
+        self.date = date
+        # Shaped like Telethon's MessageReplies and MessageReactions
+        self.views = views
+        self.forwards = forwards
+        self.replies = SimpleNamespace(replies=replies)
+        self.reactions = SimpleNamespace(results=[SimpleNamespace(count=reactions)]) if reactions else None
+
+
+class SimulatedClient:
+    def __init__(self, account='', **options):
+        self.options = {**DEFAULTS, **options}
+        self.seed = self.options['seed']
+        # Accounts see the same channels but have their own latency and FloodWait draws
+        self.rng = random.Random(f"{self.seed}:{account}")
+        self.vocabulary = self._vocabulary(2000)
+        self.connected = False
+        self.requests = 0
+        self.flood_waits = 0
+        self.handlers = []
+
+    def _vocabulary(self, size):
+        rng = random.Random(f"vocabulary-{self.seed}")
+        return [''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(1, 4))) for _ in range(size)]
+
+    # Connection and account
+
+    async def connect(self):
+        await self._request()
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    async def disconnect(self):
+        self.connected = False
+
+    async def is_user_authorized(self):
+        return True
 
-def generate_test_messages(channels, minutes_back):
-    """Generate realistic test messages for multiple channels"""
-    messages = []
-    current_time = int(time.time())
-    start_time = current_time - (minutes_back * 60)
-    
-    # Sample messages for different types of channels
-    crypto_messages = [
-        "Bitcoin supera los $98,000 en intercambios principales",
-        "Ethereum actualiza su protocolo con mejoras de eficiencia",
-        "Nuevas regulaciones crypto en la UE entran en vigor",
-        "DeFi TVL alcanza nuevo récord histórico de $85B",
-        "Análisis técnico: BTC muestra señales alcistas a corto plazo"
-    ]
-    
-    news_messages = [
-        "Mercados globales reaccionan positivamente a datos económicos",
-        "Inflación en zona euro muestra signos de moderación",
-        "Tecnológicas lideran ganancias en apertura de Wall Street",
-        "Banco Central anuncia nueva política monetaria expansiva",
-        "Sector energético presenta volatilidad tras acuerdos OPEC"
-    ]
-    
-    tech_messages = [
-        "Nueva actualización de seguridad crítica liberada",
-        "IA generativa transforma industria del software",
-        "Ciberseguridad: detectado nuevo vector de ataque",
-        "Cloud computing registra crecimiento del 40% anual",
-        "Quantum computing alcanza hito importante en estabilidad"
-    ]
-    
-    # Map channels to message types
-    message_sets = {
-        'crypto': crypto_messages,
-        'bitcoin': crypto_messages,
-        'ethereum': crypto_messages,
-        'defi': crypto_messages,
-        'news': news_messages,
-        'finance': news_messages,
-        'markets': news_messages,
-        'tech': tech_messages,
-        'security': tech_messages,
-        'ai': tech_messages
+    async def get_me(self):
+        class Me:
+            first_name = 'Simulated'
+            last_name = 'Account'
+        return Me()
+
+    def add_event_handler(self, callback, event=None):
+        # Accepted so listening works, but the simulator never pushes updates
+        self.handlers.append(callback)
+
+    def remove_event_handler(self, callback, event=None):
+        self.handlers.remove(callback)
+
+    async def __call__(self, request):
+        await self._request()
+
+    # Channels and history
+
+    async def get_entity(self, username):
+        await self._request()
+        key = username.lstrip('@').lower()
+        if _fraction(self.seed, 'missing', key) < self.options['missing']:
+            raise ValueError(f'No user has "{key}" as username')
+        return Channel(
+            id=_hash(self.seed, 'id', key) % 2 ** 31,
+            title=key,
+            photo=ChatPhotoEmpty(),
+            date=datetime.fromtimestamp(EPOCH, tz=timezone.utc),
+            access_hash=_hash(self.seed, 'hash', key) % 2 ** 63,
+            username=key,
+            broadcast=True,
+        )
+
+    async def iter_messages(self, entity, limit=None, min_id=0, offset_date=None, max_id=0):
+        """Newest first like Telethon: below `max_id` or `offset_date` down to `limit`, `min_id` or the first message"""
+        channel_id = getattr(entity, 'channel_id', None) or entity.id
+        interval = self._interval(channel_id)
+        before = offset_date.timestamp() if offset_date else self.options['now'] or time.time()
+
+        index = int((before - EPOCH) / interval)
+        while index >= 0 and self._date(channel_id, index, interval) >= before:
+            index -= 1
+        if max_id:
+            index = min(index, max_id - 2)
+
+        yielded = 0
+        while index >= 0 and index + 1 > min_id and (limit is None or yielded < limit):
+            if yielded % PAGE_SIZE == 0:
+                await self._request()
+            yield SimulatedMessage(index + 1, self._text(channel_id, index, interval),
+                                   datetime.fromtimestamp(self._date(channel_id, index, interval), tz=timezone.utc),
+                                   *self._engagement(channel_id, index))
+            yielded += 1
+            index -= 1
+
+    def _interval(self, channel_id):
+        # Channels differ in activity around the configured average
+        rate = self.options['rate'] * (0.5 + _fraction(self.seed, 'rate', channel_id))
+        return 3600 / max(rate, 1e-6)
+
+    def _date(self, channel_id, index, interval):
+        return EPOCH + (index + _fraction(self.seed, 'date', channel_id, index)) * interval
+
+    def _engagement(self, channel_id, index):
+        """(views, forwards, replies, reactions): channel audiences span 100x, posts are heavy-tailed within one"""
+        audience = 200 * 100 ** _fraction(self.seed, 'audience', channel_id)
+        views = int(audience * (1 - _fraction(self.seed, 'views', channel_id, index)) ** -0.5)
+        interest = _fraction(self.seed, 'interest', channel_id, index) ** 3
+        return (views, int(views * 0.02 * interest), int(views * 0.005 * interest),
+                int(views * 0.05 * interest))
+
+    def _text(self, channel_id, index, interval):
+        if _fraction(self.seed, 'media', channel_id, index) < self.options['media']:
+            return ''
+        text = self._body(channel_id, index, interval)
+        if _fraction(self.seed, 'footer', channel_id) < self.options['footers']:
+            name = self.vocabulary[_hash(self.seed, 'footer', channel_id) % len(self.vocabulary)]
+            text += f"\n\n👉 Subscribe to {name.capitalize()} News: https://t.me/{name}_news"
+        return text
+
+    def _body(self, channel_id, index, interval):
+        if _fraction(self.seed, 'dup', channel_id, index) < self.options['duplicates']:
+            # Reposts of one of a few stories per 10 minutes, with a channel-specific tag
+            bucket = int(self._date(channel_id, index, interval) // 600)
+            story = _hash(self.seed, 'story', channel_id, index) % 5
+            return f"{self._words('story', bucket, story)} #{self.vocabulary[channel_id % len(self.vocabulary)]}"
+
+        return self._words('message', channel_id, index)
+
+    def _words(self, *parts):
+        state = _hash(self.seed, *parts)
+        low, high = self.options['min_words'], self.options['max_words']
+        count = low + state % (high - low + 1)
+        words = []
+        for _ in range(count):
+            # xorshift64 keeps generation cheap at millions of messages
+            state ^= (state << 13) & 0xFFFFFFFFFFFFFFFF
+            state ^= state >> 7
+            state ^= (state << 17) & 0xFFFFFFFFFFFFFFFF
+            words.append(self.vocabulary[state % len(self.vocabulary)])
+        return ' '.join(words).capitalize() + '.'
+
+    async def _request(self):
+        self.requests += 1
+        latency = self.options['latency']
+        if latency > 0:
+            await asyncio.sleep(self.rng.expovariate(1000 / latency))
+        if self.rng.random() < self.options['flood']:
+            self.flood_waits += 1
+            raise FloodWaitError(request=None, capture=self.options['flood_seconds'])
+
+
+async def run_benchmark(channel_count, minutes_back, concurrency, options, rate_limit=None, accounts=1):
+    from account_pool import AccountPool
+    from rate_limiter import RateLimiter
+
+    async def connect(api_id, api_hash, phone):
+        client = SimulatedClient(phone, **options)
+        await client.connect()
+        return client
+
+    # Every simulated account sees the same channels, like real accounts do
+    pool = AccountPool(0, '', [f"sim-{i}" for i in range(accounts)], cache_entities=False, connect=connect)
+    await pool.connect()
+    if rate_limit:
+        for account in pool.accounts.values():
+            account.limiter = RateLimiter(rate=rate_limit, burst=rate_limit)
+
+    started = time.monotonic()
+    result = await pool.collect(simulated_channels(channel_count), minutes_back, concurrency=concurrency)
+    elapsed = time.monotonic() - started
+
+    clients = [account.client for account in pool.accounts.values()]
+    failed = [r for r in result['channels'] if r['status'] == 'error']
+    return {
+        'channels': channel_count,
+        'minutesBack': minutes_back,
+        'concurrency': concurrency,
+        'accounts': accounts,
+        'options': clients[0].options,
+        'elapsedSeconds': round(elapsed, 3),
+        'messages': result['total'],
+        'messagesPerSecond': round(result['total'] / elapsed, 1) if elapsed else None,
+        'channelsPerSecond': round(channel_count / elapsed, 1) if elapsed else None,
+        'requests': sum(client.requests for client in clients),
+        'floodWaits': sum(client.flood_waits for client in clients),
+        'failedChannels': len(failed),
+        'slowestChannelMs': max((r['elapsedMs'] for r in result['channels']), default=0),
     }
-    
-    message_id = 1
-    for channel in channels:
-        clean_channel = channel.replace('@', '').lower()
-        
-        # Select appropriate message set
-        channel_messages = news_messages  # default
-        for key, msgs in message_sets.items():
-            if key in clean_channel:
-                channel_messages = msgs
-                break
-        
-        # Generate 2-5 messages per channel
-        num_messages = random.randint(2, 5)
-        for i in range(num_messages):
-            message_time = random.randint(start_time, current_time)
-            message_text = random.choice(channel_messages)
-            
-            messages.append({
-                "id": message_id,
-                "text": message_text,
-                "date": message_time,
-                "channel": clean_channel,
-                "url": f"https://t.me/{clean_channel}/{message_id}"
-            })
-            message_id += 1
-    
-    # Sort by timestamp
-    messages.sort(key=lambda x: x['date'])
-    return messages
+
 
 def main():
-    """Main function to simulate telegram client"""
-    if len(sys.argv) < 5:
-        print(json.dumps({"error": "Usage: python telegram_simulator.py <api_id> <api_hash> <phone> <channels_json> [minutes_back]"}))
-        sys.exit(1)
-    
-    try:
-        # Parse arguments (we'll ignore credentials for simulation)
-        channels_json = sys.argv[4]
-        minutes_back = int(sys.argv[5]) if len(sys.argv) > 5 else 20
-        
-        channels = json.loads(channels_json)
-        
-        if not channels:
-            print(json.dumps([]))  # Empty array for no channels
-            return
-        
-        # Generate test messages
-        messages = generate_test_messages(channels, minutes_back)
-        
-        # Output as JSON
-        print(json.dumps(messages, ensure_ascii=False))
-        
-    except json.JSONDecodeError:
-        print(json.dumps({"error": "Invalid channels JSON format"}))
-        sys.exit(1)
-    except ValueError as e:
-        print(json.dumps({"error": f"Invalid parameter: {str(e)}"}))
-        sys.exit(1)
-    except Exception as e:
-        print(json.dumps({"error": f"Simulation error: {str(e)}"}))
-        sys.exit(1)
+    """Measure collector throughput against the simulator"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--minutes', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, default=8, help='Workers per account')
+    parser.add_argument('--accounts', type=int, default=1, help='Simulated accounts sharing the channels')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help="Requests per second for each account's limiter (default: the collector's)")
+    parser.add_argument('--spec', default='', help='Simulator options as key=value,...')
+    args = parser.parse_args()
+
+    # Collection progress goes to stderr, the summary is the only thing on stdout
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    summary = asyncio.run(run_benchmark(args.channels, args.minutes, args.concurrency, parse_spec(args.spec),
+                                        args.rate_limit, args.accounts))
+    out.write(json.dumps(summary, indent=2) + "\n")
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Backfill of windows larger than one walk, run against the simulator:
+concurrent time ranges must add up to exactly what a serial walk sees, a
+budget that runs out must leave a contiguous window, and the collection
+report must say so.
+"""
+
+import time
+import unittest
+
+from rate_limiter import RateLimiter
+from telegram_simple import FETCH_LIMIT, collect_messages, fetch_history, resolve_channel
+from telegram_simulator import SimulatedClient, parse_spec
+
+WINDOW = 12 * 3600
+
+
+class BackfillTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # Timelines frozen at `now`, so a walk doesn't see messages "posted" after an earlier one
+        now = int(time.time())
+        self.client = SimulatedClient('sim', **parse_spec(f'seed=3,rate=400,latency=0,now={now}'))
+        await self.client.connect()
+        self.limiter = RateLimiter(rate=1000, burst=1000)
+        self.cutoff = now - WINDOW
+        self.peer, _ = await resolve_channel(self.client, '@chan1', self.limiter, 30)
+
+    async def serial_walk(self):
+        messages = []
+        async for message in self.client.iter_messages(self.peer):
+            if message.date.timestamp() < self.cutoff:
+                break
+            if message.text:
+                messages.append(message)
+        return messages
+
+    async def test_matches_serial_walk(self):
+        expected = [m.id for m in await self.serial_walk()]
+        self.assertGreater(len(expected), 10 * FETCH_LIMIT)
+
+        messages, newest_id, _, stop = await fetch_history(
+            self.client, self.peer, '@chan1', self.cutoff, self.limiter, 30, backfill_limit=100000)
+        self.assertEqual(stop, 'cutoff')
+        self.assertEqual([m['id'] for m in messages], expected)
+        self.assertEqual(newest_id, expected[0])
+
+    async def test_ranges_run_concurrently(self):
+        self.client.options['latency'] = 5.0
+        in_flight = peak = 0
+        iter_messages = self.client.iter_messages
+
+        async def tracked(*args, **kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            try:
+                async for message in iter_messages(*args, **kwargs):
+                    yield message
+            finally:
+                in_flight -= 1
+
+        self.client.iter_messages = tracked
+        await fetch_history(self.client, self.peer, '@chan1', self.cutoff, self.limiter, 30, backfill_limit=100000)
+        self.assertGreater(peak, 1)
+
+    async def test_limit_leaves_contiguous_window(self):
+        expected = await self.serial_walk()
+        messages, _, oldest_date, stop = await fetch_history(
+            self.client, self.peer, '@chan1', self.cutoff, self.limiter, 30, backfill_limit=1000)
+        self.assertEqual(stop, 'limit')
+        self.assertLessEqual(len(messages), FETCH_LIMIT + 1000)
+
+        ids = [m['id'] for m in messages]
+        self.assertEqual(ids, sorted(set(ids), reverse=True))
+        # Everything from oldest_date on was collected, with no gap between ranges
+        contiguous = [m.id for m in expected if m.date.timestamp() >= oldest_date]
+        self.assertTrue(set(contiguous) <= set(ids))
+
+    async def test_without_backfill_stops_at_one_walk(self):
+        messages, _, _, stop = await fetch_history(self.client, self.peer, '@chan1', self.cutoff, self.limiter, 30)
+        self.assertEqual(stop, 'limit')
+        self.assertLessEqual(len(messages), FETCH_LIMIT)
+
+    async def test_report_completeness(self):
+        result = await collect_messages(self.client, ['chan1'], WINDOW // 60, limiter=self.limiter,
+                                        backfill_limit=100000)
+        report, = result['channels']
+        self.assertTrue(report['complete'])
+        self.assertNotIn('coveredSince', report)
+
+        result = await collect_messages(self.client, ['chan1'], WINDOW // 60, limiter=self.limiter,
+                                        backfill_limit=1000)
+        report, = result['channels']
+        self.assertFalse(report['complete'])
+        self.assertGreater(report['coveredSince'], self.cutoff)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+MinHash near-duplicate grouping: reposts and light rephrasings collapse into
+their earliest message, unrelated messages stay apart.
+"""
+
+import unittest
+
+from dedup import group_duplicates, minhash, normalize, shingles, similarity
+
+STORY = ("Officials confirmed on Tuesday that the northern bridge will stay closed for repairs "
+         "until the end of the month while engineers inspect the damaged supports")
+
+
+def message(id, channel, text, date, **engagement):
+    return {'id': id, 'channel': channel, 'text': text, 'date': date, **engagement}
+
+
+class GroupDuplicatesTest(unittest.TestCase):
+    def test_reposts_collapse_into_earliest(self):
+        messages = [
+            message(7, '@b', STORY + " https://t.me/b_news #bnews", 200, views=50, forwards=1),
+            message(3, '@a', STORY, 100, views=100, forwards=2),
+            message(9, '@c', "Officials CONFIRMED on Tuesday that the northern bridge will stay closed for repairs "
+                             "until the end of the month while engineers inspect the damaged supports!!", 300,
+                    views=10),
+        ]
+        group, = group_duplicates(messages)
+        self.assertEqual((group['id'], group['channel']), (3, '@a'))
+        self.assertEqual(group['duplicateCount'], 3)
+        self.assertEqual(group['sourceChannels'], ['@b', '@a', '@c'])
+        self.assertEqual(group['views'], 160)
+        self.assertEqual(group['forwards'], 3)
+        self.assertEqual(group['replies'], 0)
+
+    def test_light_rephrasing_is_grouped(self):
+        rephrased = STORY.replace("until the end of the month", "until the end of this month")
+        self.assertGreaterEqual(similarity(minhash(shingles(normalize(STORY))),
+                                           minhash(shingles(normalize(rephrased)))), 0.6)
+
+        groups = group_duplicates([message(1, '@a', STORY, 100), message(2, '@b', rephrased, 110)])
+        self.assertEqual([g['duplicateCount'] for g in groups], [2])
+
+    def test_unrelated_messages_stay_apart(self):
+        messages = [
+            message(1, '@a', STORY, 100, views=5),
+            message(2, '@b', "The central bank left interest rates unchanged and signalled no cuts before autumn", 110,
+                    views=7),
+            message(3, '@a', "Heavy snow is expected across the region this weekend with travel disruption likely", 120),
+        ]
+        groups = group_duplicates(messages)
+        self.assertEqual([g['id'] for g in groups], [1, 2, 3])
+        self.assertTrue(all(g['duplicateCount'] == 1 for g in groups))
+        self.assertEqual([g['sourceChannels'] for g in groups], [['@a'], ['@b'], ['@a']])
+        # Singletons keep their own engagement
+        self.assertEqual(groups[1]['views'], 7)
+
+    def test_short_and_empty_texts(self):
+        messages = [
+            message(1, '@a', "Breaking", 100),
+            message(2, '@b', "breaking!", 110),
+            message(3, '@c', "👇", 120),
+            message(4, '@d', "Breaking news", 130),
+        ]
+        groups = group_duplicates(messages)
+        self.assertEqual([(g['id'], g['duplicateCount']) for g in groups], [(1, 2), (3, 1), (4, 1)])
+
+    def test_texts_without_words_stay_apart(self):
+        messages = [
+            message(1, '@a', "👇", 100),
+            message(2, '@b', "https://t.me/foo/1", 110),
+            message(3, '@c', "🔥🔥 @someone", 120),
+            message(4, '@d', "🔥🔥", 130),
+        ]
+        groups = group_duplicates(messages)
+        self.assertEqual([(g['id'], g['duplicateCount']) for g in groups], [(1, 1), (2, 1), (3, 1), (4, 1)])
+
+    def test_signatures_are_reproducible(self):
+        signature = minhash(shingles(normalize(STORY)))
+        self.assertEqual(signature, minhash(shingles(normalize(STORY))))
+        self.assertEqual(similarity(signature, signature), 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Archive rowids, which the semantic index uses as its cursor: a pruned
+message's rowid must never be handed to a later message, including in
+archives created before rowids were AUTOINCREMENT.
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from message_store import MessageStore
+
+
+def message(id, date, text='The regional council approved the new transport budget'):
+    return {'channel': '@a', 'id': id, 'date': date, 'text': text}
+
+
+class RowidTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'messages.db')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_pruned_rowids_are_not_reused(self):
+        now = int(time.time())
+        store = MessageStore(self.path, retention=3600)
+        store.add_messages([message(1, now - 7200), message(2, now - 7200)])
+        cursor = store.max_rowid()
+        self.assertEqual(store.prune(), 2)
+
+        store.add_messages([message(3, now)])
+        self.assertEqual([row[2] for row in store.rows_after(cursor, 10)], [3])
+
+    def test_old_archive_keeps_its_rowids(self):
+        db = sqlite3.connect(self.path)
+        db.executescript("""
+            CREATE TABLE messages (
+                channel TEXT NOT NULL, id INTEGER NOT NULL, date INTEGER NOT NULL, text TEXT NOT NULL, url TEXT,
+                PRIMARY KEY (channel, id)
+            );
+            INSERT INTO messages VALUES ('@a', 1, 100, 'first post', NULL), ('@a', 2, 200, 'bridge closed', NULL),
+                                        ('@a', 3, 300, 'third post', NULL);
+            DELETE FROM messages WHERE id = 3;
+        """)
+        db.commit()
+        db.close()
+
+        store = MessageStore(self.path)
+        self.assertEqual([row[:3] for row in store.rows_after(0, 10)], [(1, '@a', 1), (2, '@a', 2)])
+        self.assertEqual(store.window('@a', 0)[0]['views'], 0)
+        self.assertEqual([m['id'] for m in store.search('bridge')], [2])
+
+        # Rowid 3 was pruned before the upgrade and may still be indexed
+        store.reserve_rowids(3)
+        store.add_messages([message(4, 400)])
+        self.assertEqual([row[0] for row in store.rows_after(2, 10)], [4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+"""
+Timing spans for the collection path.
+Stages are wrapped in `with span('resolve', channel=name) as labels:`; every
+finished span is passed to the sink installed with set_sink(), which the
+collector daemon uses to forward spans to the server. Labels can be added
+inside the block. Without a sink a span does nothing.
+"""
+
+import time
+from contextlib import contextmanager
+
+_sink = None
+
+
+def set_sink(sink):
+    global _sink
+    _sink = sink
+
+
+@contextmanager
+def span(name, **labels):
+    if _sink is None:
+        yield labels
+        return
+
+    started = time.perf_counter()
+    error = None
+    try:
+        yield labels
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _sink({
+            'name': name,
+            'durationMs': round((time.perf_counter() - started) * 1000, 3),
+            'labels': labels,
+            'error': error,
+        })
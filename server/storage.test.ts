@@ -0,0 +1,65 @@
+import { test } from "node:test";
+import assert from "node:assert/strict";
+import { MemStorage } from "./storage";
+
+// Analyses 1..8 started in a few bursts, several sharing the same startedAt, and not in id order
+const STARTED = [3000, 1000, 2000, 2000, 1000, 2000, 3000, 2000];
+
+async function seed(): Promise<MemStorage> {
+  const storage = new MemStorage();
+  for (const seconds of STARTED) {
+    const analysis = await storage.createAnalysis({});
+    await storage.updateAnalysis(analysis.id, { startedAt: new Date(seconds * 1000) });
+  }
+  return storage;
+}
+
+// Every analysis id, ordered by (startedAt, id)
+function ordered(): number[] {
+  return STARTED.map((seconds, index) => ({ seconds, id: index + 1 }))
+    .sort((a, b) => a.seconds - b.seconds || a.id - b.id)
+    .map(entry => entry.id);
+}
+
+test("listAnalyses pages newest first across equal startedAt values", async () => {
+  const storage = await seed();
+  const seen: number[] = [];
+  let beforeId: number | undefined;
+  for (;;) {
+    const page = await storage.listAnalyses(3, beforeId);
+    if (page.length === 0) break;
+    assert.ok(page.every(summary => !("report" in summary)));
+    seen.push(...page.map(summary => summary.id));
+    beforeId = page[page.length - 1].id;
+  }
+  assert.deepEqual(seen, ordered().reverse());
+});
+
+test("exportAnalyses pages oldest first across equal startedAt values", async () => {
+  const storage = await seed();
+  const seen: number[] = [];
+  let afterId: number | undefined;
+  for (;;) {
+    const page = await storage.exportAnalyses(2, afterId);
+    if (page.length === 0) break;
+    seen.push(...page.map(analysis => analysis.id));
+    afterId = page[page.length - 1].id;
+  }
+  assert.deepEqual(seen, ordered());
+});
+
+test("exportAnalyses bounds startedAt to [from, to)", async () => {
+  const storage = await seed();
+  const range = { from: new Date(2000 * 1000), to: new Date(3000 * 1000) };
+  const first = await storage.exportAnalyses(3, undefined, range);
+  const rest = await storage.exportAnalyses(3, first[first.length - 1].id, range);
+  assert.deepEqual([...first, ...rest].map(analysis => analysis.id), [3, 4, 6, 8]);
+});
+
+test("a deleted analysis leaves the order intact", async () => {
+  const storage = await seed();
+  await storage.deleteAnalysis(4);
+  const page = await storage.listAnalyses(10);
+  assert.deepEqual(page.map(summary => summary.id), ordered().reverse().filter(id => id !== 4));
+  assert.deepEqual(await storage.listAnalyses(10, 4), []);
+});
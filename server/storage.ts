@@ -3,18 +3,25 @@ import {
   analyses, 
   statistics,
   users,
+  jobs,
   type Configuration, 
   type InsertConfiguration,
   type Analysis,
+  type AnalysisSummary,
+  type ReportSearchHit,
   type InsertAnalysis,
   type Statistics,
   type InsertStatistics,
   type User,
-  type InsertUser
+  type InsertUser,
+  type Job,
+  type InsertJob,
+  reportSearchVector,
 } from "@shared/schema";
 import { neon } from "@neondatabase/serverless";
 import { drizzle } from "drizzle-orm/neon-http";
-import { eq, desc } from "drizzle-orm";
+import { eq, desc, asc, and, or, gte, lt, isNull, inArray, sql, getTableColumns } from "drizzle-orm";
+import { dbQueryDuration } from "./services/metrics";
 
 export interface IStorage {
   // Configuration methods
@@ -25,9 +32,15 @@ export interface IStorage {
   // Analysis methods
   getAnalysis(id: number): Promise<Analysis | undefined>;
   getLatestAnalysis(): Promise<Analysis | undefined>;
-  getAllAnalyses(): Promise<Analysis[]>;
+  // Newest first, without reports; `beforeId` continues after that analysis
+  listAnalyses(limit: number, beforeId?: number): Promise<AnalysisSummary[]>;
+  // Oldest first with reports, for exports; `afterId` continues after that analysis, `range` bounds startedAt
+  exportAnalyses(limit: number, afterId?: number, range?: { from?: Date; to?: Date }): Promise<Analysis[]>;
+  // Reports matching a full-text query over topic names and briefings, best match first
+  searchReports(query: string, limit: number, offset: number): Promise<ReportSearchHit[]>;
   createAnalysis(analysis: InsertAnalysis): Promise<Analysis>;
   updateAnalysis(id: number, updates: Partial<Analysis>): Promise<Analysis>;
+  deleteAnalysis(id: number): Promise<void>;
   
   // Statistics methods
   getStatistics(): Promise<Statistics | undefined>;
@@ -37,27 +50,47 @@ export interface IStorage {
   getUserByUsername(username: string): Promise<User | undefined>;
   createUser(user: InsertUser): Promise<User>;
   updateUserLastLogin(id: number): Promise<User>;
+  
+  // Job methods
+  // Undefined when an identical job (same dedup key) is already pending or running
+  createJob(job: InsertJob): Promise<Job | undefined>;
+  getJob(id: number): Promise<Job | undefined>;
+  getActiveJob(dedupKey: string): Promise<Job | undefined>;
+  // Oldest pending job, marked running and leased to `workerId`
+  claimNextJob(workerId: string): Promise<Job | undefined>;
+  updateJob(id: number, updates: Partial<Job>): Promise<Job>;
+  // Renew the lease on the jobs `workerId` is still running
+  heartbeatJobs(workerId: string, ids: number[]): Promise<void>;
+  // Running jobs whose worker's last heartbeat is older than `staleBefore`, put back to pending
+  requeueInterruptedJobs(staleBefore: Date): Promise<Job[]>;
 }
 
 export class MemStorage implements IStorage {
   private configurations: Map<number, Configuration>;
   private analyses: Map<number, Analysis>;
+  // Analysis ids ordered by (startedAt, id), kept sorted on insert instead of sorting per read
+  private analysisOrder: number[];
   private statistics: Map<number, Statistics>;
   private users: Map<number, User>;
+  private jobs: Map<number, Job>;
   private currentConfigId: number;
   private currentAnalysisId: number;
   private currentStatsId: number;
   private currentUserId: number;
+  private currentJobId: number;
 
   constructor() {
     this.configurations = new Map();
     this.analyses = new Map();
+    this.analysisOrder = [];
     this.statistics = new Map();
     this.users = new Map();
+    this.jobs = new Map();
     this.currentConfigId = 1;
     this.currentAnalysisId = 1;
     this.currentStatsId = 1;
     this.currentUserId = 1;
+    this.currentJobId = 1;
     
     // Initialize default statistics
     this.statistics.set(1, {
@@ -80,6 +113,7 @@ export class MemStorage implements IStorage {
       telegramApiId: config.telegramApiId,
       telegramApiHash: config.telegramApiHash,
       telegramPhone: config.telegramPhone,
+      additionalPhones: config.additionalPhones || [],
       openaiApiKey: config.openaiApiKey,
       channels: config.channels || [],
       promptTemplate: config.promptTemplate || "Analyze the following Telegram messages and generate a concise intelligence report. Focus on key topics, events, and significant developments. Provide clear, factual briefings without sentiment analysis.",
@@ -111,14 +145,98 @@ export class MemStorage implements IStorage {
   }
 
   async getLatestAnalysis(): Promise<Analysis | undefined> {
-    const allAnalyses = Array.from(this.analyses.values());
-    return allAnalyses.sort((a, b) => new Date(b.startedAt!).getTime() - new Date(a.startedAt!).getTime())[0];
+    const id = this.analysisOrder[this.analysisOrder.length - 1];
+    return id === undefined ? undefined : this.analyses.get(id);
   }
 
-  async getAllAnalyses(): Promise<Analysis[]> {
-    return Array.from(this.analyses.values()).sort((a, b) => 
-      new Date(b.startedAt!).getTime() - new Date(a.startedAt!).getTime()
-    );
+  async listAnalyses(limit: number, beforeId?: number): Promise<AnalysisSummary[]> {
+    let end = this.analysisOrder.length;
+    if (beforeId !== undefined) {
+      const before = this.analyses.get(beforeId);
+      if (!before) {
+        return [];
+      }
+      end = this.orderPosition(before);
+    }
+    
+    const page: AnalysisSummary[] = [];
+    for (let i = end - 1; i >= 0 && page.length < limit; i--) {
+      const { report, ...summary } = this.analyses.get(this.analysisOrder[i])!;
+      page.push(summary);
+    }
+    return page;
+  }
+
+  async exportAnalyses(limit: number, afterId?: number, range: { from?: Date; to?: Date } = {}): Promise<Analysis[]> {
+    let start = 0;
+    if (afterId !== undefined) {
+      const after = this.analyses.get(afterId);
+      if (!after) {
+        return [];
+      }
+      start = this.orderPosition(after) + 1;
+    }
+    
+    const page: Analysis[] = [];
+    for (let i = start; i < this.analysisOrder.length && page.length < limit; i++) {
+      const analysis = this.analyses.get(this.analysisOrder[i])!;
+      const startedAt = analysis.startedAt!.getTime();
+      if (range.to && startedAt >= range.to.getTime()) break;
+      if (range.from && startedAt < range.from.getTime()) continue;
+      page.push(analysis);
+    }
+    return page;
+  }
+
+  async searchReports(query: string, limit: number, offset: number): Promise<ReportSearchHit[]> {
+    const terms = searchTerms(query);
+    if (terms.length === 0) {
+      return [];
+    }
+    
+    const hits: ReportSearchHit[] = [];
+    for (let i = this.analysisOrder.length - 1; i >= 0; i--) {
+      const analysis = this.analyses.get(this.analysisOrder[i])!;
+      const topics: Array<{ topic?: string; briefing?: string }> = (analysis.report as any)?.topics || [];
+      const topicWords = new Set(topics.flatMap(t => searchTerms(t.topic || "")));
+      const briefingWords = new Set(topics.flatMap(t => searchTerms(t.briefing || "")));
+      if (!terms.every(term => topicWords.has(term) || briefingWords.has(term))) {
+        continue;
+      }
+      // Same weighting as the Postgres index: topic names count more than briefings
+      const rank = terms.reduce((sum, term) => sum + (topicWords.has(term) ? 1 : 0) + (briefingWords.has(term) ? 0.4 : 0), 0);
+      const briefing = topics.map(t => t.briefing || "").find(text => searchTerms(text).some(word => terms.includes(word))) || "";
+      hits.push({
+        id: analysis.id,
+        startedAt: analysis.startedAt,
+        completedAt: analysis.completedAt,
+        messagesCollected: analysis.messagesCollected,
+        channelsProcessed: analysis.channelsProcessed,
+        topics: topics.map(t => t.topic || ""),
+        headline: briefing.substring(0, 200),
+        rank,
+      });
+    }
+    // Stable sort keeps newest first among equal ranks
+    return hits.sort((a, b) => b.rank - a.rank).slice(offset, offset + limit);
+  }
+
+  // Index of the first entry in analysisOrder that sorts at or after `analysis`
+  private orderPosition(analysis: Analysis): number {
+    const key = analysis.startedAt!.getTime();
+    let low = 0;
+    let high = this.analysisOrder.length;
+    while (low < high) {
+      const mid = (low + high) >>> 1;
+      const other = this.analyses.get(this.analysisOrder[mid])!;
+      const otherKey = other.startedAt!.getTime();
+      if (otherKey < key || (otherKey === key && other.id < analysis.id)) {
+        low = mid + 1;
+      } else {
+        high = mid;
+      }
+    }
+    return low;
   }
 
   async createAnalysis(analysis: InsertAnalysis): Promise<Analysis> {
@@ -137,9 +255,19 @@ export class MemStorage implements IStorage {
       completedAt: null,
     };
     this.analyses.set(id, newAnalysis);
+    // Normally an append: new analyses start last
+    this.analysisOrder.splice(this.orderPosition(newAnalysis), 0, id);
     return newAnalysis;
   }
 
+  async deleteAnalysis(id: number): Promise<void> {
+    const existing = this.analyses.get(id);
+    if (existing) {
+      this.analysisOrder.splice(this.orderPosition(existing), 1);
+      this.analyses.delete(id);
+    }
+  }
+
   async updateAnalysis(id: number, updates: Partial<Analysis>): Promise<Analysis> {
     const existing = this.analyses.get(id);
     if (!existing) {
@@ -150,7 +278,15 @@ export class MemStorage implements IStorage {
       ...existing,
       ...updates,
     };
+    
+    const moved = updated.startedAt?.getTime() !== existing.startedAt?.getTime();
+    if (moved) {
+      this.analysisOrder.splice(this.orderPosition(existing), 1);
+    }
     this.analyses.set(id, updated);
+    if (moved) {
+      this.analysisOrder.splice(this.orderPosition(updated), 0, id);
+    }
     return updated;
   }
 
@@ -205,6 +341,89 @@ export class MemStorage implements IStorage {
     this.users.set(id, updated);
     return updated;
   }
+
+  // Job methods
+  async createJob(job: InsertJob): Promise<Job | undefined> {
+    // Checked and inserted without yielding, like the unique index does in Postgres
+    if (this.activeJob(job.dedupKey)) {
+      return undefined;
+    }
+    const id = this.currentJobId++;
+    const newJob: Job = {
+      id,
+      type: job.type,
+      dedupKey: job.dedupKey,
+      payload: job.payload,
+      status: "pending",
+      attempts: 0,
+      error: null,
+      createdAt: new Date(),
+      startedAt: null,
+      completedAt: null,
+      lockedBy: null,
+      heartbeatAt: null,
+    };
+    this.jobs.set(id, newJob);
+    return newJob;
+  }
+
+  async getJob(id: number): Promise<Job | undefined> {
+    return this.jobs.get(id);
+  }
+
+  async getActiveJob(dedupKey: string): Promise<Job | undefined> {
+    return this.activeJob(dedupKey);
+  }
+
+  private activeJob(dedupKey: string): Job | undefined {
+    return Array.from(this.jobs.values()).find(job => 
+      job.dedupKey === dedupKey && (job.status === "pending" || job.status === "running")
+    );
+  }
+
+  async claimNextJob(workerId: string): Promise<Job | undefined> {
+    // Map iteration follows insertion order, so the first pending job is the oldest
+    const next = Array.from(this.jobs.values()).find(job => job.status === "pending");
+    if (!next) {
+      return undefined;
+    }
+    const now = new Date();
+    return this.updateJob(next.id, { status: "running", attempts: next.attempts + 1, startedAt: now, lockedBy: workerId, heartbeatAt: now });
+  }
+
+  async updateJob(id: number, updates: Partial<Job>): Promise<Job> {
+    const existing = this.jobs.get(id);
+    if (!existing) {
+      throw new Error("Job not found");
+    }
+    
+    const updated: Job = {
+      ...existing,
+      ...updates,
+    };
+    this.jobs.set(id, updated);
+    return updated;
+  }
+
+  async heartbeatJobs(workerId: string, ids: number[]): Promise<void> {
+    const now = new Date();
+    for (const id of ids) {
+      const job = this.jobs.get(id);
+      if (job?.status === "running" && job.lockedBy === workerId) {
+        this.jobs.set(id, { ...job, heartbeatAt: now });
+      }
+    }
+  }
+
+  async requeueInterruptedJobs(staleBefore: Date): Promise<Job[]> {
+    const interrupted: Job[] = [];
+    for (const job of Array.from(this.jobs.values())) {
+      if (job.status === "running" && (!job.heartbeatAt || job.heartbeatAt < staleBefore)) {
+        interrupted.push(await this.updateJob(job.id, { status: "pending", startedAt: null, lockedBy: null, heartbeatAt: null }));
+      }
+    }
+    return interrupted;
+  }
 }
 
 export class PostgreSQLStorage implements IStorage {
@@ -248,13 +467,57 @@ export class PostgreSQLStorage implements IStorage {
 
   async getLatestAnalysis(): Promise<Analysis | undefined> {
     const results = await this.db.select().from(analyses)
-      .orderBy(desc(analyses.startedAt))
+      .orderBy(desc(analyses.startedAt), desc(analyses.id))
       .limit(1);
     return results[0];
   }
 
-  async getAllAnalyses(): Promise<Analysis[]> {
-    return await this.db.select().from(analyses).orderBy(desc(analyses.startedAt));
+  async listAnalyses(limit: number, beforeId?: number): Promise<AnalysisSummary[]> {
+    const { report, ...summaryColumns } = getTableColumns(analyses);
+    // Seek past the cursor row on the (started_at, id) index; comparing against the stored
+    // value keeps full timestamp precision, which a round trip through a JS Date would lose
+    const seek = beforeId === undefined ? undefined : sql`(${analyses.startedAt}, ${analyses.id}) < (
+      SELECT ${analyses.startedAt}, ${analyses.id} FROM ${analyses} WHERE ${analyses.id} = ${beforeId}
+    )`;
+    return await this.db.select(summaryColumns).from(analyses)
+      .where(seek)
+      .orderBy(desc(analyses.startedAt), desc(analyses.id))
+      .limit(limit);
+  }
+
+  async exportAnalyses(limit: number, afterId?: number, range: { from?: Date; to?: Date } = {}): Promise<Analysis[]> {
+    // Same seek as listAnalyses, in the other direction
+    const seek = afterId === undefined ? undefined : sql`(${analyses.startedAt}, ${analyses.id}) > (
+      SELECT ${analyses.startedAt}, ${analyses.id} FROM ${analyses} WHERE ${analyses.id} = ${afterId}
+    )`;
+    return await this.db.select().from(analyses)
+      .where(and(
+        seek,
+        range.from ? gte(analyses.startedAt, range.from) : undefined,
+        range.to ? lt(analyses.startedAt, range.to) : undefined,
+      ))
+      .orderBy(asc(analyses.startedAt), asc(analyses.id))
+      .limit(limit);
+  }
+
+  async searchReports(query: string, limit: number, offset: number): Promise<ReportSearchHit[]> {
+    const tsquery = sql`websearch_to_tsquery('simple', ${query})`;
+    const rank = sql<number>`ts_rank_cd(${reportSearchVector}, ${tsquery})`;
+    return await this.db.select({
+      id: analyses.id,
+      startedAt: analyses.startedAt,
+      completedAt: analyses.completedAt,
+      messagesCollected: analyses.messagesCollected,
+      channelsProcessed: analyses.channelsProcessed,
+      topics: sql<string[]>`array(select jsonb_array_elements_text(jsonb_path_query_array(${analyses.report}, '$.topics[*].topic')))`,
+      // Only computed for the rows of the page
+      headline: sql<string>`ts_headline('simple', coalesce((select string_agg(topic->>'briefing', ' ') from jsonb_array_elements(${analyses.report}->'topics') topic), ''), ${tsquery}, 'MaxFragments=2, MinWords=8, MaxWords=25, StartSel=«, StopSel=»')`,
+      rank,
+    }).from(analyses)
+      .where(sql`${reportSearchVector} @@ ${tsquery}`)
+      .orderBy(desc(rank), desc(analyses.startedAt), desc(analyses.id))
+      .limit(limit)
+      .offset(offset);
   }
 
   async createAnalysis(analysis: InsertAnalysis): Promise<Analysis> {
@@ -273,6 +536,10 @@ export class PostgreSQLStorage implements IStorage {
     return result;
   }
 
+  async deleteAnalysis(id: number): Promise<void> {
+    await this.db.delete(analyses).where(eq(analyses.id, id));
+  }
+
   // Statistics methods
   async getStatistics(): Promise<Statistics | undefined> {
     const results = await this.db.select().from(statistics).limit(1);
@@ -324,7 +591,83 @@ export class PostgreSQLStorage implements IStorage {
     }
     return result;
   }
+
+  // Job methods
+  async createJob(job: InsertJob): Promise<Job | undefined> {
+    // The unique index on active dedup keys turns a concurrent duplicate into no row
+    const [result] = await this.db.insert(jobs).values(job).onConflictDoNothing().returning();
+    return result;
+  }
+
+  async getJob(id: number): Promise<Job | undefined> {
+    const results = await this.db.select().from(jobs).where(eq(jobs.id, id));
+    return results[0];
+  }
+
+  async getActiveJob(dedupKey: string): Promise<Job | undefined> {
+    const results = await this.db.select().from(jobs)
+      .where(and(eq(jobs.dedupKey, dedupKey), inArray(jobs.status, ["pending", "running"])))
+      .orderBy(asc(jobs.id))
+      .limit(1);
+    return results[0];
+  }
+
+  async claimNextJob(workerId: string): Promise<Job | undefined> {
+    // SKIP LOCKED lets several server processes share the queue without claiming the same job
+    const now = new Date();
+    const [result] = await this.db.update(jobs)
+      .set({ status: "running", attempts: sql`${jobs.attempts} + 1`, startedAt: now, lockedBy: workerId, heartbeatAt: now })
+      .where(eq(jobs.id, sql`(SELECT ${jobs.id} FROM ${jobs} WHERE ${jobs.status} = 'pending' ORDER BY ${jobs.id} LIMIT 1 FOR UPDATE SKIP LOCKED)`))
+      .returning();
+    return result;
+  }
+
+  async updateJob(id: number, updates: Partial<Job>): Promise<Job> {
+    const [result] = await this.db.update(jobs)
+      .set(updates)
+      .where(eq(jobs.id, id))
+      .returning();
+    if (!result) {
+      throw new Error("Job not found");
+    }
+    return result;
+  }
+
+  async heartbeatJobs(workerId: string, ids: number[]): Promise<void> {
+    if (ids.length === 0) {
+      return;
+    }
+    await this.db.update(jobs)
+      .set({ heartbeatAt: new Date() })
+      .where(and(inArray(jobs.id, ids), eq(jobs.status, "running"), eq(jobs.lockedBy, workerId)));
+  }
+
+  async requeueInterruptedJobs(staleBefore: Date): Promise<Job[]> {
+    // Jobs other live processes are running keep a fresh heartbeat and are left alone
+    return await this.db.update(jobs)
+      .set({ status: "pending", startedAt: null, lockedBy: null, heartbeatAt: null })
+      .where(and(eq(jobs.status, "running"), or(isNull(jobs.heartbeatAt), lt(jobs.heartbeatAt, staleBefore))))
+      .returning();
+  }
+}
+
+// Lowercased words of a text, for the in-memory report search
+function searchTerms(text: string): string[] {
+  return text.toLowerCase().match(/[\p{L}\p{N}]+/gu) || [];
+}
+
+// Record the latency of every storage call, labelled by method
+function withQueryTiming(target: IStorage): IStorage {
+  return new Proxy(target, {
+    get(obj, prop, receiver) {
+      const value = Reflect.get(obj, prop, receiver);
+      if (typeof value !== "function") {
+        return value;
+      }
+      return (...args: any[]) => dbQueryDuration.time({ method: String(prop) }, () => value.apply(obj, args));
+    },
+  });
 }
 
 // Use PostgreSQL storage in production, fallback to memory storage for development
-export const storage = process.env.DATABASE_URL ? new PostgreSQLStorage() : new MemStorage();
+export const storage = withQueryTiming(process.env.DATABASE_URL ? new PostgreSQLStorage() : new MemStorage());
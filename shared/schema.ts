@@ -1,4 +1,5 @@
-import { pgTable, text, serial, integer, boolean, timestamp, jsonb } from "drizzle-orm/pg-core";
+import { pgTable, text, serial, integer, boolean, timestamp, jsonb, index, uniqueIndex } from "drizzle-orm/pg-core";
+import { sql } from "drizzle-orm";
 import { createInsertSchema } from "drizzle-zod";
 import { z } from "zod";
 
@@ -7,6 +8,8 @@ export const configurations = pgTable("configurations", {
   telegramApiId: text("telegram_api_id").notNull(),
   telegramApiHash: text("telegram_api_hash").notNull(),
   telegramPhone: text("telegram_phone").notNull(),
+  // More authenticated accounts on the same API credentials; channels are sharded across all of them
+  additionalPhones: text("additional_phones").array().notNull().default([]),
   openaiApiKey: text("openai_api_key").notNull(),
   channels: text("channels").array().notNull().default([]),
   promptTemplate: text("prompt_template").notNull().default("Analyze the following Telegram messages and generate a concise intelligence report. Focus on key topics, events, and significant developments. Provide clear, factual briefings without sentiment analysis."),
@@ -15,6 +18,10 @@ export const configurations = pgTable("configurations", {
   updatedAt: timestamp("updated_at").defaultNow(),
 });
 
+// Full-text document of a report: topic names (weight A) and briefings (weight B).
+// Searches must use this exact expression for Postgres to use the GIN index on it.
+export const reportSearchVector = sql`(setweight(to_tsvector('simple', coalesce(jsonb_path_query_array(report, '$.topics[*].topic')::text, '')), 'A') || setweight(to_tsvector('simple', coalesce(jsonb_path_query_array(report, '$.topics[*].briefing')::text, '')), 'B'))`;
+
 export const analyses = pgTable("analyses", {
   id: serial("id").primaryKey(),
   configId: integer("config_id").references(() => configurations.id),
@@ -27,7 +34,11 @@ export const analyses = pgTable("analyses", {
   error: text("error"),
   startedAt: timestamp("started_at").defaultNow(),
   completedAt: timestamp("completed_at"),
-});
+}, (table) => [
+  // Newest-first history pages seek on (started_at, id)
+  index("analyses_started_at_idx").on(table.startedAt, table.id),
+  index("analyses_report_search_idx").using("gin", reportSearchVector),
+]);
 
 export const statistics = pgTable("statistics", {
   id: serial("id").primaryKey(),
@@ -46,6 +57,26 @@ export const users = pgTable("users", {
   lastLogin: timestamp("last_login"),
 });
 
+export const jobs = pgTable("jobs", {
+  id: serial("id").primaryKey(),
+  type: text("type").notNull(), // analysis
+  dedupKey: text("dedup_key").notNull(),
+  payload: jsonb("payload").notNull(),
+  status: text("status").notNull().default("pending"), // pending, running, completed, failed
+  attempts: integer("attempts").notNull().default(0),
+  error: text("error"),
+  createdAt: timestamp("created_at").defaultNow(),
+  startedAt: timestamp("started_at"),
+  completedAt: timestamp("completed_at"),
+  // Process running the job and its last sign of life; a stale heartbeat means the process died
+  lockedBy: text("locked_by"),
+  heartbeatAt: timestamp("heartbeat_at"),
+}, (table) => [
+  index("jobs_status_idx").on(table.status),
+  // At most one pending or running job per dedup key, enforced even for concurrent requests
+  uniqueIndex("jobs_active_dedup_key_idx").on(table.dedupKey).where(sql`${table.status} in ('pending', 'running')`),
+]);
+
 export const insertConfigurationSchema = createInsertSchema(configurations).omit({
   id: true,
   createdAt: true,
@@ -68,6 +99,12 @@ export const insertUserSchema = createInsertSchema(users).omit({
   lastLogin: true,
 });
 
+export const insertJobSchema = createInsertSchema(jobs).pick({
+  type: true,
+  dedupKey: true,
+  payload: true,
+});
+
 export const loginSchema = z.object({
   username: z.string().min(1, "Username is required"),
   password: z.string().min(1, "Password is required"),
@@ -77,8 +114,18 @@ export type InsertConfiguration = z.infer<typeof insertConfigurationSchema>;
 export type Configuration = typeof configurations.$inferSelect;
 export type InsertAnalysis = z.infer<typeof insertAnalysisSchema>;
 export type Analysis = typeof analyses.$inferSelect;
+// History list rows leave out the report body
+export type AnalysisSummary = Omit<Analysis, "report">;
+// A report matching a full-text search, with its topic names and the briefing passages that matched
+export type ReportSearchHit = Pick<Analysis, "id" | "startedAt" | "completedAt" | "messagesCollected" | "channelsProcessed"> & {
+  topics: string[];
+  headline: string;
+  rank: number;
+};
 export type InsertStatistics = z.infer<typeof insertStatisticsSchema>;
 export type Statistics = typeof statistics.$inferSelect;
 export type InsertUser = z.infer<typeof insertUserSchema>;
 export type User = typeof users.$inferSelect;
+export type InsertJob = z.infer<typeof insertJobSchema>;
+export type Job = typeof jobs.$inferSelect;
 export type LoginRequest = z.infer<typeof loginSchema>;